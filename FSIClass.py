@@ -141,7 +141,7 @@ class FSI(object):
             
         # Determine the load conditons from the fluid solver
         # Calculate the panel lengths and normal vectors
-        (nx,nz,lp) = panel_vectors(Body.AF.x,Body.AF.z)[2:5]
+        (nx,nz,lp) = (Body.geom.nx, Body.geom.nz, Body.geom.lpanel)
         
         # Calculate the force magnitude acting on the panel due to pressure,
         # then calculate the x-z components of this force
@@ -242,7 +242,7 @@ class FSI(object):
             
         # Determine the load conditons from the fluid solver
         # Calculate the panel lengths and normal vectors
-        (nx,nz,lp) = panel_vectors(Body.AF.x,Body.AF.z)[2:5]
+        (nx,nz,lp) = (Body.geom.nx, Body.geom.nz, Body.geom.lpanel)
         
         # Calculate the force magnitude acting on the panel due to pressure,
         # then calculate the x-z components of this force
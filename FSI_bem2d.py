@@ -21,6 +21,7 @@ from SolidClass import solid
 from PyFEA import PyFEA
 from FSIClass import FSI
 from functions_general import archive, absoluteToBody, simulation_startup
+from functions_influence import SCHOOL
 
 # Turn on SIGFPE handling
 np.seterr(all='raise')
@@ -51,17 +52,20 @@ for i in xrange(START_COUNTER, COUNTER):
     if i == 0:
         for Swim in Swimmers:
             Swim.Body.free_swimming(P, i)
-            Swim.Body.panel_positions(P, i)
-            Swim.Body.surface_kinematics(P, i)
+        SCHOOL.panel_positions(Swimmers, P, i)
+        SCHOOL.surface_kinematics(Swimmers, P, i)
+        for Swim in Swimmers:
             Swim.edge_shed(DEL_T, i)
             Swim.wake_shed(DEL_T, i)
+            Swim.wake_amalgamate(P, i)
+            Swim.wake_particles(P, i)
+            Swim.wake_truncate(P, i)
         solve_phi(Swimmers, P, i, outerCorr)
-        for Swim in Swimmers:        
-            Swim.Body.force(P, i)
+        SCHOOL.force(Swimmers, P, i)
             
         wake_rollup(Swimmers, DEL_T, i, P)
-        archive(Swimmers[0].Body.AF.x_mid)
-        archive(Swimmers[0].Body.AF.z_mid)
+        archive(Swimmers[0].Body.AF.x_mid_hist)
+        archive(Swimmers[0].Body.AF.z_mid_hist)
         SolidL[0].updateSolid(P['THETA'][i])
         graph.plot_n_go(Swimmers, i, P)
         DIO.write_data(P, i, DEL_T, SwiL, GeoL, MotL, Swimmers, SolidL, FSIL, PyFEAL)
@@ -76,22 +80,26 @@ for i in xrange(START_COUNTER, COUNTER):
         while True:
             outerCorr += 1
             FSIL[0].setInterfaceDisplacemet(outerCorr, COUPLING_SCHEME)
-            for Swim in Swimmers:
-                if (outerCorr == 1):
+            if (outerCorr == 1):
+                for Swim in Swimmers:
                     Swim.Body.free_swimming(P, i)
-                    Swim.Body.panel_positions(P, i)
-                else:
+                SCHOOL.panel_positions(Swimmers, P, i)
+            else:
+                for Swim in Swimmers:
                     Swim.Body.fsi_panel_positions(FSIL[0], P, i)
-                    
-                Swim.Body.surface_kinematics(P, i)
+
+            SCHOOL.surface_kinematics(Swimmers, P, i)
+            for Swim in Swimmers:
                 Swim.edge_shed(DEL_T, i)
                 if (outerCorr == 1):
                     Swim.wake_shed(DEL_T, i)
+                    Swim.wake_amalgamate(P, i)
+                    Swim.wake_particles(P, i)
+                    Swim.wake_truncate(P, i)
                       
             solve_phi(Swimmers, P, i, outerCorr)
             
-            for Swim in Swimmers:        
-                Swim.Body.force(P, i)
+            SCHOOL.force(Swimmers, P, i)
                 
 
             #TODO: Replace '0' with viscous drag component when available
@@ -113,8 +121,8 @@ for i in xrange(START_COUNTER, COUNTER):
                     po().solution_complete_output(i/float(COUNTER-1)*100.)
                 wake_rollup(Swimmers, DEL_T, i, P)
                 absoluteToBody(Swimmers[0].Body, SolidL[0], P, i)
-                archive(Swimmers[0].Body.AF.x_mid)
-                archive(Swimmers[0].Body.AF.z_mid)
+                archive(Swimmers[0].Body.AF.x_mid_hist)
+                archive(Swimmers[0].Body.AF.z_mid_hist)
                 graph.plot_n_go(Swimmers, i, P)
                 DIO.write_data(P, i, DEL_T, SwiL, GeoL, MotL, Swimmers, SolidL, FSIL, PyFEAL)
                 break
@@ -0,0 +1,371 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+BEM-2D
+A 2D boundary element method code
+
+"""
+import numpy as np
+from scipy.special import comb
+
+# Requested precision for each iprec value (same scale as FMMLIB2D)
+FMM_EPS = {-2: 0.5, -1: 0.5e-1, 0: 0.5e-2, 1: 0.5e-3, 2: 0.5e-6, 3: 0.5e-9, 4: 0.5e-12, 5: 0.5e-15}
+
+# Child cell centers relative to their parent, in units of the child's half width
+QUADRANT_OFFSETS = np.array([-1-1j, 1-1j, -1+1j, 1+1j])
+
+# Translation operators of each expansion order, built once per process
+OPERATORS = {}
+
+def translation_operators(order):
+    """
+    Builds the multipole-to-multipole, multipole-to-local and local-to-local
+    translation matrices of FMM2D for an expansion order. Expansions are
+    scaled by their cell's half width h (multipole coefficient k by h**-k,
+    local coefficient l by h**l), which makes the matrices the same on every
+    level apart from the log(h) term of the local expansions.
+
+    Args:
+        order (int): Number of terms kept in the expansions.
+
+    Returns:
+        m2m (list): Child to parent multipole matrices, one per quadrant.
+        l2l (list): Parent to child local matrices, one per quadrant.
+        m2l (dict): Multipole to local matrices for each well separated
+            cell offset.
+    """
+    p = order
+    k = np.arange(p+1)
+
+    # Multipole-to-multipole, child to parent (Greengard & Rokhlin lemma 2.3)
+    m2m = []
+    for t in QUADRANT_OFFSETS:
+        M = np.zeros((p+1, p+1), dtype=complex)
+        M[0,0] = 1.
+        for l in xrange(1, p+1):
+            M[l,0] = -t**l / l
+            M[l,1:l+1] = comb(l-1, k[1:l+1]-1) * t**(l-k[1:l+1])
+            M[l] /= 2.**l
+        m2m.append(M)
+
+    # Local-to-local, parent to child
+    l2l = []
+    for t in QUADRANT_OFFSETS:
+        M = np.zeros((p+1, p+1), dtype=complex)
+        for m in xrange(p+1):
+            M[m,m:] = comb(k[m:], m) * t**(k[m:]-m) / 2.**k[m:]
+        l2l.append(M)
+
+    # Multipole-to-local for every well separated offset (lemma 2.4)
+    m2l = {}
+    for dx in xrange(-3, 4):
+        for dz in xrange(-3, 4):
+            if max(abs(dx), abs(dz)) < 2:
+                continue
+            s = 2.*(dx + 1j*dz)
+            M = np.zeros((p+1, p+1), dtype=complex)
+            M[0,0] = np.log(-s)
+            M[0,1:] = (-1.)**k[1:] / s**k[1:]
+            for l in xrange(1, p+1):
+                M[l,0] = -1. / (l * s**l)
+                M[l,1:] = comb(l+k[1:]-1, k[1:]-1) * (-1.)**k[1:] / s**(k[1:]+l)
+            m2l[(dx, dz)] = M
+
+    return(m2m, l2l, m2l)
+
+class FMM2D(object):
+    'Complex-variable fast multipole method for 2D Laplace charges and dipoles'
+    def __init__(self, z_s, z_t, iprec=5, leaf_size=None, length=None, core=0.):
+        """
+        Sorts the sources and targets into a quadtree and builds the
+        translation operators. The same object can evaluate any number of
+        charge and dipole distributions on the sources (see evaluate()).
+
+        The complex potential at a target z is
+        phi(z) = sum(charge * log(z - z_s) + dipole / (z - z_s)).
+        Its real part is the Laplace potential of real charges, and its
+        derivative phi'(z) = u - i*v gives the gradient (u, v) of the real
+        part.
+
+        A source with a nonzero length is a straight segment centered on its
+        source point instead, with its charge and dipole moment spread
+        uniformly over it (constant strength source and doublet panels). A
+        segment's dipole potential is then
+        dipole/length * log((z - z_1)/(z - z_2)), z_1 and z_2 being its
+        start and end.
+
+        Args:
+            z_s (complex): Source points.
+            z_t (complex): Target points.
+            iprec (int): Precision flag, -2 (0.5 relative error) to 5 (0.5e-15).
+            leaf_size (int): Maximum number of sources or targets in a leaf
+                cell. Defaults to the expansion order.
+            length (complex): Segment vector of each source (zero for point
+                sources). Leaf cells are kept at least eight segment lengths
+                wide.
+            core (float): Regularization radius. Within the leaf cells'
+                neighbourhood, the charges' derivative kernel 1/d is replaced
+                by conj(d)/(|d|**2 + core**2). Leaf cells are kept at least
+                eight core radii wide, so the charges in well separated cells
+                are far enough away (d > 8*core) for the singular kernel of
+                the expansions to differ from the regularized one by less
+                than 2%.
+
+        Attributes:
+            z_s, z_t (complex): Source and target points.
+            length (complex): Segment vectors of the sources.
+            core (float): Regularization radius of the charges.
+            order (int): Number of terms kept in the expansions.
+            leaf_size (int): Maximum number of points in a leaf cell.
+            levels (int): Index of the leaf level (the root cell is level 0).
+            corner (complex): Lower left corner of the root cell.
+            width (float): Side length of the root cell.
+            src (list): Source cell keys, and each source's cell, per level.
+            trg (list): Target cell keys, and each target's cell, per level.
+        """
+        if iprec not in FMM_EPS:
+            print 'ERROR! Invalid FMM precision flag. Valid values are -2 to 5.'
+            raise ValueError('ERROR! Invalid FMM precision flag.')
+
+        self.z_s = np.asarray(z_s, dtype=complex).ravel()
+        self.z_t = np.asarray(z_t, dtype=complex).ravel()
+        self.length = np.zeros(self.z_s.size, dtype=complex) if length is None else np.asarray(length, dtype=complex).ravel()
+        self.core = core
+        # Truncation error of well separated cells decreases as 0.55**order
+        self.order = int(np.ceil(np.log(FMM_EPS[iprec]) / np.log(0.55)))
+        self.leaf_size = self.order if leaf_size is None else leaf_size
+
+        z_all = np.hstack((self.z_s, self.z_t))
+        (x_min, x_max) = (np.min(np.real(z_all)), np.max(np.real(z_all)))
+        (z_min, z_max) = (np.min(np.imag(z_all)), np.max(np.imag(z_all)))
+        self.width = max(x_max - x_min, z_max - z_min, 1e-300) * (1. + 1e-10)
+        self.corner = x_min + 1j*z_min
+
+        # Refine until every leaf cell holds few enough points
+        l_max = np.max(np.absolute(self.length)) if self.length.size else 0.
+        self.levels = 0
+        while (self.levels < 20 and 0.5 * self.width / 2**(self.levels+1) >= 4. * max(l_max, core) and
+               max(self.max_count(self.z_s), self.max_count(self.z_t)) > self.leaf_size):
+            self.levels += 1
+
+        self.src = [self.cells(self.z_s, l) for l in xrange(self.levels+1)]
+        self.trg = [self.cells(self.z_t, l) for l in xrange(self.levels+1)]
+        self.operators()
+
+    def cell_index(self, z, level):
+        """Returns the integer cell coordinates of points at a level."""
+        n = 2**level
+        ix = np.clip(np.floor(np.real(z - self.corner) / self.width * n).astype(np.int64), 0, n-1)
+        iz = np.clip(np.floor(np.imag(z - self.corner) / self.width * n).astype(np.int64), 0, n-1)
+        return(ix, iz)
+
+    def max_count(self, z):
+        """Returns the largest number of points in a cell at the leaf level."""
+        if z.size == 0:
+            return 0
+        (ix, iz) = self.cell_index(z, self.levels)
+        return np.max(np.unique(ix * 2**self.levels + iz, return_counts=True)[1])
+
+    def cells(self, z, level):
+        """
+        Returns the sorted keys of the occupied cells at a level and the
+        position of each point's cell in that list.
+        """
+        (ix, iz) = self.cell_index(z, level)
+        return np.unique(ix * 2**level + iz, return_inverse=True)
+
+    def center(self, keys, level):
+        """Returns the centers of cells given by their keys."""
+        n = 2**level
+        return self.corner + self.width / n * ((keys // n + 0.5) + 1j*(keys % n + 0.5))
+
+    def operators(self):
+        """
+        Fetches the multipole-to-multipole, multipole-to-local and
+        local-to-local translation matrices for the expansion order, building
+        them the first time that order is used (see translation_operators()).
+        """
+        if self.order not in OPERATORS:
+            OPERATORS[self.order] = translation_operators(self.order)
+        (self.m2m, self.l2l, self.m2l) = OPERATORS[self.order]
+
+    def evaluate(self, charge=None, dipole=None, gradient=False):
+        """
+        Evaluates the complex potential of charges and dipoles on the sources
+        at every target. Sources that coincide with a target are skipped.
+
+        Args:
+            charge (complex): Charge strength of each source.
+            dipole (complex): Complex dipole moment of each source.
+            gradient (bool): Also return the derivative of the potential,
+                regularized by core (see FMM2D).
+
+        Returns:
+            phi (complex): Complex potential at the targets.
+            dphi (complex): Its derivative (only if gradient is True).
+        """
+        p = self.order
+        n_s = self.z_s.size
+        charge = np.zeros(n_s) if charge is None else np.asarray(charge).ravel()
+        dipole = np.zeros(n_s) if dipole is None else np.asarray(dipole).ravel()
+
+        phi = np.zeros(self.z_t.size, dtype=complex)
+        dphi = np.zeros(self.z_t.size, dtype=complex)
+        if (n_s == 0 or self.z_t.size == 0):
+            return (phi, dphi) if gradient else phi
+
+        L = self.levels
+        h = [0.5 * self.width / 2**l for l in xrange(L+1)]
+
+        # Source multipole expansions at the leaf level
+        (keys, inverse) = self.src[L]
+        w = (self.z_s - self.center(keys, L)[inverse]) / h[L]
+        k = np.arange(1, p+1)
+        coeffs = np.zeros((n_s, p+1), dtype=complex)
+        coeffs[:,0] = charge
+        coeffs[:,1:] = (-charge[:,np.newaxis] * self.powers(w, p)[:,1:] / k +
+                        dipole[:,np.newaxis] / h[L] * self.powers(w, p)[:,:-1])
+
+        # Segments, from the integrals of the point source expansions
+        seg = (self.length != 0.)
+        if np.any(seg):
+            lam = self.length[seg] / h[L]
+            w1 = self.powers(w[seg] - 0.5*lam, p+1)
+            w2 = self.powers(w[seg] + 0.5*lam, p+1)
+            coeffs[seg,1:] = (-(charge[seg] / lam)[:,np.newaxis] * (w2[:,2:] - w1[:,2:]) / (k * (k+1)) +
+                              (dipole[seg] / (lam * h[L]))[:,np.newaxis] * (w2[:,1:-1] - w1[:,1:-1]) / k)
+        multipole = [None] * (L+1)
+        multipole[L] = self.accumulate(coeffs, inverse, keys.size)
+
+        # Upward pass
+        for l in xrange(L, 2, -1):
+            (keys, parents) = (self.src[l][0], self.src[l-1][0])
+            parent = np.searchsorted(parents, (keys // 2**l // 2) * 2**(l-1) + (keys % 2**l) // 2)
+            quadrant = (keys // 2**l) % 2 + 2*((keys % 2**l) % 2)
+            multipole[l-1] = np.zeros((parents.size, p+1), dtype=complex)
+            for q in xrange(4):
+                sel = (quadrant == q)
+                multipole[l-1][parent[sel]] += np.dot(multipole[l][sel], self.m2m[q].T)
+
+        # Interactions between well separated cells, then downward pass
+        local = None
+        for l in xrange(2, L+1):
+            (t_keys, s_keys) = (self.trg[l][0], self.src[l][0])
+            n = 2**l
+            (ix, iz) = (t_keys // n, t_keys % n)
+            current = np.zeros((t_keys.size, p+1), dtype=complex)
+            if local is not None:
+                parent = np.searchsorted(self.trg[l-1][0], (ix // 2) * (n // 2) + iz // 2)
+                quadrant = ix % 2 + 2*(iz % 2)
+                for q in xrange(4):
+                    sel = (quadrant == q)
+                    current[sel] = np.dot(local[parent[sel]], self.l2l[q].T)
+
+            for ((dx, dz), M) in self.m2l.iteritems():
+                (jx, jz) = (ix + dx, iz + dz)
+                ok = ((jx >= 0) & (jx < n) & (jz >= 0) & (jz < n) &
+                      (np.absolute(jx // 2 - ix // 2) <= 1) & (np.absolute(jz // 2 - iz // 2) <= 1))
+                j = np.searchsorted(s_keys, jx * n + jz)
+                ok[ok] = (j[ok] < s_keys.size)
+                ok[ok] = (s_keys[j[ok]] == (jx * n + jz)[ok])
+                if np.any(ok):
+                    a = multipole[l][j[ok]]
+                    current[ok] += np.dot(a, M.T)
+                    current[ok,0] += a[:,0] * np.log(h[l])
+            local = current
+
+        # Evaluate the local expansions at the targets
+        (t_keys, t_inverse) = self.trg[L]
+        if local is not None:
+            w = (self.z_t - self.center(t_keys, L)[t_inverse]) / h[L]
+            b = local[t_inverse]
+            for l in xrange(p, -1, -1):
+                phi = phi * w + b[:,l]
+                if (gradient and l > 0):
+                    dphi = dphi * w + l * b[:,l]
+            dphi /= h[L]
+
+        # Direct interactions between neighbouring leaf cells
+        self.near_field(charge, dipole, phi, dphi, gradient)
+
+        return (phi, dphi) if gradient else phi
+
+    def powers(self, w, p):
+        """Returns the powers 0 to p of w, one row per point."""
+        powers = np.ones((w.size, p+1), dtype=complex)
+        powers[:,1:] = np.cumprod(np.repeat(w[:,np.newaxis], p, 1), axis=1)
+        return powers
+
+    def accumulate(self, coeffs, inverse, n_cells):
+        """Sums the rows of coeffs that belong to the same cell."""
+        total = np.zeros((n_cells, coeffs.shape[1]), dtype=complex)
+        for k in xrange(coeffs.shape[1]):
+            total[:,k] = (np.bincount(inverse, np.real(coeffs[:,k]), n_cells) +
+                          1j*np.bincount(inverse, np.imag(coeffs[:,k]), n_cells))
+        return total
+
+    def near_field(self, charge, dipole, phi, dphi, gradient):
+        """Adds the direct interactions between neighbouring leaf cells."""
+        L = self.levels
+        n = 2**L
+        (s_keys, s_inverse) = self.src[L]
+        (t_keys, t_inverse) = self.trg[L]
+        s_order = np.argsort(s_inverse, kind='mergesort')
+        s_start = np.searchsorted(s_inverse[s_order], np.arange(s_keys.size+1))
+        t_order = np.argsort(t_inverse, kind='mergesort')
+        t_start = np.searchsorted(t_inverse[t_order], np.arange(t_keys.size+1))
+
+        for (c, key) in enumerate(t_keys):
+            (ix, iz) = (key // n, key % n)
+            near = np.array([(jx * n + jz) for jx in xrange(ix-1, ix+2) for jz in xrange(iz-1, iz+2)
+                             if (0 <= jx < n and 0 <= jz < n)])
+            j = np.minimum(np.searchsorted(s_keys, near), s_keys.size-1)
+            j = j[s_keys[j] == near]
+            if j.size == 0:
+                continue
+
+            sources = np.hstack([s_order[s_start[k]:s_start[k+1]] for k in j])
+            targets = t_order[t_start[c]:t_start[c+1]]
+            seg = (self.length[sources] != 0.)
+            if not np.all(seg):
+                self.point_kernel(sources[~seg], targets, charge, dipole, phi, dphi, gradient)
+            if np.any(seg):
+                self.segment_kernel(sources[seg], targets, charge, dipole, phi, dphi, gradient)
+
+    def point_kernel(self, sources, targets, charge, dipole, phi, dphi, gradient):
+        """Adds the potential of point sources at the targets directly."""
+        d = self.z_t[targets,np.newaxis] - self.z_s[sources]
+        skip = (d == 0.)
+        d[skip] = 1.
+        inv_d = np.where(skip, 0., 1. / d)
+        log_d = np.where(skip, 0., np.log(d))
+        phi[targets] += np.dot(log_d, charge[sources]) + np.dot(inv_d, dipole[sources])
+        if gradient:
+            if self.core > 0.:
+                kernel = np.where(skip, 0., np.conj(d) / (np.absolute(d)**2 + self.core**2))
+            else:
+                kernel = inv_d
+            dphi[targets] += np.dot(kernel, charge[sources]) - np.dot(inv_d**2, dipole[sources])
+
+    def segment_kernel(self, sources, targets, charge, dipole, phi, dphi, gradient):
+        """
+        Adds the potential of segment sources at the targets directly. The
+        charge potential is evaluated in each segment's own frame, where the
+        branch cuts of the logarithms lie along the segment's line and the
+        real part is continuous, and then rotated back by adding
+        charge*log(direction).
+        """
+        length = self.length[sources]
+        direction = length / np.absolute(length)
+        d1 = self.z_t[targets,np.newaxis] - (self.z_s[sources] - 0.5*length)
+        d2 = d1 - length
+        (Z1, Z2) = (d1 * np.conj(direction), d2 * np.conj(direction))
+        Z1[Z1 == 0.] = 1e-300
+        Z2[Z2 == 0.] = 1e-300
+        log_ratio = np.log(Z1 / Z2)
+
+        phi[targets] += (np.dot(Z1*np.log(Z1) - Z2*np.log(Z2), charge[sources] / np.absolute(length)) +
+                         np.dot(np.log(direction) - 1., charge[sources]) + np.dot(log_ratio, dipole[sources] / length))
+        if gradient:
+            dphi[targets] += (np.dot(log_ratio, charge[sources] / length) +
+                              np.dot(1./(Z1*direction) - 1./(Z2*direction), dipole[sources] / length))
@@ -3,6 +3,8 @@ import sys
 import numpy as np
 from scipy import array
 from scipy.interpolate import PchipInterpolator
+from history_buffer_class import HistoryBuffer
+from functions_kernels import panel_transformation, set_backend
 
 def panel_vectors(x, z):
     """
@@ -49,16 +51,41 @@ def point_vectors(xdp, xdm, zdp, zdm):
     nz = tx
     return(tx,tz,nx,nz)
 
+def wake_budget(P):
+    """
+    Returns the number of wake elements (panels and vortex particles) each
+    swimmer may keep when the wake is truncated.
+
+    Each element is counted as six floats (coordinates, strength, circulation
+    and induced velocity) against the TRUNC_BYTES budget.
+
+    Args:
+        P: Dictionary of input parameters.
+
+    Returns:
+        n_max: Maximum number of wake elements per swimmer.
+    """
+    n_max = min(P['TRUNC_PANELS'], P['TRUNC_BYTES'] // (6*np.dtype(float).itemsize))
+    if n_max < 2:
+        raise ValueError('ERROR! The wake truncation budget must allow at least two wake elements.')
+
+    return int(n_max)
+
 def archive(array, axis=0):
     """
     Shifts array values along an axis (row-wise by default).
 
     Used for arrays that keep past values for differencing with respect to time.
+    A HistoryBuffer gets a new entry instead, without moving the others.
 
     Args:
         array: The array that will be manipulated.
         axis: The axis to shift values along (0==row-wise, 1==column-wise).
     """
+    if isinstance(array, HistoryBuffer):
+        array.push()
+        return
+
     if len(np.shape(array)) == 1:
         array[1:] = array[:-1]
     elif len(np.shape(array)) == 2:
@@ -67,7 +94,7 @@ def archive(array, axis=0):
         else:
             array[:,1:] = array[:,:-1]
 
-def transformation(xt,zt,xi,zi):
+def transformation(xt,zt,xi,zi,vectors=None):
     """
     Transforms points into a panel's reference frame.
     
@@ -80,34 +107,20 @@ def transformation(xt,zt,xi,zi):
         zt (float): z coordinate of target points
         xi (float): x coordinate of influences
         zi (float): z coordinate of influences
+        vectors (tuple): Optional (tx, tz) tangent vectors of the influence
+            panels, if they are already known
         
     Returns:
         xp1 (float):
         xp2 (float):
         zp (float):
     """
-    # NI is N influences, NT is N targets
-    NT = np.size(xt)
-    NI = np.size(xi)-1
-
-    (tx,tz,nx,nz) = panel_vectors(xi,zi)[:-1]
-
-    # Intermediary variables to reduce number of tile/repeat operations
-    # From normalvectors: tx==nz, tz==-nx
-    x_tile = np.repeat(xt[:,np.newaxis],NI,1) - np.repeat(xi[:-1,np.newaxis].T,NT,0)
-    z_tile = np.repeat(zt[:,np.newaxis],NI,1) - np.repeat(zi[:-1,np.newaxis].T,NT,0)
-    tx_tile = np.repeat(tx[:,np.newaxis].T,NT,0)
-    tz_tile = np.repeat(tz[:,np.newaxis].T,NT,0)
-
-    # Transforming left side collocation points from global to local coordinates
-    xp1 = x_tile*tx_tile + z_tile*tz_tile
-    zp = x_tile*(-tz_tile) + z_tile*tx_tile
-
-    # Transforming right side panel points into local coordinate system
-    dummy = (xi[1:]-xi[:-1])*tx + (zi[1:]-zi[:-1])*tz
-    xp2 = xp1 - np.repeat(dummy[:,np.newaxis].T,NT,0)
+    if vectors is None:
+        (tx,tz) = panel_vectors(xi,zi)[:2]
+    else:
+        (tx,tz) = vectors
 
-    return(xp1,xp2,zp)
+    return panel_transformation(xt, zt, xi, zi, tx, tz)
 
 def absoluteToBody(Body, Solid, P, i):
     """
@@ -214,7 +227,11 @@ def geom_setup(P, PC, Swimmer, solid=None, FSI=None, PyFEA=None):
         MotL[i] = PC.MotionParameters(P['X_START'][i], P['Z_START'][i], P['V0'], P['THETA_MAX'], P['F'], P['PHI'])
 
         # Create a Swimmer object and add it to the Swimmer object list.
-        Swimmers[i] = Swimmer(SwiL[i], GeoL[i], MotL[i], P['COUNTER']-1)
+        # Only allocate the wake panels that truncation will let the wake keep
+        N_WAKE = P['COUNTER']-1
+        if P['SW_TRUNCATE']:
+            N_WAKE = min(N_WAKE, wake_budget(P)+1)
+        Swimmers[i] = Swimmer(SwiL[i], GeoL[i], MotL[i], N_WAKE)
 
         # Create more objects if this is an FSI simulation.
         if P['SW_FSI']:
@@ -272,7 +289,10 @@ def simulation_startup(P, DIO, PC, Swimmer, solid=None, FSI=None, PyFEA=None):
     Raises:
         ValueError: If given an unsupported 'START_FROM' keyword.
         ValueError: If input parameters are inconsistent with starting data.
+        ValueError: If KERNEL_BACKEND is unknown or not installed.
     """
+    # Kernel backend used by all influence and velocity evaluations
+    set_backend(P['KERNEL_BACKEND'])
     
     # Check if the specified data output directory exists. If it does not, then
     # create a new output directory with that same name and for the simulation 
@@ -291,12 +311,9 @@ def simulation_startup(P, DIO, PC, Swimmer, solid=None, FSI=None, PyFEA=None):
         if not (sP['DEL_T'] == P['DEL_T']) and (sP['N_SWIMMERS'] == P['N_SWIMMERS']) and (sP['N_BODY'] == P['N_BODY']):
             raise ValueError('ERROR! Inconsistent input parameters with starting data file.')
 
-        if (Swimmers[0].Wake.x.shape[0] < P['COUNTER']):
+        if (Swimmers[0].Wake.N < P['COUNTER']-1):
             for Swim in Swimmers:
-                Swim.Wake.x.resize(P['COUNTER'])
-                Swim.Wake.z.resize(P['COUNTER'])
-                Swim.Wake.mu.resize(P['COUNTER']-1)
-                Swim.Wake.gamma.resize(P['COUNTER'])
+                Swim.Wake.N = P['COUNTER']-1
 
         START_COUNTER = i + 1
         COUNTER = P['COUNTER']
@@ -312,12 +329,9 @@ def simulation_startup(P, DIO, PC, Swimmer, solid=None, FSI=None, PyFEA=None):
         if not (sP['DEL_T'] == P['DEL_T']) and (sP['N_SWIMMERS'] == P['N_SWIMMERS']) and (sP['N_BODY'] == P['N_BODY']):
             raise ValueError('ERROR! Inconsistent input parameters with starting data file.')
 
-        if (Swimmers[0].Wake.x.shape[0] < P['COUNTER']):
+        if (Swimmers[0].Wake.N < P['COUNTER']-1):
             for Swim in Swimmers:
-                Swim.Wake.x.resize(P['COUNTER'])
-                Swim.Wake.z.resize(P['COUNTER'])
-                Swim.Wake.mu.resize(P['COUNTER']-1)
-                Swim.Wake.gamma.resize(P['COUNTER'])
+                Swim.Wake.N = P['COUNTER']-1
 
         START_COUNTER = i + 1
         COUNTER = P['COUNTER']
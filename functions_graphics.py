@@ -73,8 +73,8 @@ def cp_plot(Swimmers, i, SW_PLOT_FIG):
             # Gather circulations of all swimmers into a color array
             color = []
             for Swim in Swimmers:
-                Swim.n_color = len(Swim.Wake.gamma[1:i])
-                color = np.append(color, Swim.Wake.gamma[1:i])
+                Swim.n_color = len(Swim.Wake.gamma[1:Swim.Wake.n])
+                color = np.append(color, Swim.Wake.gamma[1:Swim.Wake.n])
                 Swim.i_color = len(color)-Swim.n_color
             
             # Make color map based on vorticity
@@ -96,7 +96,7 @@ def cp_plot(Swimmers, i, SW_PLOT_FIG):
 #                c = color[Swim.i_color:Swim.i_color+Swim.n_color]
 #                # Scatter plot of wake points with red-white-blue colormap, as well as body outline and edge panel segment
 #    #            for idx in xrange(i):
-#                plt.scatter(Swim.Wake.x[1:i], Swim.Wake.z[1:i], s=30, c=c, edgecolors='none', cmap=plt.get_cmap('bwr_r'))
+#                plt.scatter(Swim.Wake.x[1:Swim.Wake.n], Swim.Wake.z[1:Swim.Wake.n], s=30, c=c, edgecolors='none', cmap=plt.get_cmap('bwr_r'))
 #    #            plt.scatter(Swim.Wake.x[1:-1], Swim.Wake.z[1:-1], s=30, c=c, edgecolors='none', cmap=plt.get_cmap('bwr_r'))
 #            plt.plot(Swim.Body.AF.x, Swim.Body.AF.z, 'k')
 #            plt.plot(Swim.Edge.x, Swim.Edge.z, 'g')
@@ -156,8 +156,8 @@ def plot_n_go(Swimmers, i, P):
             # Gather circulations of all swimmers into a color array
             color = []
             for Swim in Swimmers:
-                Swim.n_color = len(Swim.Wake.gamma[1:i])
-                color = np.append(color, Swim.Wake.gamma[1:i])
+                Swim.n_color = len(Swim.Wake.gamma[1:Swim.Wake.n])
+                color = np.append(color, Swim.Wake.gamma[1:Swim.Wake.n])
                 Swim.i_color = len(color)-Swim.n_color
             
             # Make color map based on vorticity
@@ -178,7 +178,7 @@ def plot_n_go(Swimmers, i, P):
                 # Extract color map for the individual Swim
                 c = color[Swim.i_color:Swim.i_color+Swim.n_color]
                 # Scatter plot of wake points with red-white-blue colormap, as well as body outline and edge panel segment
-                plt.scatter(Swim.Wake.x[1:i], Swim.Wake.z[1:i], s=30, c=c, edgecolors='none', cmap=plt.get_cmap('bwr_r'))
+                plt.scatter(Swim.Wake.x[1:Swim.Wake.n], Swim.Wake.z[1:Swim.Wake.n], s=30, c=c, edgecolors='none', cmap=plt.get_cmap('bwr_r'))
             plt.plot(Swim.Body.AF.x, Swim.Body.AF.z, 'k')
             plt.plot(Swim.Edge.x, Swim.Edge.z, 'g')
     
@@ -200,7 +200,7 @@ def plot_n_go(Swimmers, i, P):
                 # Extract color map for the individual Swim
                 c = color[Swim.i_color:Swim.i_color+Swim.n_color]
                 # Scatter plot of wake points with red-white-blue colormap, as well as body outline and edge panel segment
-                plt.scatter(Swim.Wake.x[1:i], Swim.Wake.z[1:i], s=30, c=c, edgecolors='none', cmap=plt.get_cmap('bwr_r'))
+                plt.scatter(Swim.Wake.x[1:Swim.Wake.n], Swim.Wake.z[1:Swim.Wake.n], s=30, c=c, edgecolors='none', cmap=plt.get_cmap('bwr_r'))
             plt.plot(Swim.Body.AF.x, Swim.Body.AF.z, 'k')
             plt.plot(Swim.Edge.x, Swim.Edge.z, 'g')
             
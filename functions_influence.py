@@ -1,126 +1,252 @@
 # -*- coding: utf-8 -*-
 """Module for flow field functions that include all swimmers."""
+from multiprocessing.pool import ThreadPool
 import numpy as np
-from functions_general import panel_vectors, transformation
+from scipy.linalg import lu_solve
+from functions_general import panel_vectors
+from functions_kernels import panel_coefficients, panel_doublets, source_velocity, vortex_velocity, vortex_self_velocity
+from influence_cache_class import InfluenceCache
+from wake_expansion_class import WakeExpansion
+from vortex_quadtree_class import VortexQuadtree
+from vortex_in_cell_class import VortexInCell
+from school_state_class import SchoolState
+from parallel_rollup_class import ParallelRollup
 
-def inf_sourcepanel(xp1, xp2, zp, mask):
-    """Returns a matrix of source panel influence coefficients."""
-    return(mask * (xp1 * np.log(xp1**2 + zp**2) - xp2 * np.log(xp2**2 + zp**2) - 2*(xp1 - xp2)\
-          + 2*zp*(np.arctan2(zp,xp2) - np.arctan2(zp,xp1)))/(4*np.pi))
+# Body and edge influence matrices (and their LU factors) kept between time
+# steps. They are only rebuilt when the relative geometry changes.
+INF_CACHE = InfluenceCache()
 
-def inf_doubletpanel(xp1, xp2, zp, mask):
-    """Returns a matrix of doublet panel influence coefficients."""
-    return(-mask*(np.arctan2(zp,xp2) - np.arctan2(zp,xp1))/(2*np.pi))
+# Body nodes, collocation points, source and doublet strengths of all
+# swimmers in contiguous arrays, which the Bodies' arrays are views of
+SCHOOL = SchoolState()
 
-def quilt(Swimmers, influence_type, NT, NI, i):
-    """Constructs a full transformation matrix that includes all Swimmers.
+# Worker processes of the parallel wake rollup, kept between time steps
+ROLLUP_POOL = ParallelRollup()
+
+# Thread pools of the tiled influence assembly, by number of threads
+THREAD_POOLS = {}
+
+def quilt(Swimmers, influence_type, ep, out, r0, r1):
+    """Fills rows of an influence matrix that includes all Swimmers.
 
     The target is always the Bodies' collocation points, but the influence
-    could be the Bodies, Edges, or Wakes.
+    could be the Bodies, Edges, or Wakes. All targets are taken at once from
+    SCHOOL, so there is one kernel evaluation per influencing Swimmer, which
+    fills that Swimmer's columns.
 
     Args:
         Swimmers: List of Swimmer objects being simulated.
         influence_type: Type of influencing panel (Body, Edge, or Wake).
-        NT: Total number of target panels (across all Swimmers).
-        NI: Total number of influence panels (across all Swimmers).
-        i: Time step number.
-
-    Returns:
-        xp1: Transformed coordinate matrix from panels' left endpoints.
-        xp2: Transformed coordinate matrix from panels' right endpoints.
-        zp: Transformed coordinate matrix from panels' z-levels.
+        ep: Near-field distance below which an influence is ignored.
+        out: Arrays to write into, (source, doublet) for the Body (see
+            panel_coefficients()), the doublet matrix otherwise.
+        r0, r1: Range of target panels (rows) to fill.
     """
-    xp1 = np.empty((NT,NI))
-    xp2 = np.empty((NT,NI))
-    zp = np.empty((NT,NI))
-
-    for SwimT in Swimmers: # Target Swimmer (rows)
-        (r0, rn) = (SwimT.i_b, SwimT.i_b+SwimT.Body.N) # Insertion row range
-
-        for SwimI in Swimmers: # Influencing Swimmer (columns)
-            if influence_type == 'Body':
-                (c0, cn) = (SwimI.i_b, SwimI.i_b+SwimI.Body.N) # Insertion column range
-                (xi, zi) = (SwimI.Body.AF.x, SwimI.Body.AF.z) # Coordinates of influences
-            elif influence_type == 'Edge':
-                (c0, cn) = (SwimI.i_e, SwimI.i_e+SwimI.Edge.N)
-                (xi, zi) = (SwimI.Edge.x, SwimI.Edge.z)
-            elif influence_type == 'Wake':
-                (c0, cn) = (SwimI.i_w, SwimI.i_w+i)
-                (xi, zi) = (SwimI.Wake.x[:i+1], SwimI.Wake.z[:i+1])
-            else:
-                print 'ERROR! Invalid influence type.'
+    (xt, zt) = (SCHOOL.x_col[r0:r1], SCHOOL.z_col[r0:r1])
+
+    for SwimI in Swimmers: # Influencing Swimmer (columns)
+        if influence_type == 'Body':
+            (c0, cn) = (SwimI.i_b, SwimI.i_b+SwimI.Body.N) # Insertion column range
+            (xi, zi) = (SwimI.Body.AF.x, SwimI.Body.AF.z) # Coordinates of influences
+            (tx, tz) = (SwimI.Body.geom.tx, SwimI.Body.geom.tz)
+            panel_coefficients(xt, zt, xi, zi, tx, tz, ep, out[0][r0:r1, c0:cn], out[1][r0:r1, c0:cn])
+            continue
+        elif influence_type == 'Edge':
+            (c0, cn) = (SwimI.i_e, SwimI.i_e+SwimI.Edge.N)
+            (xi, zi) = (SwimI.Edge.x, SwimI.Edge.z)
+        elif influence_type == 'Wake':
+            (c0, cn) = (SwimI.i_w, SwimI.i_w+SwimI.Wake.n)
+            (xi, zi) = (SwimI.Wake.x[:SwimI.Wake.n+1], SwimI.Wake.z[:SwimI.Wake.n+1])
+        else:
+            print 'ERROR! Invalid influence type.'
 
-            (xp1[r0:rn, c0:cn], xp2[r0:rn, c0:cn], zp[r0:rn, c0:cn]) = \
-                transformation(SwimT.Body.AF.x_col, SwimT.Body.AF.z_col, xi, zi)
+        (tx, tz) = panel_vectors(xi, zi)[:2]
+        out[r0:r1, c0:cn] = panel_doublets(xt, zt, xi, zi, tx, tz, ep)
 
-    return(xp1, xp2, zp)
+def assemble(Swimmers, influence_type, P, ep, out):
+    """Fills the influence matrices of one type of panel on the bodies.
 
+    The matrices are built in tiles of at most ASSEMBLY_TILE rows, each by
+    its own quilt(), so the temporaries only hold one tile. With N_THREADS
+    above 1 the tiles are dispatched to a pool of threads, which run
+    concurrently since NumPy releases the GIL in its array operations.
 
-def influence_matrices(Swimmers, i):
+    Args:
+        Swimmers: List of Swimmer objects being simulated.
+        influence_type: Type of influencing panel (Body, Edge, or Wake).
+        ep: Near-field distance below which an influence is ignored.
+        out: Arrays to write into, (source, doublet) for the Body (see
+            panel_coefficients()), the doublet matrix otherwise.
+        N_THREADS: Number of assembly threads.
+        ASSEMBLY_TILE: Number of rows in a tile.
+    """
+    NT = SCHOOL.x_col.size
+    tiles = [(r0, min(r0+P['ASSEMBLY_TILE'], NT)) for r0 in xrange(0, NT, P['ASSEMBLY_TILE'])]
+
+    def fill(tile):
+        quilt(Swimmers, influence_type, ep, out, *tile)
+
+    n_threads = min(P['N_THREADS'], len(tiles))
+    if n_threads > 1:
+        if P['N_THREADS'] not in THREAD_POOLS:
+            THREAD_POOLS[P['N_THREADS']] = ThreadPool(P['N_THREADS'])
+        THREAD_POOLS[P['N_THREADS']].map(fill, tiles)
+    else:
+        map(fill, tiles)
+
+def influence_matrices(Swimmers, P, i, wake_matrix=True):
     """Constructs the influence coefficient matrices.
 
+    The body and edge influences on the bodies only depend on the geometry
+    relative to the bodies, so they are taken from INF_CACHE and rebuilt only
+    when that geometry changes (flexible bodies, changing formations). Also
+    attaches the Swimmers to SCHOOL, which sets their body panel offsets.
+    The matrices are filled by assemble().
+
     Args:
         Swimmers: List of Swimmer objects being simulated.
+        P: Dictionary of parameters.
         i: Time step number.
+        wake_matrix: Whether to build b_wakedoublet. It is None otherwise
+            and the wake's influence comes from wake_influence().
 
     Returns:
         sigma_all: Array containing all Swimmers' body source strengths.
-        a_bodydoublet: Body doublet panels' influence matrix.
+        mu_w_all: Array containing all Swimmers' wake doublet strengths.
         b_bodysource: Body source panels' influence matrix.
         b_edgedoublet: Edge panels' influence matrix.
         b_wakedoublet: Wake panels' influence matrix.
-        a_explicit: Augments the a_bodydoublet matrix when doing explicit Kutta.
     """
     ep = 1e-10
-    n_b = 0
+    SCHOOL.attach(Swimmers)
+    n_b = SCHOOL.sigma.size
     n_e = 0
     n_w = 0
     for Swim in Swimmers:
-        Swim.i_b = n_b
         Swim.i_e = n_e
         Swim.i_w = n_w
-        n_b += Swim.Body.N
         n_e += 1
-        n_w += i
+        n_w += Swim.Wake.n
 
-    sigma_all = np.empty(n_b)
+    # The bodies' source strengths are already contiguous
+    sigma_all = SCHOOL.sigma
     mu_w_all = np.empty(n_w)
     for Swim in Swimmers:
-        (r0, rn) = (Swim.i_b, Swim.i_b+Swim.Body.N)
-        sigma_all[r0:rn] = Swim.Body.sigma[:]
-        (r0, rn) = (Swim.i_w, Swim.i_w+i)
-        mu_w_all[r0:rn] = Swim.Wake.mu[:i]
-
-    (xp1, xp2, zp) = quilt(Swimmers, 'Body', n_b, n_b, i)
-    # Calculate 'Mask' - if a source or doublet gets too close then ignore its influence
-    mask = np.greater_equal(np.absolute(zp),ep).astype(int)
-#    mask = 1
-    
-    # Body source singularities influencing the bodies (part of RHS)
-    b_bodysource = inf_sourcepanel(xp1, xp2, zp, mask)
-    # Body doublet singularities influencing bodies themselves (the A matrix)
-    a_bodydoublet = inf_doubletpanel(xp1, xp2, zp, mask)
-
-    (xp1, xp2, zp) = quilt(Swimmers, 'Edge', n_b, n_e, i)
-    # Calculate 'Mask' - if a source or doublet gets too close then ignore its influence
-    mask = np.greater_equal(np.absolute(zp),ep).astype(int)
-    
-    # Edge doublet singularities influencing the bodies (part of RHS)
-    b_edgedoublet = inf_doubletpanel(xp1, xp2, zp, mask)
+        (r0, rn) = (Swim.i_w, Swim.i_w+Swim.Wake.n)
+        mu_w_all[r0:rn] = Swim.Wake.mu[:Swim.Wake.n]
+
+    if not INF_CACHE.is_current(Swimmers):
+        # Body source singularities influencing the bodies (part of RHS) and
+        # body doublet singularities influencing bodies themselves (the A matrix),
+        # written over the previous matrices when the panel count is unchanged
+        (b_bodysource, a_bodydoublet) = INF_CACHE.body_buffers(n_b)
+        assemble(Swimmers, 'Body', P, ep, (b_bodysource, a_bodydoublet))
+
+        # Edge doublet singularities influencing the bodies (part of RHS)
+        b_edgedoublet = np.empty((n_b, n_e))
+        assemble(Swimmers, 'Edge', P, ep, b_edgedoublet)
+
+        INF_CACHE.store(Swimmers, a_bodydoublet, b_bodysource, b_edgedoublet)
 
     if i==0: # There are no wake panels until i==1
         b_wakedoublet = 0
+    elif not wake_matrix:
+        b_wakedoublet = None
     else:
-        (xp1, xp2, zp) = quilt(Swimmers, 'Wake', n_b, n_w, i)
-        # Calculate 'Mask' - if a source or doublet gets too close then ignore its influence
-        mask = np.greater_equal(np.absolute(zp),ep).astype(int)
         # Wake doublet singularities influencing the bodies (part of RHS)
-        b_wakedoublet = inf_doubletpanel(xp1, xp2, zp, mask)
+        b_wakedoublet = np.empty((n_b, n_w))
+        assemble(Swimmers, 'Wake', P, ep, b_wakedoublet)
+
+    return(sigma_all, mu_w_all, INF_CACHE.b_bodysource,
+           INF_CACHE.b_edgedoublet, b_wakedoublet)
+
+def wake_influence(Swimmers, P, i):
+    """Evaluates the wake doublet panels' influence on the bodies.
+
+    Gives the same result as np.dot(b_wakedoublet, mu_w_all) without building
+    b_wakedoublet. Wake panels are streamed in blocks of at most WAKE_BLOCK
+    panels, so only an n_b x WAKE_BLOCK coefficient matrix exists at any time.
+
+    With SW_WAKE_MULTIPOLE, only the MP_NEAR newest panels of each wake are
+    evaluated this way. The older panels are grouped into clusters whose
+    multipole expansions are kept in Wake.expansion between time steps (see
+    WakeExpansion), and are only evaluated panel by panel at targets too
+    close to a cluster for its expansion.
+
+    Args:
+        Swimmers: List of Swimmer objects being simulated.
+        P: Dictionary of simulation parameters.
+        i: Time step number.
+
+    Returns:
+        phi_w: Potential induced by all wakes at all body collocation points.
+    """
+    WAKE_BLOCK = P['WAKE_BLOCK']
+    SW_WAKE_MULTIPOLE = P['SW_WAKE_MULTIPOLE']
+    ep = 1e-10
+    (x_col, z_col) = (SCHOOL.x_col, SCHOOL.z_col)
+
+    phi_w = np.zeros(x_col.size)
+    for SwimI in Swimmers:
+        if SW_WAKE_MULTIPOLE:
+            if SwimI.Wake.expansion is None:
+                SwimI.Wake.expansion = WakeExpansion(P['MP_ORDER'], P['MP_THETA'], P['MP_NEAR'],
+                                                     P['MP_CLUSTER'], P['MP_TOL'])
+            z_t = x_col + 1j*z_col
+            SwimI.Wake.expansion.update(SwimI.Wake, z_t)
+            (phi_far, far_direct) = SwimI.Wake.expansion.evaluate(SwimI.Wake, z_t)
+            phi_w += phi_far
+            n_direct = min(SwimI.Wake.n, SwimI.Wake.expansion.n_near)
+        else:
+            far_direct = []
+            n_direct = SwimI.Wake.n
+
+        # Near wake panels on every target, then far panels on the targets
+        # their cluster's expansion can't be used for
+        blocks = [(k0, min(k0+WAKE_BLOCK, n_direct), None) for k0 in xrange(0, n_direct, WAKE_BLOCK)]
+        for (c0, cn, targets) in far_direct:
+            blocks += [(k0, min(k0+WAKE_BLOCK, cn), targets) for k0 in xrange(c0, cn, WAKE_BLOCK)]
+
+        (tx, tz) = panel_vectors(SwimI.Wake.x, SwimI.Wake.z)[:2]
+        for (k0, k1, targets) in blocks:
+            if targets is None:
+                (xt, zt) = (x_col, z_col)
+            else:
+                (xt, zt) = (x_col[targets], z_col[targets])
+            doublet = panel_doublets(xt, zt, SwimI.Wake.x[k0:k1+1], SwimI.Wake.z[k0:k1+1],
+                                     tx[k0:k1], tz[k0:k1], ep)
+            phi = np.dot(doublet, SwimI.Wake.mu[k0:k1])
+            if targets is None:
+                phi_w += phi
+            else:
+                phi_w[targets] += phi
+
+    return phi_w
 
-    a_explicit = np.zeros((n_b,n_b))
+def kutta_residual(Swimmers, P, i, mu_base, mu_unit, mu_e):
+    """Evaluates the trailing edge pressure jumps for given edge strengths.
 
-    return(sigma_all, mu_w_all, a_bodydoublet, a_explicit,
-           b_bodysource, b_edgedoublet, b_wakedoublet)
+    Args:
+        Swimmers: List of Swimmer objects being simulated.
+        P: Dictionary of simulation parameters.
+        i: Time step number.
+        mu_base: Bodies' doublet strengths with no edge panel influence.
+        mu_unit: Bodies' doublet strengths for a unit strength on each edge.
+        mu_e: Edge doublet strengths of all Swimmers.
+
+    Returns:
+        delta_p: Pressure jump across the trailing edge of each Swimmer that
+            uses the implicit Kutta condition (zero for the others).
+    """
+    # Every Body.mu is a view of SCHOOL.mu
+    np.add(mu_base, np.dot(mu_unit, mu_e), out=SCHOOL.mu)
+    # Only the panels on either side of the trailing edges are needed here
+    p_te = SCHOOL.trailing_edge_pressure(Swimmers, P, i)
+    # Extrapolate pressure as it approaches the top and bottom of the trailing edge panel
+    kutta = np.array([Swim.SW_KUTTA for Swim in Swimmers], dtype=bool)
+    delta_p = np.where(kutta, p_te[:,0] - p_te[:,-1], 0.)
+
+    return delta_p
 
 def solve_phi(Swimmers, P, i, outerCorr):
     """Solves the boundary integral equation using a Kutta condition.
@@ -130,81 +256,135 @@ def solve_phi(Swimmers, P, i, outerCorr):
         RHO: Fluid density.
         DEL_T: Time step length.
         i: Time step number.
+        SW_WAKE_MATRIX_FREE: Evaluate the wake's influence in blocks of
+            WAKE_BLOCK panels instead of building b_wakedoublet.
+        SW_WAKE_MULTIPOLE: Use multipole expansions for the far wake (implies
+            SW_WAKE_MATRIX_FREE).
+        SW_PARTICLES, SW_TRUNCATE: Include the vortex particles' influence.
     """
     RHO   = P['RHO']
     DEL_T = P['DEL_T']
+    SW_WAKE_MATRIX_FREE = P['SW_WAKE_MATRIX_FREE'] or P['SW_WAKE_MULTIPOLE']
     
     
     for Swim in Swimmers:  
         if (outerCorr <= 1):
             # mu_past used in differencing for pressure
-            Swim.Body.mu_past[1:4,:] = Swim.Body.mu_past[0:3,:]
-            Swim.Body.mu_past[0,:] = Swim.Body.mu
+            Swim.Body.mu_hist.push(Swim.Body.mu)
     
-    (sigma_all, mu_w_all, a_b, a_e, b_b, b_e, b_w) = influence_matrices(Swimmers, i)
+    (sigma_all, mu_w_all, b_b, b_e, b_w) = influence_matrices(Swimmers, P, i, not SW_WAKE_MATRIX_FREE)
 
-    n_iter = 0
-    while True:
-        n_iter += 1
+    # Get right-hand side without the edge panels
+    if i == 0:
+        b = -np.dot(b_b, sigma_all)
+    elif SW_WAKE_MATRIX_FREE:
+        b = -np.dot(b_b, sigma_all) - wake_influence(Swimmers, P, i)
+    else:
+        b = -np.dot(b_b, sigma_all) - np.dot(b_w, mu_w_all)
+    if (P['SW_PARTICLES'] or P['SW_TRUNCATE']):
+        b -= particle_influence(Swimmers)
 
-        if n_iter == 1:
-            # Begin with explicit Kutta condition as first guess
-            # Construct the augmented body matrix by combining body and trailing edge panel arrays
-            for SwimI in Swimmers:
-                a_e[:,SwimI.i_b] = -b_e[:, SwimI.i_e]
-                a_e[:,SwimI.i_b+SwimI.Body.N-1] = b_e[:, SwimI.i_e]
-            a = a_b + a_e
-            # Get right-hand side
-            if i == 0:
-                b = -np.dot(b_b, sigma_all)
-            else:
-                b = -np.dot(b_b, sigma_all) - np.dot(b_w, mu_w_all)
-            # Solve for bodies' doublet strengths using explicit Kutta
-            mu_b_all = np.linalg.solve(a, b)
-            # First mu_guess (from explicit Kutta)
-            for Swim in Swimmers:
-                Swim.mu_guess = np.empty(2) # [0] is current guess, [1] is previous
-                Swim.delta_p = np.empty(2) # [0] is current delta_p, [1] is previous
-                Swim.Body.mu[:] = mu_b_all[Swim.i_b:Swim.i_b+Swim.Body.N]
-                Swim.mu_guess[0] = Swim.Body.mu[-1]-Swim.Body.mu[0]
+    kutta_solve(Swimmers, P, i, b)
+
+def kutta_solve(Swimmers, P, i, b):
+    """Solves for the body and edge doublet strengths with a Kutta condition.
+
+    Uses the body and edge influence matrices of INF_CACHE, so
+    influence_matrices() must have been called for this time step.
+
+    Args:
+        Swimmers: List of Swimmer objects being simulated.
+        P: Dictionary of simulation parameters.
+        i: Time step number.
+        b: Right-hand side at the body collocation points without the edge
+            panels (body source, wake and particle influence).
+    """
+    # The bodies' doublet strengths are affine in the edge doublet strengths,
+    # mu_b_all = mu_base + np.dot(mu_unit, mu_e), so every Kutta iteration is
+    # a vector update of the base solution and the (cached) unit responses
+    mu_base = lu_solve(INF_CACHE.implicit_lu(), b)
+    mu_unit = INF_CACHE.edge_response()
+
+    # Explicit Kutta condition, mu_e == mu_b[-1] - mu_b[0] for each swimmer
+    n_e = len(Swimmers)
+    d_base = np.empty(n_e)
+    d_unit = np.empty((n_e, n_e))
+    for Swim in Swimmers:
+        (r0, rn) = (Swim.i_b, Swim.i_b+Swim.Body.N-1)
+        d_base[Swim.i_e] = mu_base[rn] - mu_base[r0]
+        d_unit[Swim.i_e,:] = mu_unit[rn,:] - mu_unit[r0,:]
+    mu_e = np.linalg.solve(np.eye(n_e) - d_unit, d_base)
 
+    for Swim in Swimmers:
+        Swim.mu_guess = np.empty(2) # [0] is current guess, [1] is previous
+        Swim.delta_p = np.empty(2) # [0] is current delta_p, [1] is previous
+        Swim.mu_guess[0] = mu_e[Swim.i_e]
+
+    # Implicit Kutta condition: drive the trailing edge pressure jumps of all
+    # swimmers to zero together with Broyden's method (the secant method when
+    # there is a single swimmer)
+    kutta = np.array([Swim.SW_KUTTA for Swim in Swimmers])
+    if np.any(kutta):
+        (k_i, k_e) = (np.flatnonzero(kutta), np.flatnonzero(~kutta))
+        mu_explicit = mu_e[k_i]
+        # Warm start from the last converged edge doublet strengths
+        if i > 0:
+            mu_guess = np.array([np.squeeze(Swimmers[k].Edge.mu) for k in k_i])
         else:
-            if n_iter == 2: # Make a second initial guess
-                # Update phi_dinv so it no longer includes explicit Kutta condition
-                a = np.copy(a_b)
+            mu_guess = np.copy(mu_explicit)
 
-                Swimmers[0].mu_guess[1] = Swimmers[0].mu_guess[0]
-                Swimmers[0].delta_p[1] = Swimmers[0].delta_p[0]
-                Swimmers[0].mu_guess[0] = 1.01*Swimmers[0].mu_guess[1] # Multiply first (explicit) guess by arbitrary constant to get second guess
+        n_iter = 0
+        while True:
+            n_iter += 1
+
+            if n_iter == 2: # Make a second initial guess
+                (mu_prev, dp_prev) = (mu_guess, delta_p)
+                # Use the explicit Kutta solution, or multiply the first guess by an arbitrary constant
+                mu_guess = np.where(mu_explicit != mu_prev, mu_explicit, 1.01*mu_prev)
 
-            else: # Newton method to get delta_p == 0
-                # Get slope, which is change in delta_p divided by change in mu_guess
+            elif n_iter > 2: # Quasi-Newton method to get delta_p == 0
+                (d_mu, d_dp) = (mu_guess - mu_prev, delta_p - dp_prev)
                 if n_iter == 3:
-                    slope = (Swimmers[0].delta_p[0]-Swimmers[0].delta_p[1])/(Swimmers[0].mu_guess[0]-Swimmers[0].mu_guess[1])
-                Swimmers[0].mu_guess[1] = Swimmers[0].mu_guess[0]
-                Swimmers[0].delta_p[1] = Swimmers[0].delta_p[0]
-                Swimmers[0].mu_guess[0] = Swimmers[0].mu_guess[1] - Swimmers[0].delta_p[0]/slope
-
-            # Form right-hand side including mu_guess as an influence
-            if i == 0:
-                rhs = -np.dot(b_b, sigma_all) - np.squeeze(np.dot(b_e, Swimmers[0].mu_guess[0]))
-            else:
-                rhs = -np.dot(b_b, sigma_all) - np.dot(np.insert(b_w, 0, b_e[:,0], axis=1), np.insert(Swimmers[0].Wake.mu[:i], 0, Swimmers[0].mu_guess[0]))
+                    # Each swimmer's pressure jump mostly depends on its own edge panel,
+                    # so start from the diagonal secant slopes
+                    d_mu[d_mu == 0.] = 1.
+                    jac = np.diag(d_dp / d_mu)
+                else:
+                    # Broyden rank-one update of the Jacobian
+                    jac += np.outer(d_dp - np.dot(jac, d_mu), d_mu) / np.dot(d_mu, d_mu)
+                (mu_prev, dp_prev) = (mu_guess, delta_p)
+                try:
+                    mu_guess = mu_prev - np.linalg.solve(jac, dp_prev)
+                except np.linalg.LinAlgError:
+                    print 'WARNING! Singular Jacobian in Implicit Kutta solve!'
+                    break
+
+            mu_e[k_i] = mu_guess
+            if k_e.size > 0:
+                # Swimmers using the explicit Kutta condition follow the implicit ones
+                mu_e[k_e] = np.linalg.solve(np.eye(k_e.size) - d_unit[np.ix_(k_e,k_e)],
+                                            d_base[k_e] + np.dot(d_unit[np.ix_(k_e,k_i)], mu_guess))
+            delta_p = kutta_residual(Swimmers, P, i, mu_base, mu_unit, mu_e)[k_i]
+
+            for (j, k) in enumerate(k_i):
+                Swimmers[k].mu_guess[0] = mu_guess[j]
+                Swimmers[k].delta_p[0] = delta_p[j]
+                if n_iter > 1:
+                    Swimmers[k].mu_guess[1] = mu_prev[j]
+                    Swimmers[k].delta_p[1] = dp_prev[j]
+
+            # wcs211: Added a max iteration break for the implicit Kutta loop
+            if np.max(np.absolute(delta_p)) < 0.0000001 or n_iter >= 1000:
+                if n_iter >= 1000:
+                    print 'WARNING! Max iterations reached in Implicit Kutta solve!'
+                break
 
-            Swimmers[0].Body.mu = np.linalg.solve(a, rhs)
-            
         for Swim in Swimmers:
-            Swim.Body.pressure(P, i)
-        # Extrapolate pressure as it approaches the top and bottom of the trailing edge panel
-        if len(Swimmers) > 1 or Swimmers[0].SW_KUTTA == False:
-            break
-        Swimmers[0].delta_p[0] = Swimmers[0].Body.p[0] - Swimmers[0].Body.p[-1]
-
-        # wcs211: Added a max iteration break for the implicit Kutta loop
-        if Swimmers[0].delta_p[0] < 0.0000001 or n_iter >= 1000:
-            if n_iter >= 1000:
-                print 'WARNING! Max iterations reached in Implicit Kutta solve!'
-            break
+            Swim.mu_guess[0] = mu_e[Swim.i_e]
+
+    # Full surface pressure once the edge doublet strengths are known
+    np.add(mu_base, np.dot(mu_unit, mu_e), out=SCHOOL.mu)
+    SCHOOL.pressure(Swimmers, P, i)
 
     for Swim in Swimmers:  
         Swim.Edge.mu = Swim.mu_guess[0]
@@ -216,94 +396,300 @@ def solve_phi(Swimmers, P, i, outerCorr):
         Swim.Body.gamma[1:-1] = Swim.Body.mu[:-1]-Swim.Body.mu[1:]
         Swim.Body.gamma[-1] = Swim.Body.mu[-1]
 
+def body_source_velocity(xt, zt, Body):
+    """Returns the velocity induced by a body's source panels at targets.
+
+    Args:
+        xt, zt: Target point coordinates.
+        Body: Body whose source panels induce the velocity.
+
+    Returns:
+        vx, vz: Induced velocity components at the targets.
+    """
+    # Angle of normal vector with respect to global z-axis
+    beta = np.arctan2(-Body.geom.nx, Body.geom.nz)
+
+    return source_velocity(xt, zt, Body.AF.x, Body.AF.z, Body.geom.tx, Body.geom.tz, beta, Body.sigma)
+
+def particle_vortices(Swimmers):
+    """Gathers the vortex particles of all Swimmers.
+
+    Also includes the point vortex that the particles' virtual doublet panels
+    leave at the last node of each wake (see VortexParticles).
+
+    Args:
+        Swimmers: List of Swimmer objects being simulated.
+
+    Returns:
+        xs, zs: Point vortex coordinates.
+        gs: Point vortex circulations.
+    """
+    (xs, zs, gs) = ([], [], [])
+    for Swim in Swimmers:
+        (Particles, n) = (Swim.Particles, Swim.Wake.n)
+        if Particles.n > 0:
+            xs += [Particles.x[:Particles.n], Swim.Wake.x[n:n+1]]
+            zs += [Particles.z[:Particles.n], Swim.Wake.z[n:n+1]]
+            gs += [Particles.gamma[:Particles.n], [-np.sum(Particles.gamma[:Particles.n])]]
+
+    if not gs:
+        return(np.zeros(0), np.zeros(0), np.zeros(0))
+    return(np.hstack(xs), np.hstack(zs), np.hstack(gs))
+
+def wake_vortices(Swimmers):
+    """Gathers the wake point vortices and vortex particles of all Swimmers.
+
+    For each Swimmer: its wake nodes 0 to Wake.n, then its vortex particles
+    and their tail vortex (see particle_vortices()) if it has any.
+
+    Args:
+        Swimmers: List of Swimmer objects being simulated.
+
+    Returns:
+        xs, zs: Point vortex coordinates.
+        gs: Point vortex circulations.
+    """
+    (xs, zs, gs) = ([], [], [])
+    for Swim in Swimmers:
+        (Particles, n) = (Swim.Particles, Swim.Wake.n)
+        xs.append(Swim.Wake.x[:n+1])
+        zs.append(Swim.Wake.z[:n+1])
+        gs.append(Swim.Wake.gamma[:n+1])
+        if Particles.n > 0:
+            xs += [Particles.x[:Particles.n], Swim.Wake.x[n:n+1]]
+            zs += [Particles.z[:Particles.n], Swim.Wake.z[n:n+1]]
+            gs += [Particles.gamma[:Particles.n], [-np.sum(Particles.gamma[:Particles.n])]]
+
+    return(np.hstack(xs), np.hstack(zs), np.hstack(gs))
+
+def point_vortices(Swimmers):
+    """Gathers every point vortex of all Swimmers into flat arrays.
+
+    The body, edge and wake doublet panels are represented by the point
+    vortices at their endpoints (Body.gamma, Edge.gamma, Wake.gamma),
+    followed by the vortex particles (see particle_vortices()).
+
+    Args:
+        Swimmers: List of Swimmer objects being simulated.
+
+    Returns:
+        xs, zs: Point vortex coordinates.
+        gs: Point vortex circulations.
+    """
+    (xs, zs, gs) = ([], [], [])
+    for Swim in Swimmers:
+        n = Swim.Wake.n
+        xs += [Swim.Body.AF.x, Swim.Edge.x, Swim.Wake.x[:n+1]]
+        zs += [Swim.Body.AF.z, Swim.Edge.z, Swim.Wake.z[:n+1]]
+        gs += [Swim.Body.gamma, Swim.Edge.gamma, Swim.Wake.gamma[:n+1]]
+    (xp, zp, gp) = particle_vortices(Swimmers)
+
+    return(np.hstack(xs + [xp]), np.hstack(zs + [zp]), np.hstack(gs + [gp]))
+
+def particle_influence(Swimmers, block=512):
+    """Evaluates the vortex particles' potential at the body collocation points.
+
+    Each particle's potential is that of its virtual doublet panel, which
+    runs from the last node of its wake to the particle, so the branch cut of
+    the particle's potential stays in the wake.
+
+    Args:
+        Swimmers: List of Swimmer objects being simulated.
+        block: Number of particles evaluated at once.
+
+    Returns:
+        phi_p: Potential induced by all particles at all body collocation points.
+    """
+    z_col = SCHOOL.x_col + 1j*SCHOOL.z_col
+
+    phi_p = np.zeros(z_col.size)
+    for SwimI in Swimmers:
+        (Particles, n) = (SwimI.Particles, SwimI.Wake.n)
+        z_tail = SwimI.Wake.x[n] + 1j*SwimI.Wake.z[n]
+        for k0 in xrange(0, Particles.n, block):
+            k1 = min(k0+block, Particles.n)
+            z_p = Particles.x[k0:k1] + 1j*Particles.z[k0:k1]
+            # Angle subtended by each virtual panel, as for panel_doublets()
+            angle = np.angle((z_col[:,np.newaxis] - z_tail) / (z_col[:,np.newaxis] - z_p))
+            phi_p += np.dot(angle, Particles.gamma[k0:k1]) / (2*np.pi)
+
+    return phi_p
+
+def vic_velocity(Swimmers, xt, zt, P, DELTA_CORE):
+    """Returns the velocity induced by all point vortices, using a VortexInCell.
+
+    The grid spans X_FIELD from the foremost body's leading edge and Z_FIELD,
+    with spacing VIC_H. The wake nodes older than the VIC_NEAR newest panels
+    of each wake and the vortex particles are evaluated on the grid. The
+    body and edge vortices, the near wake, and any vortex or target outside
+    the grid are summed directly with vortex_velocity().
+
+    Args:
+        Swimmers: List of Swimmer objects being simulated.
+        xt, zt: Target point coordinates.
+        DELTA_CORE: Vortex core radius.
+        VIC_H: Grid spacing.
+        VIC_NEAR: Number of newest wake panels evaluated directly.
+        X_FIELD, Z_FIELD: Extent of the grid.
+
+    Returns:
+        vx, vz: Induced velocity components at the targets.
+    """
+    (VIC_H, VIC_NEAR) = (P['VIC_H'], P['VIC_NEAR'])
+    (X_FIELD, Z_FIELD) = (P['X_FIELD'], P['Z_FIELD'])
+    x0 = min(np.min(Swim.Body.AF.x) for Swim in Swimmers) + X_FIELD[0]
+    nx = int(np.ceil((X_FIELD[1] - X_FIELD[0]) / VIC_H)) + 1
+    nz = int(np.ceil((Z_FIELD[1] - Z_FIELD[0]) / VIC_H)) + 1
+    Grid = VortexInCell(x0, Z_FIELD[0], VIC_H, nx, nz, DELTA_CORE)
+
+    (xd, zd, gd) = ([], [], [])
+    (xg, zg, gg) = ([], [], [])
+    for Swim in Swimmers:
+        n = Swim.Wake.n
+        k = min(VIC_NEAR+1, n+1)
+        xd += [Swim.Body.AF.x, Swim.Edge.x, Swim.Wake.x[:k]]
+        zd += [Swim.Body.AF.z, Swim.Edge.z, Swim.Wake.z[:k]]
+        gd += [Swim.Body.gamma, Swim.Edge.gamma, Swim.Wake.gamma[:k]]
+        xg.append(Swim.Wake.x[k:n+1])
+        zg.append(Swim.Wake.z[k:n+1])
+        gg.append(Swim.Wake.gamma[k:n+1])
+    (xp, zp, gp) = particle_vortices(Swimmers)
+    (xg, zg, gg) = (np.hstack(xg + [xp]), np.hstack(zg + [zp]), np.hstack(gg + [gp]))
+
+    # Vortices outside the grid are summed directly
+    on_grid = Grid.inside(xg, zg)
+    xd += [xg[~on_grid]]
+    zd += [zg[~on_grid]]
+    gd += [gg[~on_grid]]
+    (vx, vz) = vortex_velocity(xt, zt, np.hstack(xd), np.hstack(zd), np.hstack(gd), DELTA_CORE)
+
+    if np.any(on_grid):
+        (xg, zg, gg) = (xg[on_grid], zg[on_grid], gg[on_grid])
+        t_in = Grid.inside(xt, zt)
+        (vx_g, vz_g) = Grid.velocity(xg, zg, gg, xt[t_in], zt[t_in])
+        vx[t_in] += vx_g
+        vz[t_in] += vz_g
+        if not np.all(t_in):
+            (vx_g, vz_g) = vortex_velocity(xt[~t_in], zt[~t_in], xg, zg, gg, DELTA_CORE)
+            vx[~t_in] += vx_g
+            vz[~t_in] += vz_g
+
+    return(vx, vz)
+
 def wake_rollup(Swimmers, DEL_T, i, P):
     """Performs wake rollup on the swimmers' wake panels.
 
+    The wake nodes of all Swimmers (and their vortex particles, with
+    SW_PARTICLES) are gathered into one set of targets, and the body, edge
+    and wake doublet panels of all Swimmers into one set of point vortices
+    (see point_vortices()), so the point vortices' velocity is a single
+    vortex_velocity() evaluation. With SW_BARNES_HUT, it is evaluated with a
+    VortexQuadtree instead, and with SW_VIC, with vic_velocity(). With
+    SW_PARALLEL_ROLLUP, vortex_velocity() is evaluated by the ROLLUP_POOL
+    workers over chunks of the targets while this process sums the body
+    source panels. DELTA_CORE is the same for all Swimmers.
+
     Args:
         Swimmers: List of Swimmer objects being simulated.
         DEL_T: Time step length.
         i: Time step number.
+        SW_BARNES_HUT: Switch for the Barnes-Hut evaluation.
+        BH_THETA, BH_ORDER, BH_LEAF: Opening angle, expansion order and leaf
+            size of the quadtree.
+        SW_VIC: Switch for the vortex-in-cell evaluation.
+        SW_PARALLEL_ROLLUP: Switch for the evaluation by worker processes.
+        N_WORKERS: Number of worker processes, the number of CPUs if 0.
     """
+    SW_PARTICLES = P['SW_PARTICLES'] or P['SW_TRUNCATE']
+    SW_BARNES_HUT = P['SW_BARNES_HUT']
+    SW_VIC = P['SW_VIC']
+    SW_PARALLEL_ROLLUP = P['SW_PARALLEL_ROLLUP'] and not (SW_BARNES_HUT or SW_VIC)
     if (P['SW_ROLLUP']):
         # Wake panels initialize when i==1
         if i == 0:
             pass
     
         else:
-            NT = i # Number of targets (wake panel points that are rolling up)
-            for SwimT in Swimmers:
-                SwimT.Wake.vx = np.zeros(NT)
-                SwimT.Wake.vz = np.zeros(NT)
-                DELTA_CORE = SwimT.DELTA_CORE
-                for SwimI in Swimmers:
-                    # Coordinate transformation for body panels influencing wake
-                    (xp1, xp2, zp) = transformation(SwimT.Wake.x[1:i+1], SwimT.Wake.z[1:i+1], SwimI.Body.AF.x, SwimI.Body.AF.z)
-    
-                    # Angle of normal vector with respect to global z-axis
-                    (nx, nz) = panel_vectors(SwimI.Body.AF.x, SwimI.Body.AF.z)[2:4]
-                    beta = np.arctan2(-nx, nz)
-    
-                    # Katz-Plotkin eqns 10.20 and 10.21 for body source influence
-                    dummy1 = np.log((xp1**2+zp**2)/(xp2**2+zp**2))/(4*np.pi)
-                    dummy2 = (np.arctan2(zp,xp2)-np.arctan2(zp,xp1))/(2*np.pi)
-    
-                    # Rotate back to global coordinates
-                    dummy3 = dummy1*np.cos(beta) - dummy2*np.sin(beta)
-                    dummy4 = dummy1*np.sin(beta) + dummy2*np.cos(beta)
-    
-                    # Finish eqns 10.20 and 10.21 for induced velocity by multiplying with sigma
-                    SwimT.Wake.vx += np.dot(dummy3, SwimI.Body.sigma)
-                    SwimT.Wake.vz += np.dot(dummy4, SwimI.Body.sigma)
-    
-                    # Formation of (x-x0) and (z-z0) matrices, similar to xp1/xp2/zp but coordinate transformation is not necessary
-                    NI = SwimI.Body.N+1
-                    xp = np.repeat(SwimT.Wake.x[1:i+1,np.newaxis], NI, 1) - np.repeat(SwimI.Body.AF.x[:,np.newaxis].T, NT, 0)
-                    zp = np.repeat(SwimT.Wake.z[1:i+1,np.newaxis], NI, 1) - np.repeat(SwimI.Body.AF.z[:,np.newaxis].T, NT, 0)
-    
-                    # Find distance r_b between each influence/target
-                    r_b = np.sqrt(xp**2+zp**2)
-    
-                    # Katz-Plotkin eqns 10.9 and 10.10 for body doublet (represented as point vortices) influence
-                    dummy1 = zp/(2*np.pi*(r_b**2+DELTA_CORE**2))
-                    dummy2 = -xp/(2*np.pi*(r_b**2+DELTA_CORE**2))
-    
-                    # Finish eqns 10.9 and 10.10 by multiplying with Body.gamma, add to induced velocity
-                    SwimT.Wake.vx += np.dot(dummy1, SwimI.Body.gamma)
-                    SwimT.Wake.vz += np.dot(dummy2, SwimI.Body.gamma)
-    
-                    # Formation of (x-x0) and (z-z0) matrices, similar to xp1/xp2/zp but coordinate transformation is not necessary
-                    NI = SwimI.Edge.N+1
-                    xp = np.repeat(SwimT.Wake.x[1:i+1,np.newaxis], NI, 1) - np.repeat(SwimI.Edge.x[:,np.newaxis].T, NT, 0)
-                    zp = np.repeat(SwimT.Wake.z[1:i+1,np.newaxis], NI, 1) - np.repeat(SwimI.Edge.z[:,np.newaxis].T, NT, 0)
-    
-                    # Find distance r_e between each influence/target
-                    r_e = np.sqrt(xp**2+zp**2)
-    
-                    # Katz-Plotkin eqns 10.9 and 10.10 for edge (as point vortices) influence
-                    dummy1 = zp/(2*np.pi*(r_e**2+DELTA_CORE**2))
-                    dummy2 = -xp/(2*np.pi*(r_e**2+DELTA_CORE**2))
-    
-                    # Finish eqns 10.9 and 10.10 by multiplying with Edge.gamma, add to induced velocity
-                    SwimT.Wake.vx += np.dot(dummy1, SwimI.Edge.gamma)
-                    SwimT.Wake.vz += np.dot(dummy2, SwimI.Edge.gamma)
-    
-                    # Formation of (x-x0) and (z-z0) matrices, similar to xp1/xp2/zp but coordinate transformation is not necessary
-                    NI = i+1
-                    xp = np.repeat(SwimT.Wake.x[1:i+1,np.newaxis], NI, 1) - np.repeat(SwimI.Wake.x[:i+1,np.newaxis].T, NT, 0)
-                    zp = np.repeat(SwimT.Wake.z[1:i+1,np.newaxis], NI, 1) - np.repeat(SwimI.Wake.z[:i+1,np.newaxis].T, NT, 0)
-    
-                    # Find distance r_w between each influence/target
-                    r_w = np.sqrt(xp**2+zp**2)
-    
-                    # Katz-Plotkin eqns 10.9 and 10.10 for wake (as point vortices) influence
-                    dummy1 = zp/(2*np.pi*(r_w**2+DELTA_CORE**2))
-                    dummy2 = -xp/(2*np.pi*(r_w**2+DELTA_CORE**2))
-    
-                    # Finish eqns 10.9 and 10.10 by multiplying with Wake.gamma, add to induced velocity
-                    SwimT.Wake.vx += np.dot(dummy1, SwimI.Wake.gamma[:i+1])
-                    SwimT.Wake.vz += np.dot(dummy2, SwimI.Wake.gamma[:i+1])
+            DELTA_CORE = Swimmers[0].DELTA_CORE
+
+            # Targets: wake panel points that are rolling up, then particles
+            (xt, zt) = ([], [])
+            for Swim in Swimmers:
+                NT = Swim.Wake.n
+                xt.append(Swim.Wake.x[1:NT+1])
+                zt.append(Swim.Wake.z[1:NT+1])
+                if SW_PARTICLES:
+                    xt.append(Swim.Particles.x[:Swim.Particles.n])
+                    zt.append(Swim.Particles.z[:Swim.Particles.n])
+            (xt, zt) = (np.hstack(xt), np.hstack(zt))
+
+            # All point vortices influencing the targets
+            if SW_PARALLEL_ROLLUP:
+                (xs, zs, gs) = point_vortices(Swimmers)
+                ROLLUP_POOL.submit(vortex_velocity, xt, zt, xs, zs, gs, DELTA_CORE, P['N_WORKERS'])
+                (vx, vz) = (np.zeros(xt.size), np.zeros(xt.size))
+            elif SW_BARNES_HUT:
+                (xs, zs, gs) = point_vortices(Swimmers)
+                Tree = VortexQuadtree(xs, zs, gs, P['BH_ORDER'], P['BH_LEAF'])
+                (vx, vz) = Tree.velocity(xt, zt, P['BH_THETA'], DELTA_CORE)
+            elif SW_VIC:
+                (vx, vz) = vic_velocity(Swimmers, xt, zt, P, DELTA_CORE)
+            else:
+                # Wake vortices and particles influence each other, so their
+                # velocities come from the symmetric kernel; the targets are
+                # all of them except each wake's first node and the
+                # particles' tail vortices
+                (xs, zs, gs) = wake_vortices(Swimmers)
+                (vx_w, vz_w) = vortex_self_velocity(xs, zs, gs, DELTA_CORE)
+                (targets, k) = ([], 0)
+                for Swim in Swimmers:
+                    NT = Swim.Wake.n
+                    targets.append(np.arange(k+1, k+NT+1))
+                    k += NT+1
+                    if Swim.Particles.n > 0:
+                        if SW_PARTICLES:
+                            targets.append(np.arange(k, k+Swim.Particles.n))
+                        k += Swim.Particles.n+1
+                targets = np.hstack(targets)
+                (vx, vz) = (vx_w[targets], vz_w[targets])
+
+                # Body and edge vortices influencing the targets
+                (xs, zs, gs) = ([], [], [])
+                for Swim in Swimmers:
+                    xs += [Swim.Body.AF.x, Swim.Edge.x]
+                    zs += [Swim.Body.AF.z, Swim.Edge.z]
+                    gs += [Swim.Body.gamma, Swim.Edge.gamma]
+                (vx_b, vz_b) = vortex_velocity(xt, zt, np.hstack(xs), np.hstack(zs), np.hstack(gs), DELTA_CORE)
+                vx += vx_b
+                vz += vz_b
+
+            # Body source panels influencing the targets
+            for SwimI in Swimmers:
+                (vx_s, vz_s) = body_source_velocity(xt, zt, SwimI.Body)
+                vx += vx_s
+                vz += vz_s
+
+            if SW_PARALLEL_ROLLUP:
+                # Add the body sources to the workers' results in place
+                (vx_v, vz_v) = ROLLUP_POOL.result()
+                vx_v += vx
+                vz_v += vz
+                (vx, vz) = (vx_v, vz_v)
+
+            k = 0
+            for Swim in Swimmers:
+                NT = Swim.Wake.n
+                (Swim.Wake.vx, Swim.Wake.vz) = (vx[k:k+NT], vz[k:k+NT])
+                k += NT
+                if SW_PARTICLES:
+                    Particles = Swim.Particles
+                    (Particles.vx, Particles.vz) = (vx[k:k+Particles.n], vz[k:k+Particles.n])
+                    k += Particles.n
     
             for Swim in Swimmers:
                 # Modify wake with the total induced velocity
-                Swim.Wake.x[1:i+1] += Swim.Wake.vx*DEL_T
-                Swim.Wake.z[1:i+1] += Swim.Wake.vz*DEL_T
\ No newline at end of file
+                Swim.Wake.x[1:Swim.Wake.n+1] += Swim.Wake.vx*DEL_T
+                Swim.Wake.z[1:Swim.Wake.n+1] += Swim.Wake.vz*DEL_T
+                if SW_PARTICLES:
+                    Swim.Particles.x[:Swim.Particles.n] += Swim.Particles.vx*DEL_T
+                    Swim.Particles.z[:Swim.Particles.n] += Swim.Particles.vz*DEL_T
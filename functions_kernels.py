@@ -0,0 +1,559 @@
+# -*- coding: utf-8 -*-
+"""Module for the panel and point vortex kernels, with interchangeable backends.
+
+Every kernel is called through the functions at the end of this module, which
+use the implementation of the backend chosen with set_backend(). The 'numpy'
+backend is the reference. The 'numexpr' and 'numba' backends are available
+when those packages are installed; they fuse each kernel's expression into
+one pass without intermediate arrays and agree with the reference to
+round-off. The 'complex' backend evaluates the panel and point vortex
+kernels from complex point coordinates instead of transformed ones. A backend only overrides the
+kernels it accelerates, the others come from the reference.
+"""
+import numpy as np
+
+try:
+    import numexpr as ne
+except ImportError:
+    ne = None
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# Kernel implementations of each backend, by kernel name
+BACKENDS = {}
+
+# Implementations in use, set by set_backend()
+KERNELS = {}
+
+def register(name, **kernels):
+    """Adds a backend, taking the kernels it doesn't provide from 'numpy'."""
+    BACKENDS[name] = dict(BACKENDS.get('numpy', {}), **kernels)
+
+def set_backend(name):
+    """Selects the backend used by all kernels from now on.
+
+    Args:
+        name: Backend name, 'numpy', 'numexpr', 'numba' or 'complex'.
+    """
+    if name not in BACKENDS:
+        print 'ERROR! Kernel backend "%s" is unknown or its package is not installed.' % name
+        raise ValueError('ERROR! Invalid kernel backend.')
+    KERNELS.clear()
+    KERNELS.update(BACKENDS[name])
+    KERNELS['name'] = name
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# NumPy reference backend                                                     #
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+def numpy_transformation(xt, zt, xi, zi, tx, tz):
+    """Transforms points into panels' reference frames (see transformation())."""
+    # NI is N influences, NT is N targets
+    NT = np.size(xt)
+    NI = np.size(xi)-1
+
+    # Intermediary variables to reduce number of tile/repeat operations
+    # From normalvectors: tx==nz, tz==-nx
+    x_tile = np.repeat(xt[:,np.newaxis],NI,1) - np.repeat(xi[:-1,np.newaxis].T,NT,0)
+    z_tile = np.repeat(zt[:,np.newaxis],NI,1) - np.repeat(zi[:-1,np.newaxis].T,NT,0)
+    tx_tile = np.repeat(tx[:,np.newaxis].T,NT,0)
+    tz_tile = np.repeat(tz[:,np.newaxis].T,NT,0)
+
+    # Transforming left side collocation points from global to local coordinates
+    xp1 = x_tile*tx_tile + z_tile*tz_tile
+    zp = x_tile*(-tz_tile) + z_tile*tx_tile
+
+    # Transforming right side panel points into local coordinate system
+    dummy = (xi[1:]-xi[:-1])*tx + (zi[1:]-zi[:-1])*tz
+    xp2 = xp1 - np.repeat(dummy[:,np.newaxis].T,NT,0)
+
+    return(xp1,xp2,zp)
+
+def numpy_doublet_panel(xp1, xp2, zp, mask):
+    """Returns a matrix of doublet panel influence coefficients."""
+    return(mask*(np.arctan2(zp,xp1) - np.arctan2(zp,xp2))/(2*np.pi))
+
+def numpy_body_panel(xp1, xp2, zp, ep, source, doublet):
+    """Fills source and doublet coefficient matrices (see panel_coefficients())."""
+    work1 = np.empty(zp.shape)
+    work2 = np.empty(zp.shape)
+
+    # Angle subtended by each panel, arctan2(zp,xp2) - arctan2(zp,xp1)
+    np.arctan2(zp, xp2, out=doublet)
+    doublet -= np.arctan2(zp, xp1, out=work1)
+
+    # xp1*log(xp1**2 + zp**2) - xp2*log(xp2**2 + zp**2)
+    zp2 = np.multiply(zp, zp, out=work1)
+    np.multiply(xp2, xp2, out=work2)
+    work2 += zp2
+    np.log(work2, out=work2)
+    work2 *= xp2
+    np.multiply(xp1, xp1, out=source)
+    source += zp2
+    np.log(source, out=source)
+    source *= xp1
+    source -= work2
+
+    # - 2*(xp1 - xp2) + 2*zp*(angle)
+    np.subtract(xp1, xp2, out=work2)
+    work2 *= 2
+    source -= work2
+    np.multiply(zp, doublet, out=work2)
+    work2 *= 2
+    source += work2
+
+    source /= 4*np.pi
+    doublet /= -2*np.pi
+
+    # Ignore sources and doublets that get too close to a target
+    near = np.less(np.absolute(zp, out=work1), ep)
+    source[near] = 0.
+    doublet[near] = 0.
+
+def numpy_panel_coefficients(xt, zt, xi, zi, tx, tz, ep, source, doublet):
+    """Fills source and doublet coefficient matrices (see panel_coefficients())."""
+    (xp1, xp2, zp) = KERNELS['transformation'](xt, zt, xi, zi, tx, tz)
+    KERNELS['body_panel'](xp1, xp2, zp, ep, source, doublet)
+
+def numpy_panel_doublets(xt, zt, xi, zi, tx, tz, ep):
+    """Returns a doublet coefficient matrix (see panel_doublets())."""
+    (xp1, xp2, zp) = KERNELS['transformation'](xt, zt, xi, zi, tx, tz)
+    # Calculate 'Mask' - if a doublet gets too close then ignore its influence
+    mask = np.greater_equal(np.absolute(zp),ep)
+    return KERNELS['doublet_panel'](xp1, xp2, zp, mask)
+
+def numpy_source_velocity(xt, zt, xi, zi, tx, tz, beta, sigma):
+    """Returns the velocity induced by source panels (see source_velocity())."""
+    (xp1, xp2, zp) = KERNELS['transformation'](xt, zt, xi, zi, tx, tz)
+
+    # Katz-Plotkin eqns 10.20 and 10.21 for body source influence
+    dummy1 = np.log((xp1**2+zp**2)/(xp2**2+zp**2))/(4*np.pi)
+    dummy2 = (np.arctan2(zp,xp2)-np.arctan2(zp,xp1))/(2*np.pi)
+
+    # Rotate back to global coordinates
+    dummy3 = dummy1*np.cos(beta) - dummy2*np.sin(beta)
+    dummy4 = dummy1*np.sin(beta) + dummy2*np.cos(beta)
+
+    # Finish eqns 10.20 and 10.21 for induced velocity by multiplying with sigma
+    return(np.dot(dummy3, sigma), np.dot(dummy4, sigma))
+
+def numpy_vortex_velocity(xt, zt, xs, zs, gs, DELTA_CORE, block):
+    """Returns the velocity induced by point vortices (see vortex_velocity())."""
+    vx = np.zeros(xt.size)
+    vz = np.zeros(xt.size)
+    for k0 in xrange(0, xt.size, block):
+        k1 = min(k0+block, xt.size)
+        xp = xt[k0:k1,np.newaxis] - xs
+        zp = zt[k0:k1,np.newaxis] - zs
+        w = 1. / (2*np.pi*(xp**2 + zp**2 + DELTA_CORE**2))
+        vx[k0:k1] = np.dot(zp*w, gs)
+        vz[k0:k1] = -np.dot(xp*w, gs)
+
+    return(vx, vz)
+
+def numpy_vortex_self_velocity(xs, zs, gs, DELTA_CORE, block):
+    """Returns the point vortices' mutual velocity (see vortex_self_velocity())."""
+    vx = np.zeros(xs.size)
+    vz = np.zeros(xs.size)
+    for k0 in xrange(0, xs.size, block):
+        k1 = min(k0+block, xs.size)
+        for j0 in xrange(k0, xs.size, block):
+            j1 = min(j0+block, xs.size)
+            xp = xs[k0:k1,np.newaxis] - xs[j0:j1]
+            zp = zs[k0:k1,np.newaxis] - zs[j0:j1]
+            w = 1. / (2*np.pi*(xp**2 + zp**2 + DELTA_CORE**2))
+            xp *= w
+            zp *= w
+            vx[k0:k1] += np.dot(zp, gs[j0:j1])
+            vz[k0:k1] -= np.dot(xp, gs[j0:j1])
+            if j0 > k0:
+                # The same pairs seen from block j, where xp and zp change sign
+                vx[j0:j1] -= np.dot(gs[k0:k1], zp)
+                vz[j0:j1] += np.dot(gs[k0:k1], xp)
+
+    return(vx, vz)
+
+register('numpy', transformation=numpy_transformation,
+         doublet_panel=numpy_doublet_panel,
+         body_panel=numpy_body_panel,
+         panel_coefficients=numpy_panel_coefficients,
+         panel_doublets=numpy_panel_doublets,
+         source_velocity=numpy_source_velocity,
+         vortex_velocity=numpy_vortex_velocity,
+         vortex_self_velocity=numpy_vortex_self_velocity)
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# numexpr backend: each expression evaluated in one pass over the arrays      #
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+if ne is not None:
+    def numexpr_transformation(xt, zt, xi, zi, tx, tz):
+        """Transforms points into panels' reference frames (see transformation())."""
+        env = {'xt': xt[:,np.newaxis], 'zt': zt[:,np.newaxis], 'xi': xi[:-1], 'zi': zi[:-1],
+               'tx': tx, 'tz': tz, 'length': (xi[1:]-xi[:-1])*tx + (zi[1:]-zi[:-1])*tz}
+        xp1 = ne.evaluate('(xt - xi)*tx + (zt - zi)*tz', env)
+        zp = ne.evaluate('(zt - zi)*tx - (xt - xi)*tz', env)
+        xp2 = ne.evaluate('xp1 - length', {'xp1': xp1, 'length': env['length']})
+
+        return(xp1, xp2, zp)
+
+    def numexpr_doublet_panel(xp1, xp2, zp, mask):
+        """Returns a matrix of doublet panel influence coefficients."""
+        return ne.evaluate('where(mask, (arctan2(zp, xp1) - arctan2(zp, xp2))/(2*pi), 0.)',
+                           {'xp1': xp1, 'xp2': xp2, 'zp': zp, 'mask': mask, 'pi': np.pi})
+
+    def numexpr_body_panel(xp1, xp2, zp, ep, source, doublet):
+        """Fills source and doublet coefficient matrices (see panel_coefficients())."""
+        # Angle subtended by each panel first, shared by both coefficients
+        env = {'xp1': xp1, 'xp2': xp2, 'zp': zp, 'ep': ep, 'angle': doublet, 'pi': np.pi}
+        ne.evaluate('where(abs(zp) < ep, 0., arctan2(zp, xp2) - arctan2(zp, xp1))', env, out=doublet)
+        ne.evaluate('(xp1*log(xp1**2 + zp**2) - xp2*log(xp2**2 + zp**2) - 2*(xp1 - xp2) + 2*zp*angle)/(4*pi)',
+                    env, out=source)
+        ne.evaluate('where(abs(zp) < ep, 0., source)', {'zp': zp, 'ep': ep, 'source': source}, out=source)
+        ne.evaluate('angle/(-2*pi)', env, out=doublet)
+
+    def numexpr_source_velocity(xt, zt, xi, zi, tx, tz, beta, sigma):
+        """Returns the velocity induced by source panels (see source_velocity())."""
+        (xp1, xp2, zp) = numexpr_transformation(xt, zt, xi, zi, tx, tz)
+
+        # Katz-Plotkin eqns 10.20 and 10.21, rotated back to global coordinates
+        env = {'xp1': xp1, 'xp2': xp2, 'zp': zp, 'cb': np.cos(beta), 'sb': np.sin(beta), 'pi': np.pi}
+        dummy3 = ne.evaluate('log((xp1**2 + zp**2)/(xp2**2 + zp**2))/(4*pi)*cb'
+                             ' - (arctan2(zp, xp2) - arctan2(zp, xp1))/(2*pi)*sb', env)
+        dummy4 = ne.evaluate('log((xp1**2 + zp**2)/(xp2**2 + zp**2))/(4*pi)*sb'
+                             ' + (arctan2(zp, xp2) - arctan2(zp, xp1))/(2*pi)*cb', env)
+
+        return(np.dot(dummy3, sigma), np.dot(dummy4, sigma))
+
+    def numexpr_vortex_velocity(xt, zt, xs, zs, gs, DELTA_CORE, block):
+        """Returns the velocity induced by point vortices (see vortex_velocity())."""
+        vx = np.zeros(xt.size)
+        vz = np.zeros(xt.size)
+        for k0 in xrange(0, xt.size, block):
+            k1 = min(k0+block, xt.size)
+            env = {'xt': xt[k0:k1,np.newaxis], 'zt': zt[k0:k1,np.newaxis], 'xs': xs, 'zs': zs,
+                   'd2': DELTA_CORE**2, 'pi': np.pi}
+            vx[k0:k1] = np.dot(ne.evaluate('(zt - zs)/(2*pi*((xt - xs)**2 + (zt - zs)**2 + d2))', env), gs)
+            vz[k0:k1] = -np.dot(ne.evaluate('(xt - xs)/(2*pi*((xt - xs)**2 + (zt - zs)**2 + d2))', env), gs)
+
+        return(vx, vz)
+
+    register('numexpr', transformation=numexpr_transformation,
+             doublet_panel=numexpr_doublet_panel,
+             body_panel=numexpr_body_panel,
+             source_velocity=numexpr_source_velocity,
+             vortex_velocity=numexpr_vortex_velocity)
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Numba backend: compiled loops over targets, in parallel                     #
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+if numba is not None:
+    @numba.njit(parallel=True, cache=True)
+    def numba_transformation_loop(xt, zt, xi, zi, tx, tz, xp1, xp2, zp):
+        for k in numba.prange(xt.size):
+            for j in range(tx.size):
+                dx = xt[k] - xi[j]
+                dz = zt[k] - zi[j]
+                xp1[k,j] = dx*tx[j] + dz*tz[j]
+                zp[k,j] = dz*tx[j] - dx*tz[j]
+                xp2[k,j] = xp1[k,j] - ((xi[j+1] - xi[j])*tx[j] + (zi[j+1] - zi[j])*tz[j])
+
+    def numba_transformation(xt, zt, xi, zi, tx, tz):
+        """Transforms points into panels' reference frames (see transformation())."""
+        shape = (xt.size, tx.size)
+        (xp1, xp2, zp) = (np.empty(shape), np.empty(shape), np.empty(shape))
+        numba_transformation_loop(xt, zt, xi, zi, tx, tz, xp1, xp2, zp)
+        return(xp1, xp2, zp)
+
+    @numba.njit(parallel=True, cache=True)
+    def numba_panel_loop(xp1, xp2, zp, mask, source, doublet, with_source):
+        for k in numba.prange(zp.shape[0]):
+            for j in range(zp.shape[1]):
+                if not mask[k,j]:
+                    if with_source:
+                        source[k,j] = 0.
+                    doublet[k,j] = 0.
+                    continue
+                x1 = xp1[k,j]
+                x2 = xp2[k,j]
+                z = zp[k,j]
+                angle = np.arctan2(z, x2) - np.arctan2(z, x1)
+                if with_source:
+                    source[k,j] = (x1*np.log(x1*x1 + z*z) - x2*np.log(x2*x2 + z*z)
+                                   - 2*(x1 - x2) + 2*z*angle) / (4*np.pi)
+                doublet[k,j] = -angle / (2*np.pi)
+
+    def numba_doublet_panel(xp1, xp2, zp, mask):
+        """Returns a matrix of doublet panel influence coefficients."""
+        doublet = np.empty(zp.shape)
+        numba_panel_loop(xp1, xp2, zp, np.broadcast_to(mask, zp.shape), doublet, doublet, False)
+        return doublet
+
+    def numba_body_panel(xp1, xp2, zp, ep, source, doublet):
+        """Fills source and doublet coefficient matrices (see panel_coefficients())."""
+        numba_panel_loop(xp1, xp2, zp, np.absolute(zp) >= ep, source, doublet, True)
+
+    @numba.njit(parallel=True, cache=True)
+    def numba_source_velocity_loop(xt, zt, xi, zi, tx, tz, beta, sigma, vx, vz):
+        for k in numba.prange(xt.size):
+            u = 0.
+            w = 0.
+            for j in range(tx.size):
+                dx = xt[k] - xi[j]
+                dz = zt[k] - zi[j]
+                x1 = dx*tx[j] + dz*tz[j]
+                z = dz*tx[j] - dx*tz[j]
+                x2 = x1 - ((xi[j+1] - xi[j])*tx[j] + (zi[j+1] - zi[j])*tz[j])
+                # Katz-Plotkin eqns 10.20 and 10.21, rotated back to global coordinates
+                d1 = np.log((x1*x1 + z*z)/(x2*x2 + z*z)) / (4*np.pi)
+                d2 = (np.arctan2(z, x2) - np.arctan2(z, x1)) / (2*np.pi)
+                u += (d1*np.cos(beta[j]) - d2*np.sin(beta[j])) * sigma[j]
+                w += (d1*np.sin(beta[j]) + d2*np.cos(beta[j])) * sigma[j]
+            vx[k] = u
+            vz[k] = w
+
+    def numba_source_velocity(xt, zt, xi, zi, tx, tz, beta, sigma):
+        """Returns the velocity induced by source panels (see source_velocity())."""
+        (vx, vz) = (np.empty(xt.size), np.empty(xt.size))
+        numba_source_velocity_loop(xt, zt, xi, zi, tx, tz, beta, sigma, vx, vz)
+        return(vx, vz)
+
+    @numba.njit(parallel=True, cache=True)
+    def numba_vortex_loop(xt, zt, xs, zs, gs, d2, vx, vz):
+        for k in numba.prange(xt.size):
+            u = 0.
+            w = 0.
+            for j in range(xs.size):
+                dx = xt[k] - xs[j]
+                dz = zt[k] - zs[j]
+                g = gs[j] / (2*np.pi*(dx*dx + dz*dz + d2))
+                u += dz*g
+                w -= dx*g
+            vx[k] = u
+            vz[k] = w
+
+    def numba_vortex_velocity(xt, zt, xs, zs, gs, DELTA_CORE, block):
+        """Returns the velocity induced by point vortices (see vortex_velocity())."""
+        (vx, vz) = (np.empty(xt.size), np.empty(xt.size))
+        numba_vortex_loop(xt, zt, xs, zs, gs, DELTA_CORE**2, vx, vz)
+        return(vx, vz)
+
+    def numba_vortex_self_velocity(xs, zs, gs, DELTA_CORE, block):
+        """Returns the point vortices' mutual velocity (see vortex_self_velocity())."""
+        # Each target's sum is a separate parallel loop, which outruns
+        # sharing the pairs between targets
+        return numba_vortex_velocity(xs, zs, xs, zs, gs, DELTA_CORE, block)
+
+    register('numba', transformation=numba_transformation,
+             doublet_panel=numba_doublet_panel,
+             body_panel=numba_body_panel,
+             source_velocity=numba_source_velocity,
+             vortex_velocity=numba_vortex_velocity,
+             vortex_self_velocity=numba_vortex_self_velocity)
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Complex backend: kernels as parts of log((z-z1)/(z-z2)) and 1/(z-zs)       #
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+# For a target z and a panel from z1 to z2, the angle the panel subtends,
+# arctan2(zp,xp1) - arctan2(zp,xp2), is the argument of (z-z1)/(z-z2), and
+# log(r1/r2) its log-modulus. Neither depends on the panel's orientation, so
+# the doublet and source velocity kernels need no coordinate transformation
+# and one arctan2 per pair instead of two. The source potential also needs
+# the target's tangential distance xp1 and both log(r**2), which replace
+# the second arctan2. Targets on a panel's line (zp == 0), where the two
+# angles can differ by 2*pi, are ignored like in the other backends.
+# Velocities are summed as conjugate velocities u - i*w, so the panels'
+# orientations only enter through their complex strengths, and a point
+# vortex of circulation gamma at zs gives i*gamma/(2*pi) * conj(d)/|d|**2,
+# d = z-zs, regularized by adding DELTA_CORE**2 to |d|**2.
+
+def complex_offsets(xt, zt, xi, zi):
+    """Returns z-z1 and z-z2 for every target z and panel (z1, z2)."""
+    z_t = (xt + 1j*zt)[:,np.newaxis]
+    z_i = xi + 1j*zi
+    return(z_t - z_i[:-1], z_t - z_i[1:])
+
+def complex_panel_coefficients(xt, zt, xi, zi, tx, tz, ep, source, doublet):
+    """Fills source and doublet coefficient matrices (see panel_coefficients())."""
+    (w1, w2) = complex_offsets(xt, zt, xi, zi)
+    length = (xi[1:]-xi[:-1])*tx + (zi[1:]-zi[:-1])*tz
+
+    # Angle subtended by each panel, arg(w1/w2) == arg(w1*conj(w2))
+    angle = np.angle(w1 * np.conj(w2))
+    # Target position relative to the panel's first endpoint, in its frame
+    xp1 = w1.real*tx + w1.imag*tz
+    zp = w1.imag*tx - w1.real*tz
+    log_r1 = np.log(w1.real**2 + w1.imag**2)
+    log_r2 = np.log(w2.real**2 + w2.imag**2)
+
+    # xp1*log(r1**2) - xp2*log(r2**2) - 2*(xp1 - xp2) + 2*zp*(-angle), xp2 = xp1 - length
+    source[:] = (xp1*(log_r1 - log_r2) + length*(log_r2 - 2.) - 2*zp*angle) / (4*np.pi)
+    doublet[:] = angle / (2*np.pi)
+
+    # Ignore sources and doublets that get too close to a target
+    near = np.less(np.absolute(zp), ep)
+    source[near] = 0.
+    doublet[near] = 0.
+
+def complex_panel_doublets(xt, zt, xi, zi, tx, tz, ep):
+    """Returns a doublet coefficient matrix (see panel_doublets())."""
+    (w1, w2) = complex_offsets(xt, zt, xi, zi)
+    doublet = np.angle(w1 * np.conj(w2)) / (2*np.pi)
+
+    # Ignore doublets that get too close to a target
+    doublet[np.absolute(w1.imag*tx - w1.real*tz) < ep] = 0.
+    return doublet
+
+def complex_source_velocity(xt, zt, xi, zi, tx, tz, beta, sigma):
+    """Returns the velocity induced by source panels (see source_velocity())."""
+    (w1, w2) = complex_offsets(xt, zt, xi, zi)
+
+    # Katz-Plotkin eqns 10.20 and 10.21 in a panel's frame are
+    # conj(log(w1/w2))/(2*pi), so the global conjugate velocity is
+    # log(w1/w2) times the strengths rotated once by -beta
+    w = np.dot(np.log(w1 / w2), sigma * np.exp(-1j*beta) / (2*np.pi))
+    return(w.real, -w.imag)
+
+def complex_vortex_velocity(xt, zt, xs, zs, gs, DELTA_CORE, block):
+    """Returns the velocity induced by point vortices (see vortex_velocity())."""
+    z_t = xt + 1j*zt
+    z_s = xs + 1j*zs
+    g = 1j*gs / (2*np.pi)
+    w = np.zeros(xt.size, dtype=complex)
+    for k0 in xrange(0, xt.size, block):
+        k1 = min(k0+block, xt.size)
+        d = z_t[k0:k1,np.newaxis] - z_s
+        w[k0:k1] = np.dot(np.conj(d) / (d.real**2 + d.imag**2 + DELTA_CORE**2), g)
+
+    return(w.real, -w.imag)
+
+def complex_vortex_self_velocity(xs, zs, gs, DELTA_CORE, block):
+    """Returns the point vortices' mutual velocity (see vortex_self_velocity())."""
+    z_s = xs + 1j*zs
+    g = 1j*gs / (2*np.pi)
+    w = np.zeros(xs.size, dtype=complex)
+    for k0 in xrange(0, xs.size, block):
+        k1 = min(k0+block, xs.size)
+        for j0 in xrange(k0, xs.size, block):
+            j1 = min(j0+block, xs.size)
+            d = z_s[k0:k1,np.newaxis] - z_s[j0:j1]
+            kernel = np.conj(d) / (d.real**2 + d.imag**2 + DELTA_CORE**2)
+            w[k0:k1] += np.dot(kernel, g[j0:j1])
+            if j0 > k0:
+                # The same pairs seen from block j, where the kernel changes sign
+                w[j0:j1] -= np.dot(g[k0:k1], kernel)
+
+    return(w.real, -w.imag)
+
+register('complex', panel_coefficients=complex_panel_coefficients,
+         panel_doublets=complex_panel_doublets,
+         source_velocity=complex_source_velocity,
+         vortex_velocity=complex_vortex_velocity,
+         vortex_self_velocity=complex_vortex_self_velocity)
+
+set_backend('numpy')
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Kernels, evaluated by the selected backend                                  #
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+def panel_transformation(xt, zt, xi, zi, tx, tz):
+    """Returns targets' coordinates in panels' frames (see transformation())."""
+    return KERNELS['transformation'](xt, zt, xi, zi, tx, tz)
+
+def panel_coefficients(xt, zt, xi, zi, tx, tz, ep, source, doublet):
+    """Fills the source and doublet panel influence coefficients of panels.
+
+    Transforms the targets into the panels' frames (see transformation()),
+    computes the angle term shared by both coefficients only once and works
+    in place on the given arrays. Influences of panels closer than ep to a
+    target (in the panel's normal direction) are set to zero.
+
+    Args:
+        xt, zt: Target point coordinates.
+        xi, zi: Panel endpoint coordinates.
+        tx, tz: Panel tangent vectors.
+        ep: Near-field distance below which an influence is ignored.
+        source: Array to write the source coefficients into.
+        doublet: Array to write the doublet coefficients into.
+    """
+    KERNELS['panel_coefficients'](xt, zt, xi, zi, tx, tz, ep, source, doublet)
+
+def panel_doublets(xt, zt, xi, zi, tx, tz, ep):
+    """Returns the doublet panel influence coefficients of panels.
+
+    Influences of panels closer than ep to a target (in the panel's normal
+    direction) are set to zero.
+
+    Args:
+        xt, zt: Target point coordinates.
+        xi, zi: Panel endpoint coordinates.
+        tx, tz: Panel tangent vectors.
+        ep: Near-field distance below which an influence is ignored.
+
+    Returns:
+        doublet: Matrix of doublet panel influence coefficients.
+    """
+    return KERNELS['panel_doublets'](xt, zt, xi, zi, tx, tz, ep)
+
+def source_velocity(xt, zt, xi, zi, tx, tz, beta, sigma):
+    """Returns the velocity induced by source panels at targets.
+
+    Uses Katz-Plotkin eqns 10.20 and 10.21 in each panel's frame, rotated
+    back to global coordinates.
+
+    Args:
+        xt, zt: Target point coordinates.
+        xi, zi: Panel endpoint coordinates.
+        tx, tz: Panel tangent vectors.
+        beta: Angle of each panel's normal vector with the global z-axis.
+        sigma: Source strengths.
+
+    Returns:
+        vx, vz: Induced velocity components at the targets.
+    """
+    return KERNELS['source_velocity'](xt, zt, xi, zi, tx, tz, beta, sigma)
+
+def vortex_velocity(xt, zt, xs, zs, gs, DELTA_CORE, block=512):
+    """Returns the velocity induced by regularized point vortices at targets.
+
+    Uses Katz-Plotkin eqns 10.9 and 10.10 with the vortex core DELTA_CORE,
+    broadcasting over blocks of at most block targets so that no tiled
+    coordinate matrices are formed.
+
+    Args:
+        xt, zt: Target point coordinates.
+        xs, zs: Point vortex coordinates.
+        gs: Point vortex circulations.
+        DELTA_CORE: Vortex core radius.
+        block: Number of targets evaluated at once.
+
+    Returns:
+        vx, vz: Induced velocity components at the targets.
+    """
+    return KERNELS['vortex_velocity'](xt, zt, xs, zs, gs, DELTA_CORE, block)
+
+def vortex_self_velocity(xs, zs, gs, DELTA_CORE, block=256):
+    """Returns the velocity that regularized point vortices induce on each other.
+
+    Gives the same result as vortex_velocity(xs, zs, xs, zs, gs, DELTA_CORE).
+    The kernel of Katz-Plotkin eqns 10.9 and 10.10 is antisymmetric in the
+    two points, so each pair of blocks of at most block vortices is formed
+    once and used for both directions. Only block x block workspace exists
+    at any time.
+
+    Args:
+        xs, zs: Point vortex coordinates.
+        gs: Point vortex circulations.
+        DELTA_CORE: Vortex core radius.
+        block: Number of vortices in a block.
+
+    Returns:
+        vx, vz: Induced velocity components at the point vortices.
+    """
+    return KERNELS['vortex_self_velocity'](xs, zs, gs, DELTA_CORE, block)
@@ -0,0 +1,86 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+BEM-2D
+A 2D boundary element method code
+
+"""
+import numpy as np
+
+class HistoryBuffer(object):
+    'Newest-first history of arrays with constant cost time stepping'
+    # Smallest number of entries allocated
+    MIN_CAPACITY = 16
+
+    def __init__(self, length, shape=(), max_length=None):
+        """
+        Initializes a history of length zero-filled entries.
+
+        The entries are kept at the end of a larger array, newest first, so
+        that a new entry is added by moving the start of the view back by one
+        instead of shifting every entry. The array is only copied when the
+        start reaches its beginning, into an array with room for as many new
+        entries again as there are entries kept.
+
+        Args:
+            length (int): Initial number of entries.
+            shape (tuple): Shape of each entry.
+            max_length (int): The oldest entries are dropped beyond this
+                length. None for no limit.
+
+        Attributes:
+            data (float): Array the entries are stored in.
+            start (int): Index of the newest entry in data.
+            length (int): Number of entries.
+        """
+        self.shape = shape
+        self.max_length = max_length
+        self.length = length
+        self.data = np.zeros((self.capacity(length),) + shape)
+        self.start = self.data.shape[0] - length
+
+    def capacity(self, length):
+        """Returns the array length allocated for length entries."""
+        return max(2*length, self.MIN_CAPACITY)
+
+    def view(self):
+        """Returns the entries, newest first, as a view of the array."""
+        return self.data[self.start:self.start+self.length]
+
+    def push(self, value=None):
+        """
+        Adds a new entry in front of the others.
+
+        Args:
+            value (float): The new entry. A copy of the newest entry if None,
+                as archive() leaves it.
+        """
+        if self.start == 0:
+            self.relocate(self.length)
+        self.start -= 1
+        if value is None:
+            value = self.data[self.start+1] if self.length > 0 else 0.
+        self.data[self.start] = value
+        if (self.max_length is None or self.length < self.max_length):
+            self.length += 1
+
+    def resize(self, length):
+        """
+        Changes the number of entries, dropping or adding the oldest ones.
+        Added entries are zero.
+
+        Args:
+            length (int): New number of entries.
+        """
+        if self.start + length > self.data.shape[0]:
+            self.relocate(length)
+        if length > self.length:
+            self.data[self.start+self.length:self.start+length] = 0.
+        self.length = length
+
+    def relocate(self, length):
+        """Moves the entries to the end of a new array with room for length entries."""
+        data = np.zeros((self.capacity(length),) + self.shape)
+        start = data.shape[0] - length
+        data[start:start+self.length] = self.view()
+        (self.data, self.start) = (data, start)
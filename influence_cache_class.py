@@ -0,0 +1,145 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+BEM-2D
+A 2D boundary element method code
+
+"""
+import numpy as np
+from scipy.linalg import lu_factor, lu_solve
+
+class InfluenceCache(object):
+    'Body-frame influence coefficients that persist between time steps'
+    # Allowed change in the relative geometry (scaled by the formation size)
+    # before the cached matrices are rebuilt
+    GEOM_TOL = 1e-12
+
+    def __init__(self):
+        """
+        Initializes an empty cache. The matrices are built by the first call
+        to influence_matrices() and reused for as long as the relative
+        geometry of the bodies and edge panels does not change.
+
+        Attributes:
+            geometry (complex): Body nodes, collocation points and edge nodes
+                of all Swimmers expressed in the frame of the first body.
+            a_bodydoublet (float): Body doublet panels' influence matrix.
+            b_bodysource (float): Body source panels' influence matrix.
+            b_edgedoublet (float): Edge panels' influence matrix.
+            lu_implicit (tuple): LU factors of a_bodydoublet.
+            mu_unit (float): Body doublet strengths induced by a unit strength
+                on each edge panel (one column per edge panel).
+            n_builds (int): Number of times the matrices have been built.
+        """
+        self.geometry = None
+        self.a_bodydoublet = None
+        self.b_bodysource = None
+        self.b_edgedoublet = None
+        self.lu_implicit = None
+        self.mu_unit = None
+        self.n_builds = 0
+
+    def relative_geometry(self, Swimmers):
+        """
+        Collects the geometry that the body and edge influence coefficients
+        depend on, expressed relative to the first body's trailing edge panel.
+        A rigid motion of the whole formation leaves this array unchanged.
+
+        Args:
+            Swimmers (list): List of Swimmer objects being simulated.
+
+        Returns:
+            geometry (complex): Relative positions of all influence and target
+                points.
+        """
+        Body = Swimmers[0].Body
+        origin = Body.AF.x[0] + 1j*Body.AF.z[0]
+        rotation = Body.geom.tx[0] - 1j*Body.geom.tz[0]
+
+        points = []
+        for Swim in Swimmers:
+            points.append(Swim.Body.AF.x     + 1j*Swim.Body.AF.z)
+            points.append(Swim.Body.AF.x_col + 1j*Swim.Body.AF.z_col)
+            points.append(Swim.Edge.x        + 1j*Swim.Edge.z)
+
+        return((np.hstack(points) - origin) * rotation)
+
+    def is_current(self, Swimmers):
+        """
+        Checks whether the cached matrices still describe the Swimmers.
+
+        Args:
+            Swimmers (list): List of Swimmer objects being simulated.
+
+        Returns:
+            current (bool): True if the cached matrices can be reused.
+        """
+        if self.geometry is None:
+            return False
+
+        geometry = self.relative_geometry(Swimmers)
+        if (geometry.shape != self.geometry.shape):
+            return False
+
+        scale = np.max(np.absolute(self.geometry))
+        return (np.max(np.absolute(geometry - self.geometry)) <= self.GEOM_TOL * scale)
+
+    def store(self, Swimmers, a_bodydoublet, b_bodysource, b_edgedoublet):
+        """
+        Replaces the cached matrices and discards any old LU factors.
+
+        Args:
+            Swimmers (list): List of Swimmer objects being simulated.
+            a_bodydoublet (float): Body doublet panels' influence matrix.
+            b_bodysource (float): Body source panels' influence matrix.
+            b_edgedoublet (float): Edge panels' influence matrix.
+        """
+        self.geometry = self.relative_geometry(Swimmers)
+        self.a_bodydoublet = a_bodydoublet
+        self.b_bodysource = b_bodysource
+        self.b_edgedoublet = b_edgedoublet
+        self.lu_implicit = None
+        self.mu_unit = None
+        self.n_builds += 1
+
+    def body_buffers(self, n_b):
+        """
+        Returns arrays for the next body source and body doublet matrices.
+        The cached matrices are handed back to be overwritten when they have
+        the right size, since they are replaced by the rebuild anyway.
+
+        Args:
+            n_b (int): Total number of body panels.
+
+        Returns:
+            b_bodysource (float): Array for the body source matrix.
+            a_bodydoublet (float): Array for the body doublet matrix.
+        """
+        if (self.b_bodysource is None or self.b_bodysource.shape != (n_b, n_b)):
+            return(np.empty((n_b, n_b)), np.empty((n_b, n_b)))
+
+        self.lu_implicit = None
+        self.mu_unit = None
+        return(self.b_bodysource, self.a_bodydoublet)
+
+    def implicit_lu(self):
+        """
+        Returns the LU factors of the body doublet matrix, factorizing it the
+        first time they are requested after a rebuild.
+        """
+        if self.lu_implicit is None:
+            self.lu_implicit = lu_factor(self.a_bodydoublet)
+
+        return self.lu_implicit
+
+    def edge_response(self):
+        """
+        Returns the body doublet strengths that a unit strength on each edge
+        panel induces, solving for them the first time they are requested
+        after a rebuild. The bodies' doublet strengths for any set of edge
+        strengths mu_e follow by superposition, mu_base + mu_unit * mu_e.
+        """
+        if self.mu_unit is None:
+            self.mu_unit = lu_solve(self.implicit_lu(), -self.b_edgedoublet)
+
+        return self.mu_unit
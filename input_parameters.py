@@ -36,6 +36,30 @@ P = PARAMETERS = {
 , 'DSTEP':              1e-5
 , 'TSTEP':              1e-5
 , 'VERBOSITY':          1
+, 'WAKE_BLOCK':         512
+, 'MP_ORDER':           16
+, 'MP_THETA':           0.5
+, 'MP_NEAR':            64
+, 'MP_CLUSTER':         32
+, 'MP_TOL':             1e-4
+, 'AMALG_AGE':          150
+, 'AMALG_DIST':         0.5
+, 'AMALG_RATIO':        0.1
+, 'PARTICLE_AGE':       60
+, 'TRUNC_MODE':         'fold' # ['drop', 'fold']
+, 'TRUNC_PANELS':       2000
+, 'TRUNC_DIST':         10.
+, 'TRUNC_BYTES':        1e6
+, 'BH_THETA':           0.5
+, 'BH_ORDER':           12
+, 'BH_LEAF':            32
+, 'FMM_IPREC':          5
+, 'VIC_H':              0.005
+, 'VIC_NEAR':           20
+, 'N_WORKERS':          0
+, 'N_THREADS':          1
+, 'ASSEMBLY_TILE':      128
+, 'KERNEL_BACKEND':     'numpy' # ['numpy', 'numexpr', 'numba', 'complex']
 
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 # Fluid Body Constants                                                        #
@@ -107,6 +131,14 @@ P = PARAMETERS = {
 , 'SW_CNST_THK_BM':     True
 , 'SW_RAMP':            False
 , 'SW_FMM':             False
+, 'SW_WAKE_MATRIX_FREE': False
+, 'SW_WAKE_MULTIPOLE':  False
+, 'SW_AMALGAMATE':      False
+, 'SW_PARTICLES':       False
+, 'SW_TRUNCATE':        False
+, 'SW_BARNES_HUT':      False
+, 'SW_VIC':             False
+, 'SW_PARALLEL_ROLLUP': False
 , 'SW_4PRESSURE':       False
 , 'SW_PLOT_FIG':        False
 , 'SW_REL_RESIDUAL':    False
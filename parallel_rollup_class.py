@@ -0,0 +1,141 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+BEM-2D
+A 2D boundary element method code
+
+"""
+import multiprocessing as mp
+from multiprocessing.sharedctypes import RawArray
+import numpy as np
+
+# Views of the shared arrays in a worker process, set by init_worker()
+WORKER = {}
+
+def init_worker(buffers):
+    """Makes a worker process's views of the shared arrays."""
+    WORKER['arrays'] = [np.ctypeslib.as_array(buf) for buf in buffers]
+
+def evaluate_chunk(task):
+    """Evaluates the velocity at a chunk of targets, writing it in the shared arrays."""
+    (kernel, k0, k1, ns, DELTA_CORE) = task
+    (xs, zs, gs, xt, zt, vx, vz) = WORKER['arrays']
+    (vx[k0:k1], vz[k0:k1]) = kernel(xt[k0:k1], zt[k0:k1], xs[:ns], zs[:ns], gs[:ns], DELTA_CORE)
+
+class ParallelRollup(object):
+    'Persistent pool of worker processes evaluating point vortex velocities'
+    # Smallest number of sources and targets allocated
+    MIN_CAPACITY = 1024
+    # Smallest number of targets given to a worker at once
+    MIN_CHUNK = 64
+
+    def __init__(self):
+        """
+        Initializes an executor without workers. The shared arrays and the
+        pool are created by allocate().
+
+        The sources, targets and velocities are kept in shared memory, which
+        the workers map when they are started, so only the chunk bounds are
+        sent to them and the velocities they write are read in place. The
+        arrays are allocated with room to grow, and the pool is only
+        restarted when they have to be enlarged.
+
+        Attributes:
+            n_workers (int): Number of worker processes.
+            Pool (Pool): Worker processes, None until allocate().
+            capacity (int): Number of sources and targets allocated.
+            xs, zs, gs (float): Shared point vortex coordinates and
+                circulations.
+            xt, zt (float): Shared target point coordinates.
+            vx, vz (float): Shared velocity components at the targets.
+            n_s, n_t (int): Number of sources and targets submitted.
+            pending (AsyncResult): Chunks being evaluated, None if none are.
+        """
+        self.n_workers = 0
+        self.Pool = None
+        self.capacity = (0, 0)
+        (self.xs, self.zs, self.gs) = (None, None, None)
+        (self.xt, self.zt, self.vx, self.vz) = (None, None, None, None)
+        (self.n_s, self.n_t) = (0, 0)
+        self.pending = None
+
+    def allocate(self, n_s, n_t, n_workers):
+        """
+        Makes sure that the shared arrays hold n_s sources and n_t targets
+        and that n_workers processes are running, restarting the pool
+        otherwise.
+
+        Args:
+            n_s, n_t (int): Number of sources and targets.
+            n_workers (int): Number of worker processes, the number of CPUs
+                if 0.
+        """
+        n_workers = n_workers if n_workers > 0 else mp.cpu_count()
+        if (self.Pool is not None and n_workers == self.n_workers and
+            n_s <= self.capacity[0] and n_t <= self.capacity[1]):
+            return
+
+        self.close()
+        self.capacity = (max(2*n_s, self.MIN_CAPACITY, self.capacity[0]),
+                         max(2*n_t, self.MIN_CAPACITY, self.capacity[1]))
+        buffers = [RawArray('d', self.capacity[0]) for k in xrange(3)]
+        buffers += [RawArray('d', self.capacity[1]) for k in xrange(4)]
+        (self.xs, self.zs, self.gs, self.xt, self.zt, self.vx, self.vz) = \
+            [np.ctypeslib.as_array(buf) for buf in buffers]
+
+        # The workers inherit the buffers when they are forked
+        self.n_workers = n_workers
+        self.Pool = mp.Pool(n_workers, init_worker, (buffers,))
+
+    def submit(self, kernel, xt, zt, xs, zs, gs, DELTA_CORE, n_workers=0):
+        """
+        Starts the evaluation of the velocity induced by point vortices at
+        target points, split into chunks of targets over the workers. The
+        caller can do other work before collecting it with result().
+
+        Args:
+            kernel (function): Module-level function with the signature of
+                vortex_velocity(), evaluated by the workers on each chunk.
+            xt, zt (float): Target point coordinates.
+            xs, zs (float): Point vortex coordinates.
+            gs (float): Point vortex circulations.
+            DELTA_CORE (float): Vortex core radius.
+            n_workers (int): Number of worker processes, the number of CPUs
+                if 0.
+        """
+        if self.pending is not None:
+            self.result()
+
+        (n_s, n_t) = (xs.size, xt.size)
+        self.allocate(n_s, n_t, n_workers)
+        (self.xs[:n_s], self.zs[:n_s], self.gs[:n_s]) = (xs, zs, gs)
+        (self.xt[:n_t], self.zt[:n_t]) = (xt, zt)
+        (self.n_s, self.n_t) = (n_s, n_t)
+
+        # A few chunks per worker even out their loads
+        n_chunk = max(min(4*self.n_workers, n_t // self.MIN_CHUNK), 1)
+        bounds = np.linspace(0, n_t, n_chunk+1).astype(int)
+        tasks = [(kernel, bounds[k], bounds[k+1], n_s, DELTA_CORE) for k in xrange(n_chunk)]
+        self.pending = self.Pool.map_async(evaluate_chunk, tasks)
+
+    def result(self):
+        """
+        Waits for the evaluation started by submit().
+
+        Returns:
+            vx, vz (float): Induced velocity components at the targets, as
+                views of the shared arrays. They are overwritten by the next
+                submit().
+        """
+        # get() also raises the workers' exceptions here
+        self.pending.get()
+        self.pending = None
+        return(self.vx[:self.n_t], self.vz[:self.n_t])
+
+    def close(self):
+        """Stops the worker processes."""
+        if self.Pool is not None:
+            self.Pool.terminate()
+            self.Pool.join()
+            self.Pool = None
+        self.pending = None
@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 
 import numpy as np
+from functions_general import panel_vectors
+from history_buffer_class import HistoryBuffer
 
 class SwimmerParameters(object):
     """A collection of parameters related to a single swimmer.
@@ -105,7 +107,8 @@ class BodyAFC(object):
     Attributes:
         x, z: Panel endpoint positions.
         x_col, z_col: Panel collocation point positions (shifted midpoints).
-        x_mid, z_mid: Panel midpoint positions.
+        x_mid, z_mid: Panel midpoint positions of the current and four
+            previous time steps (views of x_mid_hist and z_mid_hist).
         x_neut, z_neut: Point arrays along the body's neutral axis.
         x_le, z_le: Position of the body's leading edge point.
     """
@@ -114,9 +117,46 @@ class BodyAFC(object):
         self.z = np.empty(N+1)
         self.x_col = np.empty(N)
         self.z_col = np.empty(N)
-        self.x_mid = np.zeros((5,N))
-        self.z_mid = np.zeros((5,N))
+        self.x_mid_hist = HistoryBuffer(5, (N,), 5)
+        self.z_mid_hist = HistoryBuffer(5, (N,), 5)
         self.x_neut = np.empty(N)
         self.z_neut = np.empty(N)
         self.x_le = 0.
-        self.z_le = 0.
\ No newline at end of file
+        self.z_le = 0.
+
+    @property
+    def x_mid(self):
+        return self.x_mid_hist.view()
+
+    @property
+    def z_mid(self):
+        return self.z_mid_hist.view()
+
+class PanelGeometry(object):
+    """Panel vectors and points derived from a Body's absolute-frame nodes.
+
+    Built once every time the panel endpoints move (see
+    SchoolState.update_geometry() and Body.update_geometry()) so that the rest
+    of the time step can read these arrays instead of recomputing them.
+
+    Attributes:
+        tx, tz: Unit tangent vector components of the panels.
+        nx, nz: Unit normal vector components of the panels (outward).
+        lpanel: Panel lengths.
+        x_mid, z_mid: Panel midpoint positions.
+        x_col, z_col: Panel collocation point positions (shifted midpoints).
+    """
+    def __init__(self, x, z, shift):
+        (self.tx, self.tz, self.nx, self.nz, self.lpanel) = panel_vectors(x, z)
+        self.x_mid = (x[:-1] + x[1:])/2
+        self.z_mid = (z[:-1] + z[1:])/2
+        # Normal vectors point outward but positive shift is inward
+        self.x_col = self.x_mid - shift*self.nx
+        self.z_col = self.z_mid - shift*self.nz
+
+    def take(self, panels):
+        """Returns the geometry of the given panels (a view for a slice)."""
+        geom = object.__new__(PanelGeometry)
+        for name in ('tx', 'tz', 'nx', 'nz', 'lpanel', 'x_mid', 'z_mid', 'x_col', 'z_col'):
+            setattr(geom, name, getattr(self, name)[panels])
+        return geom
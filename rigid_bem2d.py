@@ -18,6 +18,7 @@ else:
 from terminal_output import print_output as po
 import functions_graphics as graph
 from functions_general import archive, simulation_startup
+from functions_influence import SCHOOL
 
 #po().prog_title('1.0.0')
 DIO = DataIO(P)
@@ -40,17 +41,20 @@ outerCorr = 1
 
 for i in xrange(START_COUNTER, COUNTER):
     if i == 0:
+        SCHOOL.panel_positions(Swimmers, P, i)
+        SCHOOL.surface_kinematics(Swimmers, P, i)
         for Swim in Swimmers:
-                Swim.Body.panel_positions(P, i)
-                Swim.Body.surface_kinematics(P, i)
                 Swim.edge_shed(DEL_T, i)
                 Swim.wake_shed(DEL_T, i)
+                Swim.wake_amalgamate(P, i)
+                Swim.wake_particles(P, i)
+                Swim.wake_truncate(P, i)
         solve_phi(Swimmers, P, i, outerCorr)
+        SCHOOL.force(Swimmers, P, i)
         for Swim in Swimmers:
-            Swim.Body.force(P, i)
             Swim.Body.free_swimming(P, i)
-            archive(Swim.Body.AF.x_mid)
-            archive(Swim.Body.AF.z_mid)
+            archive(Swim.Body.AF.x_mid_hist)
+            archive(Swim.Body.AF.z_mid_hist)
         graph.plot_n_go(Swimmers, i, P)
         DIO.write_data(P, i, DEL_T, SwiL, GeoL, MotL, Swimmers)
 
@@ -58,21 +62,24 @@ for i in xrange(START_COUNTER, COUNTER):
         if np.fmod(i, VERBOSITY) == 0:
             po().timestep_header(i,T[i])
 
+        SCHOOL.panel_positions(Swimmers, P, i)
+        SCHOOL.surface_kinematics(Swimmers, P, i)
         for Swim in Swimmers:
-            Swim.Body.panel_positions(P, i)
-            Swim.Body.surface_kinematics(P, i)
             Swim.edge_shed(DEL_T, i)
             Swim.wake_shed(DEL_T, i)
+            Swim.wake_amalgamate(P, i)
+            Swim.wake_particles(P, i)
+            Swim.wake_truncate(P, i)
         solve_phi(Swimmers, P, i, outerCorr)
         wake_rollup(Swimmers, DEL_T, i, P)
+        SCHOOL.force(Swimmers, P, i)
         for Swim in Swimmers:
-            Swim.Body.force(P, i)
             Swim.Body.free_swimming(P, i)
             if np.fmod(i, VERBOSITY) == 0:
                 po().solution_output(Swim.Body.Cf, Swim.Body. Cl,Swim.Body.Ct,Swim.Body.Cpow)
                 po().solution_complete_output(i/float(COUNTER-1)*100.)
-            archive(Swim.Body.AF.x_mid)
-            archive(Swim.Body.AF.z_mid)
+            archive(Swim.Body.AF.x_mid_hist)
+            archive(Swim.Body.AF.z_mid_hist)
         graph.plot_n_go(Swimmers, i, P)
         DIO.write_data(P, i, DEL_T, SwiL, GeoL, MotL, Swimmers)
 
@@ -0,0 +1,462 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+BEM-2D
+A 2D boundary element method code
+
+"""
+import numpy as np
+from scipy.sparse import block_diag
+import parameter_classes as PC
+
+class SchoolState(object):
+    'Body arrays of all Swimmers, stored contiguously, and the per time step body updates'
+    # Body attributes kept in the shared arrays, and whether they hold one
+    # value per panel node (N+1) or per panel (N). The ones in AF_ARRAYS
+    # belong to Body.AF, the others to the Body itself.
+    NODE_ARRAYS = ('x', 'z')
+    PANEL_ARRAYS = ('x_col', 'z_col', 'sigma', 'mu', 'vx', 'vz', 'p_s', 'p_us', 'p', 'cp')
+    AF_ARRAYS = ('x', 'z', 'x_col', 'z_col')
+
+    def __init__(self):
+        """
+        Initializes an empty state. The arrays are allocated by attach().
+
+        Attributes:
+            Swimmers (list): Swimmers the arrays belong to.
+            x, z (float): Absolute-frame panel endpoints of all bodies.
+            x_col, z_col (float): Collocation points of all bodies.
+            sigma (float): Source strengths of all body panels.
+            mu (float): Doublet strengths of all body panels.
+            vx, vz (float): Body-frame surface velocities of all body panels.
+            p_s, p_us, p, cp (float): Steady, unsteady and total surface
+                pressures and pressure coefficients of all body panels.
+            i_b (int): Offset of each Body's first panel.
+            i_n (int): Offset of each Body's first node.
+            n_p (int): Number of panels of each Body.
+            panels (int): Index of the first node of every panel.
+            shift (float): Collocation point shift of every pair of
+                consecutive nodes (zero between bodies).
+            geom (PanelGeometry): Geometry of all body panels.
+            geoms (list): Each Body's part of geom.
+            dl_ops (list): Body differentiation operators dl_op was built from.
+            dl_op: Block diagonal differentiation operator of all bodies.
+            n_attach (int): Number of times the arrays have been allocated.
+        """
+        self.Swimmers = []
+        self.x = None
+        self.z = None
+        self.x_col = None
+        self.z_col = None
+        self.sigma = None
+        self.mu = None
+        self.vx = None
+        self.vz = None
+        self.p_s = None
+        self.p_us = None
+        self.p = None
+        self.cp = None
+        self.i_b = None
+        self.i_n = None
+        self.n_p = None
+        self.panels = None
+        self.shift = None
+        self.geom = None
+        self.geoms = []
+        self.dl_ops = []
+        self.dl_op = None
+        self.n_attach = 0
+
+    def owner(self, Body, name):
+        """Returns the object that holds the Body array name."""
+        return Body.AF if name in self.AF_ARRAYS else Body
+
+    def is_attached(self, Swimmers):
+        """
+        Checks whether every Body array listed in NODE_ARRAYS and
+        PANEL_ARRAYS is still a view of the shared arrays. An array that a
+        Body has replaced instead of writing into is not.
+
+        Args:
+            Swimmers (list): List of Swimmer objects being simulated.
+
+        Returns:
+            attached (bool): True if the shared arrays are current.
+        """
+        if (len(Swimmers) != len(self.Swimmers) or
+            any(Swim is not Old for (Swim, Old) in zip(Swimmers, self.Swimmers))):
+            return False
+
+        for Swim in Swimmers:
+            for name in self.NODE_ARRAYS + self.PANEL_ARRAYS:
+                if getattr(self.owner(Swim.Body, name), name).base is not getattr(self, name):
+                    return False
+
+        return True
+
+    def attach(self, Swimmers):
+        """
+        Allocates the shared arrays, copies the Bodies' current values into
+        them and replaces the Bodies' arrays with views of them. Also sets
+        each Swimmer's panel offset i_b. Does nothing if is_attached().
+
+        Args:
+            Swimmers (list): List of Swimmer objects being simulated.
+        """
+        if self.is_attached(Swimmers):
+            return
+
+        self.n_p = np.array([Swim.Body.N for Swim in Swimmers])
+        self.i_b = np.hstack((0, np.cumsum(self.n_p)[:-1]))
+        self.i_n = self.i_b + np.arange(len(Swimmers))
+        n_b = np.sum(self.n_p)
+        for name in self.NODE_ARRAYS:
+            setattr(self, name, np.empty(n_b + len(Swimmers)))
+        for name in self.PANEL_ARRAYS:
+            setattr(self, name, np.empty(n_b))
+
+        for (Swim, j0, n0, N) in zip(Swimmers, self.i_b, self.i_n, self.n_p):
+            Swim.i_b = j0
+            for name in self.NODE_ARRAYS + self.PANEL_ARRAYS:
+                (k0, k1) = (n0, n0+N+1) if name in self.NODE_ARRAYS else (j0, j0+N)
+                owner = self.owner(Swim.Body, name)
+                shared = getattr(self, name)
+                shared[k0:k1] = getattr(owner, name)
+                setattr(owner, name, shared[k0:k1])
+
+        # A panel's first node is its index plus the number of bodies before it
+        self.panels = np.arange(n_b) + np.repeat(np.arange(len(Swimmers)), self.n_p)
+        # Shifting surface collocation points some percent of the height from the neutral axis
+        self.shift = np.zeros(self.x.size - 1)
+        self.shift[self.panels] = np.hstack([Swim.Body.S*np.absolute(Swim.Body.zcval) for Swim in Swimmers])
+        self.geom = None
+        self.dl_op = None
+
+        self.Swimmers = list(Swimmers)
+        self.n_attach += 1
+
+    def per_panel(self, values):
+        """Repeats one value per Body for each of its panels."""
+        return np.repeat(values, self.n_p)
+
+    def per_node(self, values):
+        """Repeats one value per Body for each of its panel nodes."""
+        return np.repeat(values, self.n_p+1)
+
+    def update_geometry(self, Swimmers):
+        """
+        Rebuilds the panel geometry of all bodies from the absolute-frame
+        nodes and gives each Body its part of it (see Body.update_geometry()).
+        Also refreshes the absolute-frame midpoints and collocation points.
+
+        Args:
+            Swimmers (list): List of Swimmer objects being simulated.
+        """
+        # The segments between one body's last node and the next body's first
+        # node are not panels and are dropped right away
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.geom = PC.PanelGeometry(self.x, self.z, self.shift).take(self.panels)
+        self.x_col[:] = self.geom.x_col
+        self.z_col[:] = self.geom.z_col
+
+        self.geoms = []
+        for (Swim, j0, N) in zip(Swimmers, self.i_b, self.n_p):
+            Swim.Body.geom = self.geom.take(slice(j0, j0+N))
+            self.geoms.append(Swim.Body.geom)
+            Swim.Body.AF.x_mid[0,:] = Swim.Body.geom.x_mid
+            Swim.Body.AF.z_mid[0,:] = Swim.Body.geom.z_mid
+
+    def geometry(self, Swimmers):
+        """
+        Returns the panel geometry of all bodies, rebuilt first if a Body has
+        replaced its own (see Body.fsi_panel_positions()).
+
+        Args:
+            Swimmers (list): List of Swimmer objects being simulated.
+
+        Returns:
+            geom (PanelGeometry): Geometry of all body panels.
+        """
+        if (self.geom is None or
+            any(Swim.Body.geom is not geom for (Swim, geom) in zip(Swimmers, self.geoms))):
+            self.update_geometry(Swimmers)
+
+        return self.geom
+
+    def panel_positions(self, Swimmers, P, i):
+        """
+        Updates all the absolute-frame coordinates of the bodies.
+
+        Args:
+            Swimmers (list): List of Swimmer objects being simulated.
+            T: Time of current step.
+            THETA: Current pitching angle.
+            HEAVE: Current heave position.
+        """
+        self.attach(Swimmers)
+        T = P['T'][i]
+        THETA = P['THETA'][i]
+        HEAVE = P['HEAVE'][i]
+        bfx = np.hstack([Swim.Body.BF.x for Swim in Swimmers])
+        bfz = np.hstack([Swim.Body.BF.z for Swim in Swimmers])
+        x_le = self.per_node([Swim.Body.AF.x_le for Swim in Swimmers])
+
+        self.x[:] = bfx * np.cos(THETA) - bfz * np.sin(THETA) + x_le
+        self.z[:] = bfx * np.sin(THETA) + bfz * np.cos(THETA) + HEAVE
+        self.update_geometry(Swimmers)
+
+        # Neutral axis of each body (see Body.neutral_axis())
+        X0 = self.per_node([Swim.Body.MP.X0 for Swim in Swimmers])
+        Z0 = self.per_node([Swim.Body.MP.Z0 for Swim in Swimmers])
+        V0 = self.per_node([Swim.Body.MP.V0 for Swim in Swimmers])
+        x_neut = X0 + bfx*np.cos(THETA) + V0*T
+        z_neut = Z0 + bfx*np.sin(THETA) + HEAVE
+        for (Swim, n0, N) in zip(Swimmers, self.i_n, self.n_p):
+            Swim.Body.AF.x_neut = x_neut[n0:n0+N+1]
+            Swim.Body.AF.z_neut = z_neut[n0:n0+N+1]
+
+    def surface_kinematics(self, Swimmers, P, i):
+        """
+        Calculates the body-frame surface velocities of all body panels.
+
+        Also finds the body panel source strengths based on these surface
+        velocities.
+
+        Args:
+            Swimmers (list): List of Swimmer objects being simulated.
+            TSTEP: Small time difference for central differencing.
+            DEL_T: Time step length.
+            T: Time of current step.
+            i: Time step number.
+            THETA_MINUS: Pitching angle minus a small time difference (TSTEP)
+            THETA_PLUS: Pitching angle plus a small time difference (TSTEP)
+        """
+        self.attach(Swimmers)
+        TSTEP       = P['TSTEP']
+        THETA_MINUS = P['THETA_MINUS'][i]
+        THETA_PLUS  = P['THETA_PLUS'][i]
+        HEAVE_MINUS = P['HEAVE_MINUS'][i]
+        HEAVE_PLUS  = P['HEAVE_PLUS'][i]
+        DEL_T       = P['DEL_T']
+        T           = P['T'][i]
+        geom = self.geometry(Swimmers)
+        V = self.per_panel([Swim.Body.V for Swim in Swimmers])
+
+        if i == 0:
+            # Use the prescribed kinematics to do a central difference over a 
+            # small period of time
+            x_col = np.hstack([Swim.Body.BF.x_col for Swim in Swimmers])
+            z_col = np.hstack([Swim.Body.BF.z_col for Swim in Swimmers])
+
+            xp = x_col * np.cos(THETA_PLUS) - z_col * np.sin(THETA_PLUS) + V*(T+TSTEP)
+            zp = x_col * np.sin(THETA_PLUS) + z_col * np.cos(THETA_PLUS) + HEAVE_PLUS
+
+            xm = x_col * np.cos(THETA_MINUS) - z_col * np.sin(THETA_MINUS) + V*(T-TSTEP)
+            zm = x_col * np.sin(THETA_MINUS) + z_col * np.cos(THETA_MINUS) + HEAVE_MINUS
+
+            self.vx[:] = (xp - xm) / (2. * TSTEP) - V
+            self.vz[:] = (zp - zm) / (2. * TSTEP)
+
+        else:
+            # Midpoint histories of all bodies, one column per panel
+            x_mid = np.hstack([Swim.Body.AF.x_mid for Swim in Swimmers])
+            z_mid = np.hstack([Swim.Body.AF.z_mid for Swim in Swimmers])
+
+            if i == 1:
+                # First-order backwards differencing of body collocation point positions
+                self.vx[:] = (x_mid[0,:]-x_mid[1,:])/DEL_T - V
+                self.vz[:] = (z_mid[0,:]-z_mid[1,:])/DEL_T
+
+            elif i == 2 or i == 3:
+                # Second-order backwards differencing of body collocation point positions
+                self.vx[:] = (3*x_mid[0,:]-4*x_mid[1,:]+x_mid[2,:])/(2*DEL_T) - V
+                self.vz[:] = (3*z_mid[0,:]-4*z_mid[1,:]+z_mid[2,:])/(2*DEL_T)
+
+            else:
+                # Fourth-order backwards differencing of body collocation point positions
+                self.vx[:] = (25/12*x_mid[0,:] - 4*x_mid[1,:] + 3*x_mid[2,:] - 4/3*x_mid[3,:] + 1/4*x_mid[4,:]) / DEL_T - V
+                self.vz[:] = (25/12*z_mid[0,:] - 4*z_mid[1,:] + 3*z_mid[2,:] - 4/3*z_mid[3,:] + 1/4*z_mid[4,:]) / DEL_T
+
+        # Body source strengths with normal vector pointing outward (overall sigma pointing outward)
+        self.sigma[:] = geom.nx*(V + self.vx) + geom.nz*self.vz
+
+    def surface_derivative(self, Swimmers, stencil_npts=5):
+        """
+        Returns the operator that differentiates along every body's surface.
+
+        It is reassembled from the Bodies' own operators (see
+        Body.surface_derivative()) whenever one of them is.
+
+        Args:
+            Swimmers (list): List of Swimmer objects being simulated.
+            stencil_npts: Number of points in the finite difference stencil.
+
+        Returns:
+            dl_op: Sparse block diagonal differentiation operator.
+        """
+        dl_ops = [Swim.Body.surface_derivative(stencil_npts) for Swim in Swimmers]
+        if (self.dl_op is None or any(D is not Old for (D, Old) in zip(dl_ops, self.dl_ops))):
+            self.dl_op = block_diag(dl_ops, format='csr')
+            self.dl_ops = dl_ops
+
+        return self.dl_op
+
+    def surface_pressure(self, Swimmers, P, i, panels=None, stencil_npts=5):
+        """
+        Calculates the pressure on a subset of the body panels.
+
+        Args:
+            Swimmers (list): List of Swimmer objects being simulated.
+            RHO: Fluid density.
+            DEL_T: Time step length.
+            i: Time step number.
+            panels: Indices of the panels to evaluate (into the shared
+                arrays). All panels if None.
+            stencil_npts: Number of points in the finite difference stencil.
+
+        Returns:
+            p_s, p_us: Steady and unsteady pressures of the requested panels.
+        """
+        RHO          = P['RHO']
+        DEL_T        = P['DEL_T']
+        SW_4PRESSURE = P['SW_4PRESSURE']
+        geom = self.geometry(Swimmers)
+
+        # Tangential panel velocity dmu/dl (3-point and 5-point stencils available)
+        D = self.surface_derivative(Swimmers, stencil_npts)
+        if panels is None:
+            dmu_dl = D.dot(self.mu)
+            panels = slice(None)
+        else:
+            dmu_dl = D[panels,:].dot(self.mu)
+        (tx, tz) = (geom.tx[panels], geom.tz[panels])
+        (nx, nz) = (geom.nx[panels], geom.nz[panels])
+        V = self.per_panel([Swim.Body.V for Swim in Swimmers])[panels]
+
+        # Potential change dmu/dt, second-order differencing after first time step
+        mu = self.mu[panels]
+        mu_past = np.hstack([Swim.Body.mu_past for Swim in Swimmers])[:,panels]
+        if i == 0:
+            dmu_dt = mu / DEL_T
+        elif i == 1:
+            dmu_dt = (mu - mu_past[0,:])/DEL_T
+        elif (i > 3 and SW_4PRESSURE):
+            dmu_dt = ((25. / 12.) * mu - 4. * mu_past[0,:] + 3. * mu_past[1,:] - (4. / 3.) * mu_past[2,:] + (1. / 4.) * mu_past[3,:]) / DEL_T
+        else:
+            dmu_dt = (3.*mu - 4.*mu_past[0,:] + mu_past[1,:])/(2.*DEL_T)
+
+        # Unsteady pressure calculation (from Matlab code)
+        qpx_tot = dmu_dl*tx + self.sigma[panels]*nx
+        qpz_tot = dmu_dl*tz + self.sigma[panels]*nz
+
+        p_s  = -RHO*(qpx_tot**2 + qpz_tot**2)/2.
+        p_us = RHO*dmu_dt + RHO*(qpx_tot*(V+self.vx[panels]) + qpz_tot*self.vz[panels])
+
+        return(p_s, p_us)
+
+    def pressure(self, Swimmers, P, i, stencil_npts=5):
+        """
+        Calculates the pressure distribution along every body's surface.
+
+        Args:
+            Swimmers (list): List of Swimmer objects being simulated.
+            RHO: Fluid density.
+            DEL_T: Time step length.
+            i: Time step number.
+        """
+        RHO = P['RHO']
+        V = self.per_panel([Swim.Body.V for Swim in Swimmers])
+
+        (self.p_s[:], self.p_us[:]) = self.surface_pressure(Swimmers, P, i, None, stencil_npts)
+        self.p[:]  = self.p_s + self.p_us
+        self.cp[:] = self.p / (0.5*RHO*V**2)
+
+    def trailing_edge_pressure(self, Swimmers, P, i, stencil_npts=5):
+        """
+        Calculates the pressure on the two panels at each trailing edge.
+
+        Only the first and last panels' stencils are evaluated, which is all
+        the implicit Kutta iteration needs. The pressure arrays are left
+        untouched; call pressure() once the iteration has converged.
+
+        Args:
+            Swimmers (list): List of Swimmer objects being simulated.
+            RHO: Fluid density.
+            DEL_T: Time step length.
+            i: Time step number.
+
+        Returns:
+            p_te: Pressures on the first and last panel of each body, one
+                row per Swimmer.
+        """
+        panels = np.vstack((self.i_b, self.i_b + self.n_p - 1)).T.ravel()
+        (p_s, p_us) = self.surface_pressure(Swimmers, P, i, panels, stencil_npts)
+
+        return((p_s + p_us).reshape(-1, 2))
+
+    def force(self, Swimmers, P, i):
+        """
+        Calculates drag and lift forces acting on every body.
+
+        The panel forces of all bodies are computed at once and summed per
+        body with np.add.reduceat().
+
+        Args:
+            Swimmers (list): List of Swimmer objects being simulated.
+            RHO (float): Fluid density
+            C (float): Body's chord length
+            B (float): Body's Span length
+            i: Time step number.
+        """
+        C             = P['C']
+        B             = P['B']
+        RHO           = P['RHO']
+        CD_BOD        = P['CD_BOD']
+        S_W           = P['S_W']
+        NU            = P['NU']
+        L_T           = P['L_T']
+        SW_ADDED_DRAG = P['SW_ADDED_DRAG']
+        DRAG_LAW      = P['DRAG_LAW']
+        SW_SPRING     = P['SW_SPRING']
+        H_DOT         = P['H_DOT'][i]
+        geom = self.geometry(Swimmers)
+        (nx, nz, lpanel) = (geom.nx, geom.nz, geom.lpanel)
+        V = np.array([Swim.Body.V for Swim in Swimmers], dtype=float)
+
+        delFx = -self.p * lpanel * B * nx
+        delFz = -self.p * lpanel * B * nz
+        delP = -delFx * self.vx - delFz * self.vz
+
+        force_x = np.add.reduceat(delFx, self.i_b)
+        force_z = np.add.reduceat(delFz, self.i_b)
+        lift = force_z
+        thrust = -force_x
+        if SW_SPRING:
+            power = -H_DOT * lift
+        else:
+            power = np.add.reduceat(delP, self.i_b)
+
+        if SW_ADDED_DRAG:
+            if DRAG_LAW == 'FORM':
+                D_add = 0.5 * CD_BOD * RHO * S_W * V**2
+            elif DRAG_LAW == 'BLASIUS':
+                D_add = CD_BOD * RHO * S_W * np.absolute(V**1.5 * (NU / L_T)**0.5)
+            else:
+                print 'ERROR: Invalid drag law "%s"' % DRAG_LAW
+                print 'Valid trag laws are:'
+                print '    "FORM"'
+                print '    "BLASIUS"'
+                raise ValueError('Invalid drag law "%s"' % DRAG_LAW)
+
+            net_thrust = force_x - np.sign(V) * D_add
+            Ct_net = -net_thrust / (0.5 * RHO * np.absolute(V)**2 * C * B)
+
+        Cf = np.sqrt(force_x**2 + force_z**2) / (0.5 * RHO * np.absolute(V)**2 * C * B)
+        Cl = lift /(0.5 * RHO * np.absolute(V)**2 * C * B)
+        Ct = thrust / (0.5 * RHO * np.absolute(V)**2 * C * B)
+        Cpow = power /  (0.5 * RHO * np.absolute(V)**3 * C * B)
+
+        for (k, Swim) in enumerate(Swimmers):
+            (Swim.Body.Cf, Swim.Body.Cl, Swim.Body.Ct, Swim.Body.Cpow) = (Cf[k], Cl[k], Ct[k], Cpow[k])
+            if SW_ADDED_DRAG:
+                Swim.Body.Ct_net = Ct_net[k]
@@ -2,8 +2,8 @@
 """Module for the Swimmer class and its methods."""
 
 import numpy as np
-from functions_general import archive
-from swimmer_subclasses import Body, Edge, Wake
+from functions_general import wake_budget
+from swimmer_subclasses import Body, Edge, Wake, VortexParticles
 
 class Swimmer(object):
     """A single swimmer, consisting of Body, Edge, and Wake objects.
@@ -44,6 +44,7 @@ class Swimmer(object):
 
         self.Edge = Edge(self.CE)
         self.Wake = Wake(N_WAKE)
+        self.Particles = VortexParticles()
         
 #        self.Cf = np.zeros(N_WAKE+1)
 #        self.Cl = np.zeros(N_WAKE+1)
@@ -98,17 +99,21 @@ class Swimmer(object):
 
         # Initialize wake coordinates when i==1
         if i == 1:
+            Wake.n = 1
 
             Wake.x[0] = Edge.x[-1]
             Wake.z[0] = Edge.z[-1]
 
-            Wake.x[1:] = Wake.x[0] + np.arange(1,np.size(Wake.x))*(-V0)*DEL_T
-            Wake.z[1:] = Wake.z[0]
+            Wake.x[1] = Wake.x[0] - V0*DEL_T
+            Wake.z[1] = Wake.z[0]
+
+        elif i == 0:
+            Wake.x[0] = Edge.x[-1]
+            Wake.z[0] = Edge.z[-1]
 
         else:
-            archive(Wake.x)
-            archive(Wake.z)
-            archive(Wake.mu)
+            # Older panels and their circulations keep their values
+            Wake.shed()
 
             Wake.x[0] = Edge.x[-1]
             Wake.z[0] = Edge.z[-1]           
@@ -116,5 +121,202 @@ class Swimmer(object):
             Wake.mu[0] = Edge.mu
 
             Wake.gamma[0] = -Wake.mu[0]
-            Wake.gamma[1:-1] = Wake.mu[:-1]-Wake.mu[1:]
-            Wake.gamma[-1] = Wake.mu[-1]
\ No newline at end of file
+            if Wake.n > 1:
+                Wake.gamma[1] = Wake.mu[0]-Wake.mu[1]
+            Wake.gamma[-1] = Wake.mu[-1]
+
+    def wake_amalgamate(self, P, i):
+        """Merges neighbouring wake vortices far from the trailing edge.
+
+        Each wake node carries a point vortex of circulation
+        Wake.gamma[k] = Wake.mu[k-1] - Wake.mu[k]. Removing node k and moving
+        node k+1 to the circulation-weighted centroid of the two keeps the
+        doublet panel chain consistent (the panel between them is dropped and
+        the merged node carries gamma[k] + gamma[k+1]), and conserves the
+        wake's total circulation and first moment of circulation. Only
+        vortices of the same sign are merged, so the centroid is always
+        between the two nodes. When there are vortex particles, the vortex at
+        the last node is the last panel's strength minus the particles' total
+        circulation (see wake_particles()), and that is what it carries here.
+
+        A node may be merged once it is at least AMALG_AGE panels old or
+        AMALG_DIST away from the end of the edge panel, and only if the
+        resulting panel is no longer than AMALG_RATIO times its distance from
+        the end of the edge panel. Panels therefore grow with distance
+        downstream, and the number of active panels stays bounded.
+
+        This should be done after wake_shed() each time step.
+
+        Args:
+            SW_AMALGAMATE: Switch for wake amalgamation.
+            AMALG_AGE, AMALG_DIST, AMALG_RATIO: Amalgamation criteria.
+            i: Time step number.
+            Wake: Wake panels.
+            Particles: Vortex particles.
+        """
+        if not P['SW_AMALGAMATE']:
+            return
+
+        AMALG_AGE   = P['AMALG_AGE']
+        AMALG_DIST  = P['AMALG_DIST']
+        AMALG_RATIO = P['AMALG_RATIO']
+        Wake = self.Wake
+        Particles = self.Particles
+        n = Wake.n
+
+        # Oldest vortices first, so merges don't shift nodes still to be checked
+        for k in xrange(n-1, 0, -1):
+            if k+1 < n:
+                mu_next = Wake.mu[k+1]
+            else:
+                mu_next = np.sum(Particles.gamma[:Particles.n])
+            gamma = np.array([Wake.mu[k-1] - Wake.mu[k], Wake.mu[k] - mu_next])
+            if gamma[0]*gamma[1] < 0.:
+                continue
+
+            dist = np.sqrt((Wake.x[k]-Wake.x[0])**2 + (Wake.z[k]-Wake.z[0])**2)
+            if (k < AMALG_AGE and dist < AMALG_DIST):
+                continue
+
+            if np.sum(gamma) == 0.:
+                (x_new, z_new) = (Wake.x[k+1], Wake.z[k+1])
+            else:
+                x_new = np.dot(gamma, Wake.x[k:k+2]) / np.sum(gamma)
+                z_new = np.dot(gamma, Wake.z[k:k+2]) / np.sum(gamma)
+            if np.sqrt((x_new-Wake.x[k-1])**2 + (z_new-Wake.z[k-1])**2) > AMALG_RATIO*dist:
+                continue
+
+            # Drop node k and the panel after it (the n-1-k th from the oldest)
+            Wake.panels_removed(n-1-k, n-k)
+            Wake.x[k:n] = Wake.x[k+1:n+1]
+            Wake.z[k:n] = Wake.z[k+1:n+1]
+            Wake.x[k] = x_new
+            Wake.z[k] = z_new
+            Wake.mu[k:n-1] = Wake.mu[k+1:n]
+            Wake.mu[n-1] = 0.
+            n -= 1
+
+        Wake.n = n
+        Wake.update_gamma()
+
+    def wake_particles(self, P, i):
+        """Converts the oldest wake panels into vortex particles.
+
+        The wake keeps its PARTICLE_AGE newest panels. Each older panel is
+        removed from the end of the chain and the point vortex at the chain's
+        last node (the panel's strength minus the existing particles' total
+        circulation) becomes a particle there. The particles' virtual doublet
+        panels then start from the new last node (see VortexParticles), so the
+        flow outside the wake is unchanged by the conversion.
+
+        This should be done after wake_shed() each time step.
+
+        Args:
+            SW_PARTICLES: Switch for the vortex particle wake.
+            PARTICLE_AGE: Number of wake panels kept as panels.
+            i: Time step number.
+            Wake: Wake panels.
+            Particles: Vortex particles.
+        """
+        if not P['SW_PARTICLES']:
+            return
+
+        Wake = self.Wake
+        Particles = self.Particles
+        n = Wake.n
+        while n > max(P['PARTICLE_AGE'], 1):
+            gamma_tail = Wake.mu[n-1] - np.sum(Particles.gamma[:Particles.n])
+            Particles.append(Wake.x[n], Wake.z[n], gamma_tail)
+            Wake.mu[n-1] = 0.
+            n -= 1
+
+        Wake.panels_removed(0, Wake.n - n)
+        Wake.n = n
+        Wake.update_gamma()
+
+    def wake_truncate(self, P, i):
+        """Keeps the wake within the budget set by the input parameters.
+
+        The wake panels and vortex particles together are limited to
+        wake_budget(P) elements, and none of them may lie farther than
+        TRUNC_DIST from the end of the edge panel. Elements outside the budget
+        are removed oldest first: particles, then panels from the end of the
+        chain. With TRUNC_MODE 'drop', the point vortex of a removed element
+        moves to the new last wake node. With TRUNC_MODE 'fold', it is merged
+        into a single far-field vortex, the first particle, placed at the
+        strength-weighted centroid. The total circulation is conserved either
+        way, and the change in the wake's impulse is added up in
+        Wake.impulse_removed.
+
+        This should be done after wake_particles() each time step.
+
+        Args:
+            SW_TRUNCATE: Switch for wake truncation.
+            TRUNC_MODE: 'drop' or 'fold'.
+            TRUNC_DIST: Maximum distance of the wake from the trailing edge.
+            i: Time step number.
+            Wake: Wake panels.
+            Particles: Vortex particles.
+        """
+        if not P['SW_TRUNCATE']:
+            return
+
+        if P['TRUNC_MODE'] not in ('drop', 'fold'):
+            print "ERROR! Invalid wake truncation mode. Valid modes are:"
+            print "    'drop'"
+            print "    'fold'"
+            raise ValueError('ERROR! Invalid wake truncation mode.')
+
+        FOLD = (P['TRUNC_MODE'] == 'fold')
+        TRUNC_DIST = P['TRUNC_DIST']
+        Wake = self.Wake
+        Particles = self.Particles
+        n = Wake.n
+        z_te = Wake.x[0] + 1j*Wake.z[0]
+
+        # The far-field vortex takes up one element of the budget
+        if (FOLD and not Particles.far):
+            Particles.append(Wake.x[n], Wake.z[n], 0.)
+            for a in (Particles.x, Particles.z, Particles.gamma):
+                a[:Particles.n] = np.roll(a[:Particles.n], 1)
+            Particles.far = True
+        p0 = 1 if Particles.far else 0
+        N_MAX = wake_budget(P) - p0
+
+        def remove(gamma, z):
+            """Drops or folds point vortices and returns the change in their moment."""
+            if not FOLD:
+                return np.sum(gamma * (z - (Wake.x[n] + 1j*Wake.z[n])))
+            z_far = Particles.x[0] + 1j*Particles.z[0]
+            weight = np.absolute(Particles.gamma[0]) + np.sum(np.absolute(gamma))
+            moment = Particles.gamma[0]*z_far + np.sum(gamma*z)
+            if weight > 0.:
+                z_far = (np.absolute(Particles.gamma[0])*z_far + np.sum(np.absolute(gamma)*z)) / weight
+            Particles.gamma[0] += np.sum(gamma)
+            (Particles.x[0], Particles.z[0]) = (np.real(z_far), np.imag(z_far))
+            return moment - Particles.gamma[0]*z_far
+
+        # Oldest particles first
+        z_p = Particles.x[:Particles.n] + 1j*Particles.z[:Particles.n]
+        keep = np.ones(Particles.n, dtype=bool)
+        keep[p0:] = np.absolute(z_p[p0:] - z_te) <= TRUNC_DIST
+        excess = n + np.count_nonzero(keep[p0:]) - N_MAX
+        if excess > 0:
+            keep[p0 + np.nonzero(keep[p0:])[0][:excess]] = False
+        moment = remove(Particles.gamma[:Particles.n][~keep], z_p[~keep])
+        Particles.remove(keep)
+
+        # Then panels from the end of the chain
+        while (n > 1 and (n + Particles.n - p0 > N_MAX or
+                          np.hypot(Wake.x[n]-Wake.x[0], Wake.z[n]-Wake.z[0]) > TRUNC_DIST)):
+            gamma_tail = Wake.mu[n-1] - np.sum(Particles.gamma[:Particles.n])
+            Wake.mu[n-1] = 0.
+            n -= 1
+            moment += remove(gamma_tail, Wake.x[n+1] + 1j*Wake.z[n+1])
+
+        # Linear impulse per unit density, (sum(gamma*z), -sum(gamma*x))
+        Wake.impulse_removed += [np.imag(moment), -np.real(moment)]
+
+        Wake.panels_removed(0, Wake.n - n)
+        Wake.n = n
+        Wake.update_gamma()
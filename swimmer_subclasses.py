@@ -6,99 +6,89 @@ A 2D boundary element method code. Module for the Body, Edge, and Wake classes.
 
 """
 import numpy as np
-from functions_general import panel_vectors
+from scipy.sparse import csr_matrix
 import parameter_classes as PC
+from history_buffer_class import HistoryBuffer
     
-def finite_diff(mu, dL, stencil):
+def chordwise_stencil(N, panels, stencil_npts=5):
     """
-    Method for generating arbitrary finite difference approximation based on the stencil
-    Solving for the coefficients of the finite difference scheme (three-point stencil example):
-        1.) dphi/dx = a*phi_m1 + b*phi_0 + c*phi_p1
-        2.) Write out a Taylor series expansion of phi_m1 and phi_p1
-        3.) a*phi_m1 + b*phi_0 + c*phi_p1 = (a + b + c)*phi_0 + (-a*s_m1 + c*s_p1)*phi_x + ...
-                  1/2*(-a*s_m1^2 + c*s_p1^2)*phi_xx + 1/6*(-a*s_m1^3 + c*s_p1^3)*phi_xxx + ...
-        4.) Set coefficient of phi and derivative of phi to 1 and 0.  For instance:               
-                           (a + b + c) = 0,          (-a*s_m1 + c*s_p1) = 1, 
-            1/2*(-a*s_m1^2 + c*s_p1^2) = 0,  1/6*(-a*s_m1^3 + c*s_p1^3) = 0
-        5.) Write out equations for the coefficients (a,b,c) in matrix form A*coeffs = b and solve.
-        6.) Construct finite difference scheme for the gradient
-    
-    Calculating the arc length vector from the zero stencil point to the
-    other stencil points.  Breaking up the arc length vector into the minus
-    and plus arc length vectors relative to the zero stencil point
+    Returns the finite difference stencils (offsets from the panel) for a set
+    of body panels. Central stencils are used away from the trailing edge;
+    next to it they are shifted towards the interior of the panel chain, so
+    that a panel's stencil has n_m points behind it and n_p ahead of it with
+    n_m + n_p + 1 = stencil_npts (see diff_operator()).
+
+    Args:
+        N (int): Number of body panels.
+        panels (int): Indices of the panels.
+        stencil_npts (int): Number of points in the stencil (3 or 5).
+
+    Returns:
+        stencil (int: panels x stencil_npts): Stencil offsets of each panel.
     """
-    # Calculating arc lengths between stencil points
-    s = 0.5 * dL[:-1] + 0.5 * dL[1:]
-    
-    # Determine the number of minus and plus points
-    n_m = np.absolute(np.min(stencil))
-    n_p = np.absolute(np.max(stencil))
-    
-    s_m = np.zeros(n_m)
-    for i in xrange(n_m):
-        s_m[i] = np.sum(s[i:n_m])
-        
-    s_p = np.zeros(n_p)
-    for i in xrange(n_p):
-        s_p[i] = np.sum(s[n_m: n_m + i + 1])
-        
-    # Building submatrices of A for up to a 5-point stencil
-    numel = stencil.shape[0]
-    A = np.zeros((numel, n_m + n_p + 1))
-    if (n_m > 0):
-        A_m = np.zeros((numel, n_m))
-        A_m[0,:] = np.ones((1,n_m))
-        A_m[1,:] = -s_m
-        A_m[2,:] = 0.5*s_m**2
-        A_m[3,:] = -1./6.*s_m**3
-        A_m[4,:] = 1./24.*s_m**4
-        A[:numel,:n_m] = A_m[:numel, :]
-
-    A[:numel,n_m ] = np.array([1., 0., 0., 0., 0.])
-
-    if (n_p > 0):
-        A_p = np.zeros((numel, n_p))
-        A_p[0,:] = np.ones((1,n_p))
-        A_p[1,:] = s_p
-        A_p[2,:] = 0.5*s_p**2
-        A_p[3,:] = 1./6.*s_p**3
-        A_p[4,:] = 1./24.*s_p**4
-        A[:numel, n_m + 1: n_p + n_m + 1] = A_p[:numel, :]
-        
-    # Determining the full vector b_full and vector b for specific stencil number of points
-    b_full = np.array([[0.], [1.], [0.], [0.], [0.]])
-    b = b_full[:numel]
-    
-    # The A matrix and b vector need to be scaled so that the matrix isn't
-    # ill-conditioned.  The minimum arc length will be determined and each row 
-    # of A and b will be divided by the power of s_min that will scale that
-    # equation (row) to order 1.  This is get around the ill-conditioned matrix
-    # warning that we are getting.
-    if (s_m.shape[0] > 0):
-        s1 = np.min(s_m)
-    else:
-        s1 = np.nan
-    
-    if (s_p.shape[0] > 0):
-        s2 = np.min(s_p)
-    else:
-        s2 = np.nan
-    
-    s_min = np.nanmin(np.array([s1, s2]))
-    vec_scaling_full = np.array([[1.], [s_min], [s_min**2], [s_min**3], [s_min**4]])
-    b_vec_scaling = vec_scaling_full[:numel]
-    A_mat_scaling = np.repeat(b_vec_scaling, 1 + n_m + n_p, axis=1)
-    A = A / A_mat_scaling
-    b = b / b_vec_scaling
-    
-    # Solving for finite difference approximation coefficients
-    coeffs = np.linalg.solve(A, b)
-    
-    # Finite difference approximation of the gradient
-    dmu_ds = np.dot(coeffs.T, mu)
-    
-    # Determining the pertubation velocity (Qp)
-    return(-dmu_ds)
+    if (stencil_npts != 5 and stencil_npts != 3):
+        print '+-----------------------------------------------------------------------------+'
+        print '| WARNING! There are only three- and five-point stencils available.           |'
+        print '|          Defaulting to the three-point stencil.                             |'
+        print '+-----------------------------------------------------------------------------+'
+        stencil_npts = 3
+
+    # Shift the central stencil so that it stays on the body
+    n_side = stencil_npts / 2
+    shift = np.maximum(n_side - panels, 0) - np.maximum(panels - (N - 1 - n_side), 0)
+
+    return (np.arange(-n_side, n_side+1)[np.newaxis,:] + shift[:,np.newaxis])
+
+def diff_operator(lpanel, stencil_npts=5):
+    """
+    Assembles the finite difference operator that differentiates a quantity
+    along a chain of panels.
+
+    The coefficients of a panel's stencil (three-point example) follow from
+    Taylor series of mu about the panel, at the arc lengths s_m1 and s_p1 to
+    its neighbours' collocation points:
+        1.) dmu/ds = a*mu_m1 + b*mu_0 + c*mu_p1
+        2.) a*mu_m1 + b*mu_0 + c*mu_p1 = (a + b + c)*mu_0 + (-a*s_m1 + c*s_p1)*mu_s
+                + 1/2*(a*s_m1^2 + c*s_p1^2)*mu_ss + ...
+        3.) Matching the coefficient of mu_s to 1 and the others to 0 gives
+            (a + b + c) = 0, (-a*s_m1 + c*s_p1) = 1, (a*s_m1^2 + c*s_p1^2) = 0,
+            a linear system A*coeffs = b (the Taylor table).
+    The system of every panel is solved at once, and the coefficients are
+    stored in a sparse matrix so that the tangential perturbation velocity
+    of every panel is a single sparse matrix-vector product, dmu_dl = D.dot(mu).
+
+    Args:
+        lpanel (float: 1 x N): Length of each panel.
+        stencil_npts (int): Number of points in the stencil (3 or 5).
+
+    Returns:
+        D (float: N x N, sparse): Differentiation operator, with the sign
+            of the perturbation velocity (-dmu/ds).
+    """
+    N = lpanel.size
+    panels = np.arange(N)
+    stencil = chordwise_stencil(N, panels, stencil_npts)
+    numel = stencil.shape[1]
+    pan_elem = panels[:,np.newaxis] + stencil
+
+    # Arc length from each stencil point to the panel the stencil belongs to
+    s = 0.5 * lpanel[pan_elem[:,:-1]] + 0.5 * lpanel[pan_elem[:,1:]]
+    arc = np.hstack((np.zeros((N,1)), np.cumsum(s, axis=1)))
+    arc -= arc[panels, -stencil[:,0]][:,np.newaxis]
+
+    # Each row of the Taylor table is scaled by the power of the smallest arc
+    # length that brings it to order 1 so that the systems are well conditioned
+    s_min = np.min(np.where(stencil == 0, np.inf, np.absolute(arc)), axis=1)
+    powers = np.arange(numel)
+    factorials = np.cumprod(np.hstack((1., np.arange(1., numel))))
+    A = (arc[:,np.newaxis,:] / s_min[:,np.newaxis,np.newaxis])**powers[np.newaxis,:,np.newaxis] / factorials[np.newaxis,:,np.newaxis]
+    b = np.zeros((N, numel, 1))
+    b[:,1,0] = 1. / s_min
+
+    # Solving for finite difference approximation coefficients of every panel
+    coeffs = np.linalg.solve(A, b)[:,:,0]
+
+    return csr_matrix((-coeffs.ravel(), (np.repeat(panels, numel), pan_elem.ravel())), shape=(N, N))
 
 class Edge(object):
     """An edge doublet panel located where separation occurs on a body.
@@ -122,28 +112,144 @@ class Edge(object):
 class Wake(object):
     """A chain of wake doublet panels.
 
+    The panel endpoints and strengths are kept in HistoryBuffers, so x, z,
+    mu and gamma are views of the active panels only, newest first, and
+    shedding a panel (shed()) does not move the older ones. Setting n
+    resizes all of them.
+
     Attributes:
-        N: Number of wake panels.
-        x, z: X- and Z-coordinates of the wake panel endpoints.
-        mu: Doublet strengths of the wake panels.
-        gamma: Circulations at the wake panel endpoints.
+        N: Maximum number of wake panels.
+        n: Number of active wake panels (the newest ones, starting at index
+            0). Equal to the time step number unless panels were amalgamated.
+        x, z: X- and Z-coordinates of the wake panel endpoints (n+1).
+        mu: Doublet strengths of the wake panels (n).
+        gamma: Circulations at the wake panel endpoints (n+1).
+        expansion: Multipole expansions of the far wake panels (see
+            WakeExpansion), created by the first solve that uses them.
+        impulse_removed: Linear impulse per unit density removed from the
+            wake by truncation (see Swimmer.wake_truncate()).
     """
     def __init__(self, N):
         """Inits Wake with all necessary parameters."""
         self.N = N
-        self.x = np.zeros(N+1)
-        self.z = np.zeros(N+1)
-        self.mu = np.zeros(N)
-        self.gamma = np.zeros(N+1)
+        self.x_hist = HistoryBuffer(1)
+        self.z_hist = HistoryBuffer(1)
+        self.mu_hist = HistoryBuffer(0)
+        self.gamma_hist = HistoryBuffer(1)
+        self.expansion = None
+        self.impulse_removed = np.zeros(2)
+
+    @property
+    def n(self):
+        return self.mu_hist.length
+
+    @n.setter
+    def n(self, n):
+        for History in (self.x_hist, self.z_hist, self.gamma_hist):
+            History.resize(n+1)
+        self.mu_hist.resize(n)
+
+    @property
+    def x(self):
+        return self.x_hist.view()
+
+    @property
+    def z(self):
+        return self.z_hist.view()
+
+    @property
+    def mu(self):
+        return self.mu_hist.view()
+
+    @property
+    def gamma(self):
+        return self.gamma_hist.view()
+
+    def shed(self):
+        """Adds a panel in front of the others, dropping the oldest one if
+        there are already N. The new node copies the previous first node."""
+        if self.n == self.N:
+            self.panels_removed(0, 1)
+        n = min(self.n+1, self.N)
+        for History in (self.x_hist, self.z_hist, self.mu_hist, self.gamma_hist):
+            History.push()
+        self.n = n
+
+    def panels_removed(self, j0, j1):
+        """Tells the far wake expansions that the panels j0 to j1, counted
+        from the oldest active panel, are being removed."""
+        if self.expansion is not None:
+            self.expansion.remove(j0, j1)
+
+    def update_gamma(self):
+        """Recomputes the circulations at all active wake panel endpoints."""
+        if self.n == 0:
+            self.gamma[:] = 0.
+            return
+        self.gamma[0] = -self.mu[0]
+        self.gamma[1:-1] = self.mu[:-1]-self.mu[1:]
+        self.gamma[-1] = self.mu[-1]
+
+class VortexParticles(object):
+    """Regularized point vortices that the oldest wake panels turn into.
+
+    The potential of each particle is carried by a virtual doublet panel of
+    the particle's circulation running from the wake's last node to the
+    particle, which leaves a point vortex of minus the particles' total
+    circulation at that node.
+
+    Attributes:
+        n: Number of particles (the first n entries of each array are used).
+        far: True once the first particle is the far-field vortex that
+            truncated wake elements are folded into (see wake_truncate()).
+        x, z: X- and Z-coordinates of the particles.
+        gamma: Circulations of the particles.
+        vx, vz: Induced velocities of the particles.
+    """
+    def __init__(self, N=64):
+        """Inits VortexParticles with room for N particles."""
+        self.n = 0
+        self.far = False
+        self.x = np.zeros(N)
+        self.z = np.zeros(N)
+        self.gamma = np.zeros(N)
+        self.vx = np.zeros(0)
+        self.vz = np.zeros(0)
+
+    def append(self, x, z, gamma):
+        """Adds a particle, doubling the size of the arrays when they are full."""
+        if self.n == self.x.size:
+            self.x = np.append(self.x, np.zeros(self.x.size))
+            self.z = np.append(self.z, np.zeros(self.z.size))
+            self.gamma = np.append(self.gamma, np.zeros(self.gamma.size))
+        self.x[self.n] = x
+        self.z[self.n] = z
+        self.gamma[self.n] = gamma
+        self.n += 1
+
+    def remove(self, keep):
+        """Removes the particles where the boolean array keep is False."""
+        m = np.count_nonzero(keep)
+        self.x[:m] = self.x[:self.n][keep]
+        self.z[:m] = self.z[:self.n][keep]
+        self.gamma[:m] = self.gamma[:self.n][keep]
+        self.x[m:self.n] = 0.
+        self.z[m:self.n] = 0.
+        self.gamma[m:self.n] = 0.
+        self.n = m
 
 class Body(object):
     """An arrangement of source/doublet panels in the shape of a swimming body.
 
+    The positions, surface kinematics, pressures and forces of all bodies are
+    updated together by SchoolState, in the arrays the bodies' own are views of.
+
     Attributes:
         N: Number of body panels.
         S: Parameter for shifting collocation points into the body.
         BF: A collection of various body-frame coordinates.
         AF: A collection of various absolute-frame coordinates.
+        geom: Panel vectors, lengths and points for the current AF nodes.
         MP: A collection of parameters describing the motion of the swimmer.
         V0: The free-stream velocity (included in MP as well).
         vx, vz: X- and Z-components of body-frame surface velocities.
@@ -155,7 +261,11 @@ class Body(object):
         gamma: Circulations at the body panel endpoints.
         p: Surface pressures of the body panels.
         cp: Surface pressure coefficients of the body panels.
-        mu_past: mu arrays from previous time steps for backwards differencing.
+        mu_past: mu arrays from previous time steps for backwards differencing
+            (a view of mu_hist).
+        dl_op: Sparse operator that differentiates along the body's surface.
+        dl_op_lpanel: Panel lengths the differentiation operator was built for.
+        dl_op_npts: Stencil size the differentiation operator was built for.
     """
     def __init__(self, N, S, BodyFrameCoordinates, MotionParameters):
         """Inits Body with all necessary parameters."""
@@ -168,6 +278,8 @@ class Body(object):
         # Initialize absolute-frame panel coordinates:
         # x, z, x_col, z_col, x_mid, z_mid, x_neut, z_neut
         self.AF = PC.BodyAFC(N)
+        # Panel geometry, built whenever the absolute-frame nodes move
+        self.geom = None
         # Prescribed motion
         self.MP = MotionParameters
         self.V0 = MotionParameters.V0
@@ -188,7 +300,10 @@ class Body(object):
         self.p_us = np.zeros(N)
         self.p = np.zeros(N)
         self.cp = np.zeros(N)
-        self.mu_past = np.zeros((4,N))
+        self.mu_hist = HistoryBuffer(4, (N,), 4)
+        self.dl_op = None
+        self.dl_op_lpanel = None
+        self.dl_op_npts = 0
         
         self.Cf = 0.
         self.Cl = 0.
@@ -198,6 +313,10 @@ class Body(object):
         self.D_visc = 0.
         self.Cpow = 0.
         self.forceData = np.zeros((0,7))
+
+    @property
+    def mu_past(self):
+        return self.mu_hist.view()
         
     @classmethod
     def from_van_de_vooren(cls, GeoVDVParameters, MotionParameters):
@@ -403,56 +522,32 @@ class Body(object):
 
         return(x_neut, z_neut)
 
-    def panel_positions(self, P, i):
-        """Updates all the absolute-frame coordinates of the body.
-
-        Args:
-            DSTEP: Small incremental distance to pass into neutral_axis().
-            T: Time of current step.
-            THETA: Current pitching angle.
+    def update_geometry(self):
+        """Rebuilds the panel geometry from the absolute-frame nodes.
 
+        Must be called whenever AF.x or AF.z change outside of SchoolState,
+        which updates the geometry of all bodies at once. Also refreshes the
+        absolute-frame midpoints and collocation points, which are taken from
+        the new geometry.
         """
-        T = P['T'][i]
-        THETA = P['THETA'][i]
-        HEAVE = P['HEAVE'][i]
-        bfx = self.BF.x
-        bfz = self.BF.z
-        
-        afx = bfx * np.cos(THETA) - bfz * np.sin(THETA) + self.AF.x_le
-        afz = bfx * np.sin(THETA) + bfz * np.cos(THETA) + HEAVE
-
-        (x_neut, z_neut) = self.neutral_axis(bfx, T, THETA, HEAVE)
-
-        # Absolute-frame panel midpoint positions
-        x_mid = (afx[:-1]+afx[1:])/2
-        z_mid = (afz[:-1]+afz[1:])/2
-
         # Collocation points are the points where impermeable boundary condition is forced
         # They should be shifted inside or outside of the boundary depending on the dirichlet or neumann condition
         # Shifting surface collocation points some percent of the height from the neutral axis
-        # Normal vectors point outward but positive S is inward, so the shift must be subtracted from the panel midpoints
-        afx_col = x_mid - self.S*panel_vectors(afx, afz)[2]*np.absolute(self.zcval) #bfz_col
-        afz_col = z_mid - self.S*panel_vectors(afx, afz)[3]*np.absolute(self.zcval)
-
-        self.AF.x = afx
-        self.AF.z = afz
-        self.AF.x_col = afx_col
-        self.AF.z_col = afz_col
-        self.AF.x_mid[0,:] = x_mid
-        self.AF.z_mid[0,:] = z_mid
-        self.AF.x_neut = x_neut
-        self.AF.z_neut = z_neut
+        self.geom = PC.PanelGeometry(self.AF.x, self.AF.z, self.S*np.absolute(self.zcval))
+
+        self.AF.x_col[:] = self.geom.x_col
+        self.AF.z_col[:] = self.geom.z_col
+        self.AF.x_mid[0,:] = self.geom.x_mid
+        self.AF.z_mid[0,:] = self.geom.z_mid
         
     def fsi_panel_positions(self, FSI, P, i):
         T     = P['T'][i]
         THETA = P['THETA'][i]
         HEAVE = P['HEAVE'][i]
         
-        self.AF.x = self.AF.x + (FSI.fluidNodeDispl[:,0] - FSI.fluidNodeDisplOld[:,0])
-        self.AF.z = self.AF.z + (FSI.fluidNodeDispl[:,1] - FSI.fluidNodeDisplOld[:,1])                 
-
-        self.AF.x_mid[0,:] = (self.AF.x[:-1] + self.AF.x[1:])/2
-        self.AF.z_mid[0,:] = (self.AF.z[:-1] + self.AF.z[1:])/2
+        self.AF.x += (FSI.fluidNodeDispl[:,0] - FSI.fluidNodeDisplOld[:,0])
+        self.AF.z += (FSI.fluidNodeDispl[:,1] - FSI.fluidNodeDisplOld[:,1])                 
+        self.update_geometry()
 
         self.BF.x = (self.AF.x - self.AF.x_le) * np.cos(-1*THETA) - (self.AF.z - self.AF.z_le) * np.sin(-1*THETA)
         self.BF.z = (self.AF.z - self.AF.z_le) * np.cos(-1*THETA) + (self.AF.x - self.AF.x_le) * np.sin(-1*THETA)
@@ -461,180 +556,29 @@ class Body(object):
 
         (self.AF.x_neut, self.AF.z_neut) = self.neutral_axis(self.BF.x, T, THETA, HEAVE)
 
-        self.AF.x_col = self.AF.x_mid[0,:] - self.S*panel_vectors(self.AF.x, self.AF.z)[2]*np.absolute(self.zcval) #self.BF.z_col
-        self.AF.z_col = self.AF.z_mid[0,:] - self.S*panel_vectors(self.AF.x, self.AF.z)[3]*np.absolute(self.zcval)
-
-    def surface_kinematics(self, P, i):
-        """Calculates the body-frame surface velocities of body panels.
+    def surface_derivative(self, stencil_npts=5):
+        """Returns the operator that differentiates along the body's surface.
 
-        Also finds the body panel source strengths based on these surface
-        velocities.
+        The operator only depends on the panel lengths, so it is kept for as
+        long as they stay the same (the whole run for a rigid body) and is
+        reassembled when they change (flexible bodies).
 
         Args:
-            DSTEP, TSTEP: Incremental distance/time passed into neutral_axis().
-            DEL_T: Time step length.
-            T: Time of current step.
-            i: Time step number.
-            THETA_MINUS: Pitching angle minus a small time difference (TSTEP)
-            THETA_PLUS: Pitching angle plus a small time difference (TSTEP)
-        """
-        TSTEP       = P['TSTEP']
-        THETA_MINUS = P['THETA_MINUS'][i]
-        THETA_PLUS  = P['THETA_PLUS'][i]
-        HEAVE_MINUS = P['HEAVE_MINUS'][i]
-        HEAVE_PLUS  = P['HEAVE_PLUS'][i]
-        DEL_T       = P['DEL_T']
-        T           = P['T'][i]     
-        
-        if i == 0:
-            # Use the prescribed kinematics to do a central difference over a 
-            # small period of time
-            x_col = self.BF.x_col
-            z_col = self.BF.z_col
-            
-            xp = x_col * np.cos(THETA_PLUS) - z_col * np.sin(THETA_PLUS) + self.V*(T+TSTEP)
-            zp = x_col * np.sin(THETA_PLUS) + z_col * np.cos(THETA_PLUS) + HEAVE_PLUS
-            
-            xm = x_col * np.cos(THETA_MINUS) - z_col * np.sin(THETA_MINUS) + self.V*(T-TSTEP)
-            zm = x_col * np.sin(THETA_MINUS) + z_col * np.cos(THETA_MINUS) + HEAVE_MINUS
-            
-            self.vx = (xp - xm) / (2. * TSTEP) - self.V
-            self.vz = (zp - zm) / (2. * TSTEP)
-
-        elif i == 1:
-            # First-order backwards differencing of body collocation point positions
-            self.vx = (self.AF.x_mid[0,:]-self.AF.x_mid[1,:])/DEL_T - self.V
-            self.vz = (self.AF.z_mid[0,:]-self.AF.z_mid[1,:])/DEL_T
-            
-        elif i == 2 or i == 3:
-            # Second-order backwards differencing of body collocation point positions
-            self.vx = (3*self.AF.x_mid[0,:]-4*self.AF.x_mid[1,:]+self.AF.x_mid[2,:])/(2*DEL_T) - self.V
-            self.vz = (3*self.AF.z_mid[0,:]-4*self.AF.z_mid[1,:]+self.AF.z_mid[2,:])/(2*DEL_T)
+            stencil_npts: Number of points in the finite difference stencil.
 
-        else:
-            # Fourth-order backwards differencing of body collocation point positions
-            self.vx = (25/12*self.AF.x_mid[0,:] - 4*self.AF.x_mid[1,:] + 3*self.AF.x_mid[2,:] - 4/3*self.AF.x_mid[3,:] + 1/4*self.AF.x_mid[4,:]) / DEL_T - self.V
-            self.vz = (25/12*self.AF.z_mid[0,:] - 4*self.AF.z_mid[1,:] + 3*self.AF.z_mid[2,:] - 4/3*self.AF.z_mid[3,:] + 1/4*self.AF.z_mid[4,:]) / DEL_T
-
-        # Body source strengths with normal vector pointing outward (overall sigma pointing outward)
-        (nx,nz) = panel_vectors(self.AF.x,self.AF.z)[2:4]
-        self.sigma = nx*(self.V + self.vx) + nz*self.vz    
-
-    def pressure(self, P, i, stencil_npts=5):
-        """Calculates the pressure distribution along the body's surface.
-
-        Args:
-            RHO: Fluid density.
-            DEL_T: Time step length.
-            i: Time step number.
+        Returns:
+            dl_op: Sparse differentiation operator (see diff_operator()).
         """
-        RHO          = P['RHO']
-        DEL_T        = P['DEL_T']
-        SW_4PRESSURE = P['SW_4PRESSURE']
+        lpanel = self.geom.lpanel
+        if (self.dl_op is None or self.dl_op_npts != stencil_npts or
+            (lpanel is not self.dl_op_lpanel and
+             np.max(np.absolute(lpanel - self.dl_op_lpanel)) > 1e-12 * np.max(lpanel))):
+            self.dl_op = diff_operator(lpanel, stencil_npts)
+            self.dl_op_lpanel = lpanel
+            self.dl_op_npts = stencil_npts
 
-        (tx,tz,nx,nz,lpanel) = panel_vectors(self.AF.x,self.AF.z)
-        
-        # Defining stencil
-        if (stencil_npts == 5):
-            stencil_chordwise = np.zeros((self.N, 5),dtype=int)
-            stencil_chordwise[0:2,:] = np.array([[0, 1, 2, 3, 4], [-1, 0, 1, 2, 3]])
-            stencil_chordwise[2:-2,:] = np.tile(np.array([-2, -1, 0, 1, 2]), (self.N-4, 1))
-            stencil_chordwise[-2:,:] = np.array([[-3, -2, -1, 0, 1], [-4, -3, -2, -1, 0]])
-        else:
-            if (stencil_npts != 3):
-                print '+-----------------------------------------------------------------------------+'
-                print '| WARNING! There are only three- and five-point stencils available.           |'
-                print '|          Defaulting to the three-point stencil.                             |'
-                print '+-----------------------------------------------------------------------------+'
-            stencil_chordwise = np.zeros((self.N, 3))
-            stencil_chordwise[0,:] = np.array([0, 1, 2])
-            stencil_chordwise[1:-1,:] = np.repeat(np.array([-1, 0, 1]), self.N-2, axis=0)
-            stencil_chordwise[-1,:] = np.array([-2, -1, 0])
-        
-        # Tangential panel velocity dmu/dl
-        dmu_dl = np.empty(self.N)
-        for j in xrange(self.N):
-            # Defining stencil depending on chordwise element
-            stencil = np.copy(stencil_chordwise[j,:])
-            pan_elem = j + stencil
-            
-            # Calling finite difference approximations based on stencil (3-point and 5-point available)
-            dmu_dl[j] = finite_diff(self.mu[pan_elem], lpanel[pan_elem], stencil)
-
-        # Potential change dmu/dt, second-order differencing after first time step
-        if i == 0:
-            dmu_dt = self.mu / DEL_T
-        elif i == 1:
-            dmu_dt = (self.mu - self.mu_past[0,:])/DEL_T
-        elif (i > 3 and SW_4PRESSURE):
-            dmu_dt = ((25. / 12.) * self.mu - 4. * self.mu_past[0,:] + 3. * self.mu_past[1,:] - (4. / 3.) * self.mu_past[2,:] + (1. / 4.) * self.mu_past[3,:]) / DEL_T
-        else:
-            dmu_dt = (3.*self.mu - 4.*self.mu_past[0,:] + self.mu_past[1,:])/(2.*DEL_T)
-            
-        # Unsteady pressure calculation (from Matlab code)
-        qpx_tot = dmu_dl*tx + self.sigma*nx
-        qpz_tot = dmu_dl*tz + self.sigma*nz
-
-        self.p_s  = -RHO*(qpx_tot**2 + qpz_tot**2)/2.
-        self.p_us = RHO*dmu_dt + RHO*(qpx_tot*(self.V+self.vx) + qpz_tot*self.vz)
-        self.p    = self.p_s + self.p_us
-        self.cp   = self.p / (0.5*RHO*self.V**2)
-        
-    def force(self, P, i):
-        """Calculates drag and lift forces acting on the body.
+        return self.dl_op
 
-        Args:
-            RHO (float): Fluid density
-            C (float): Body's chord length
-            B (float): Body's Span length
-            i: Time step number.
-        """
-        C             = P['C']
-        B             = P['B']
-        RHO           = P['RHO']
-        CD_BOD        = P['CD_BOD']
-        S_W           = P['S_W']
-        NU            = P['NU']
-        L_T           = P['L_T']
-        SW_ADDED_DRAG = P['SW_ADDED_DRAG']
-        DRAG_LAW      = P['DRAG_LAW']
-        SW_SPRING     = P['SW_SPRING']
-        H_DOT         = P['H_DOT'][i]
-        (tx,tz,nx,nz,lpanel) = panel_vectors(self.AF.x, self.AF.z)
-
-        delFx = -self.p * lpanel * B * nx
-        delFz = -self.p * lpanel * B * nz
-        delF = np.array([delFx, delFz])
-        delP = np.sum(-delF * np.array([self.vx.T, self.vz.T]), 1)
-        
-        force = np.sum(delF,1)
-        lift = force[1]
-        thrust = -force[0]
-        if SW_SPRING:
-            power = -H_DOT * lift
-        else:
-            power = np.sum(delP, 0)
-        
-        if SW_ADDED_DRAG:
-            if DRAG_LAW == 'FORM':
-                D_add = 0.5 * CD_BOD * RHO * S_W * self.V**2
-            elif DRAG_LAW == 'BLASIUS':
-                D_add = CD_BOD * RHO * S_W * np.absolute(self.V**1.5 * (NU / L_T)**0.5)
-            else:
-                print 'ERROR: Invalid drag law "%s"' % DRAG_LAW
-                print 'Valid trag laws are:'
-                print '    "FORM"'
-                print '    "BLASIUS"'
-                raise ValueError('Invalid drag law "%s"' % DRAG_LAW)
-            
-            net_thrust = force[0] - np.sign(self.V) * D_add
-            self.Ct_net = -net_thrust / (0.5 * RHO * np.absolute(self.V)**2 * C * B)
-        
-        self.Cf = np.sqrt(force[0]**2 + force[1]**2) / (0.5 * RHO * np.absolute(self.V)**2 * C * B)
-        self.Cl = lift /(0.5 * RHO * np.absolute(self.V)**2 * C * B)
-        self.Ct = thrust / (0.5 * RHO * np.absolute(self.V)**2 * C * B)
-        self.Cpow = power /  (0.5 * RHO * np.absolute(self.V)**3 * C * B)
-        
     def free_swimming(self, P, i):
         """Determines the free-swimming velocity.
         
@@ -0,0 +1,138 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+BEM-2D
+A 2D boundary element method code
+
+"""
+import numpy as np
+
+# Fourier transforms of the zero-padded Green's function, by grid size and
+# spacing, reused while the grid only moves with the bodies
+GREEN = {}
+
+def fft_size(n):
+    """Returns the smallest even number of the form 2**a * 3**b * 5**c that
+    is at least n, for which FFTs are fast."""
+    size = 2*n
+    for p2 in 2**np.arange(1, int(np.ceil(np.log2(max(n, 2)))) + 1):
+        for p3 in 3**np.arange(int(np.ceil(np.log(n) / np.log(3))) + 1):
+            p = p2 * p3
+            while p < n:
+                p *= 5
+            size = min(size, p)
+    return int(size)
+
+def m4_weights(s):
+    """
+    Returns the M4' interpolation weights of the four grid nodes around each
+    point. s holds the points' distances from the first of the four nodes, in
+    grid spacings (between 1 and 2). The kernel conserves circulation and its
+    first two moments.
+    """
+    d = np.absolute(s[:,np.newaxis] - np.arange(4))
+    return np.where(d < 1., 1. - 2.5*d**2 + 1.5*d**3,
+                    np.where(d < 2., 0.5*(2. - d)**2*(1. - d), 0.))
+
+class VortexInCell(object):
+    'Velocity of point vortices from a stream function on a uniform grid'
+    def __init__(self, x0, z0, h, nx, nz, DELTA_CORE=0.):
+        """
+        Initializes a grid of nx by nz nodes with spacing h, whose first node
+        is at (x0, z0).
+
+        With a vortex core radius, the Green's function is
+        log(r**2 + DELTA_CORE**2)/(4*pi), whose gradient is the regularized
+        kernel of Katz-Plotkin eqns 10.9 and 10.10 used for direct sums.
+
+        Attributes:
+            x0, z0 (float): Position of the first grid node.
+            h (float): Grid spacing.
+            nx, nz (int): Number of grid nodes in each direction.
+            shape (int): Size of the zero-padded grid, at least 2*nx-1 by
+                2*nz-1 so that the FFTs' circular convolution is the
+                free-space (unbounded) one.
+            green (complex): Fourier transform of the Green's function on the
+                zero-padded grid.
+        """
+        self.x0 = x0
+        self.z0 = z0
+        self.h = h
+        self.nx = nx
+        self.nz = nz
+
+        self.shape = (fft_size(2*nx-1), fft_size(2*nz-1))
+
+        key = (nx, nz, h, DELTA_CORE)
+        if key not in GREEN:
+            # Distances on the padded grid, wrapped around
+            (mx, mz) = self.shape
+            kx = np.minimum(np.arange(mx), mx - np.arange(mx)) * h
+            kz = np.minimum(np.arange(mz), mz - np.arange(mz)) * h
+            r2 = kx[:,np.newaxis]**2 + kz**2 + DELTA_CORE**2
+            if DELTA_CORE == 0.:
+                r2[0,0] = 1.
+            green = np.log(r2) / (4*np.pi)
+            if DELTA_CORE == 0.:
+                # Average of log(r)/(2*pi) over a disk with the cell's area
+                green[0,0] = (np.log(h / np.sqrt(np.pi)) - 0.5) / (2*np.pi)
+            GREEN[key] = np.fft.rfft2(green)
+        self.green = GREEN[key]
+
+    def inside(self, x, z):
+        """
+        Returns True for the points whose M4' stencil and velocity stencil
+        lie inside the grid.
+        """
+        (sx, sz) = ((x - self.x0) / self.h, (z - self.z0) / self.h)
+        return ((sx >= 2.) & (sx < self.nx - 3.) & (sz >= 2.) & (sz < self.nz - 3.))
+
+    def stencil(self, x, z):
+        """Returns the flat grid indices and M4' weights (n by 16) of points."""
+        (sx, sz) = ((x - self.x0) / self.h, (z - self.z0) / self.h)
+        (ix, iz) = (np.floor(sx).astype(int) - 1, np.floor(sz).astype(int) - 1)
+        (wx, wz) = (m4_weights(sx - ix), m4_weights(sz - iz))
+        idx = ((ix[:,np.newaxis] + np.arange(4))[:,:,np.newaxis] * self.nz +
+               (iz[:,np.newaxis] + np.arange(4))[:,np.newaxis,:])
+        weights = wx[:,:,np.newaxis] * wz[:,np.newaxis,:]
+        return(idx.reshape(-1, 16), weights.reshape(-1, 16))
+
+    def velocity(self, xs, zs, gs, xt, zt):
+        """
+        Evaluates the velocity induced by point vortices at target points.
+
+        The circulations are spread onto the grid with the M4' kernel. The
+        stream function psi, which satisfies laplacian(psi) = vorticity with
+        this code's sign convention (Katz-Plotkin eqns 10.9 and 10.10), is
+        the convolution of the grid circulations with the Green's function,
+        evaluated with zero-padded FFTs. The grid velocity (dpsi/dz,
+        -dpsi/dx) from central differences is interpolated back to the
+        targets with the same kernel.
+
+        Sources and targets must be inside() the grid. The result is
+        accurate for targets a few grid spacings from the sources, and
+        smoothed at the grid scale closer to them.
+
+        Args:
+            xs, zs (float): Point vortex coordinates.
+            gs (float): Point vortex circulations.
+            xt, zt (float): Target point coordinates.
+
+        Returns:
+            vx, vz (float): Induced velocity components at the targets.
+        """
+        (nx, nz, h) = (self.nx, self.nz, self.h)
+        (idx, weights) = self.stencil(xs, zs)
+        circulation = np.bincount(idx.ravel(), (weights * gs[:,np.newaxis]).ravel(), nx*nz)
+
+        padded = np.zeros(self.shape)
+        padded[:nx,:nz] = circulation.reshape(nx, nz)
+        psi = np.fft.irfft2(np.fft.rfft2(padded) * self.green, self.shape)[:nx,:nz]
+
+        u = np.zeros((nx, nz))
+        w = np.zeros((nx, nz))
+        u[:,1:-1] = (psi[:,2:] - psi[:,:-2]) / (2*h)
+        w[1:-1,:] = -(psi[2:,:] - psi[:-2,:]) / (2*h)
+
+        (idx, weights) = self.stencil(xt, zt)
+        return(np.sum(u.ravel()[idx] * weights, 1), np.sum(w.ravel()[idx] * weights, 1))
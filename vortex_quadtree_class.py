@@ -0,0 +1,135 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+BEM-2D
+A 2D boundary element method code
+
+"""
+import numpy as np
+
+class QuadtreeNode(object):
+    'A square cell of a VortexQuadtree and the expansion of its vortices'
+    def __init__(self, idx, center, half, radius, coeffs):
+        """
+        Initializes a cell. Children are added by VortexQuadtree.build().
+
+        Attributes:
+            idx (int): Indices of the point vortices inside the cell.
+            center (complex): Center of the cell and of its expansion.
+            half (float): Half of the cell's side length.
+            radius (float): Distance from the center to the farthest vortex.
+            coeffs (complex): Multipole coefficients (orders 0 to p-1).
+            children (list): Non-empty sub-cells, none if the cell is a leaf.
+        """
+        self.idx = idx
+        self.center = center
+        self.half = half
+        self.radius = radius
+        self.coeffs = coeffs
+        self.children = []
+
+class VortexQuadtree(object):
+    'Barnes-Hut evaluator for the velocity induced by regularized point vortices'
+    def __init__(self, x, z, gamma, order, leaf_size):
+        """
+        Sorts the point vortices into a quadtree and computes the multipole
+        expansion of every cell.
+
+        Args:
+            x, z (float): Point vortex coordinates.
+            gamma (float): Point vortex circulations.
+            order (int): Number of terms kept in each expansion.
+            leaf_size (int): Maximum number of vortices in a leaf cell.
+
+        Attributes:
+            z_s (complex): Point vortex positions.
+            gamma (float): Point vortex circulations.
+            order (int): Number of terms kept in each expansion.
+            leaf_size (int): Maximum number of vortices in a leaf cell.
+            root (QuadtreeNode): Cell containing all the vortices.
+        """
+        self.z_s = x + 1j*z
+        self.gamma = gamma
+        self.order = order
+        self.leaf_size = leaf_size
+
+        (x_min, x_max, z_min, z_max) = (np.min(x), np.max(x), np.min(z), np.max(z))
+        half = 0.5 * max(x_max - x_min, z_max - z_min)
+        center = 0.5*(x_min + x_max) + 0.5j*(z_min + z_max)
+        # Cells smaller than this are not split (coincident vortices)
+        self.min_half = 1e-12 * max(half, 1.)
+        self.root = self.build(np.arange(self.z_s.size), center, half)
+
+    def build(self, idx, center, half):
+        """
+        Creates the cell holding the vortices idx and, recursively, its
+        sub-cells.
+
+        The velocity of point vortices far from the cell's center c is
+        (u - i*v) = i/(2*pi) * sum(coeffs[k] / (z - c)**(k+1)), k = 0 to p-1,
+        with coeffs[k] = sum(gamma * (z_s - c)**k).
+        """
+        dz = self.z_s[idx] - center
+        powers = np.ones((idx.size, self.order), dtype=complex)
+        if self.order > 1:
+            powers[:,1:] = np.cumprod(np.repeat(dz[:,np.newaxis], self.order-1, 1), axis=1)
+        Node = QuadtreeNode(idx, center, half, np.max(np.absolute(dz)), np.dot(self.gamma[idx], powers))
+
+        if (idx.size > self.leaf_size and half > self.min_half):
+            quadrant = (np.real(dz) >= 0.).astype(int) + 2*(np.imag(dz) >= 0.).astype(int)
+            for (q, offset) in enumerate([-1-1j, 1-1j, -1+1j, 1+1j]):
+                sub = idx[quadrant == q]
+                if sub.size > 0:
+                    Node.children.append(self.build(sub, center + 0.5*half*offset, 0.5*half))
+
+        return Node
+
+    def velocity(self, xt, zt, theta, DELTA_CORE):
+        """
+        Evaluates the velocity induced by all the vortices at target points.
+
+        A cell's expansion is used for the targets farther than radius/theta
+        from its center, and farther than DELTA_CORE/theta**(order/2) so that
+        the regularization's effect is as small as the truncation error. Its
+        far-field velocity is also scaled by r**2/(r**2+DELTA_CORE**2) at the
+        center distance r. Vortices in leaf cells that are too close are
+        summed directly with Katz-Plotkin eqns 10.9 and 10.10.
+
+        Args:
+            xt, zt (float): Target point coordinates.
+            theta (float): Opening angle; smaller values are more accurate.
+            DELTA_CORE (float): Vortex core radius.
+
+        Returns:
+            vx, vz (float): Induced velocity components at the targets.
+        """
+        z_t = xt + 1j*zt
+        w = np.zeros(z_t.size, dtype=complex)
+        if self.z_s.size > 0:
+            r_core = DELTA_CORE * theta**(-0.5*self.order)
+            self.evaluate(self.root, np.arange(z_t.size), z_t, w, theta, DELTA_CORE, r_core)
+
+        return(np.real(w), -np.imag(w))
+
+    def evaluate(self, Node, targets, z_t, w, theta, DELTA_CORE, r_core):
+        """Adds a cell's conjugate velocity (u - i*v) at the targets to w."""
+        d = z_t[targets] - Node.center
+        r = np.absolute(d)
+        far = (r*theta > Node.radius) & (r > r_core)
+        if np.any(far):
+            inv_d = 1. / d[far]
+            s = np.zeros(inv_d.size, dtype=complex)
+            for c in Node.coeffs[::-1]:
+                s = (s + c) * inv_d
+            w[targets[far]] += 1j*s / (2*np.pi) * r[far]**2 / (r[far]**2 + DELTA_CORE**2)
+
+        near = targets[~far]
+        if near.size == 0:
+            return
+
+        if not Node.children:
+            dz = z_t[near,np.newaxis] - self.z_s[Node.idx]
+            w[near] += 1j*np.dot(np.conj(dz) / (np.absolute(dz)**2 + DELTA_CORE**2), self.gamma[Node.idx]) / (2*np.pi)
+        else:
+            for Child in Node.children:
+                self.evaluate(Child, near, z_t, w, theta, DELTA_CORE, r_core)
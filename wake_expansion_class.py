@@ -0,0 +1,242 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+BEM-2D
+A 2D boundary element method code
+
+"""
+import numpy as np
+
+class WakeCluster(object):
+    'A run of consecutive far wake panels and their multipole expansion'
+    def __init__(self, j0, j1, level):
+        """
+        Initializes an empty cluster. The expansion is computed by build().
+
+        Attributes:
+            j0, j1 (int): Range of the cluster's panels counted from the oldest
+                active panel (0). Unlike the wake array indices these stay
+                the same from one time step to the next, as long as no
+                panels are removed (see WakeExpansion.remove()).
+            level (int): Number of times the cluster has been merged.
+            nodes (complex): Panel endpoints the expansion was built for.
+            mu (float): Doublet strengths the expansion was built for, None
+                if the expansion is out of date.
+            center (complex): Expansion center.
+            radius (float): Distance from the center to the farthest node.
+            coeffs (complex): Multipole coefficients (orders 1 to p).
+        """
+        self.j0 = j0
+        self.j1 = j1
+        self.level = level
+        self.nodes = None
+        self.mu = None
+        self.center = 0.
+        self.radius = 0.
+        self.coeffs = None
+
+    def build(self, nodes, mu, order):
+        """
+        Computes the multipole expansion of the cluster's doublet panels.
+
+        A chain of constant strength doublet panels is equivalent to point
+        vortices at its nodes with strengths mu[k-1] - mu[k], which sum to
+        zero. The potential at a point z far from the cluster is then
+        Im(sum(coeffs[m-1] / (z - center)**m)) / (2*pi), m = 1 to order.
+
+        Args:
+            nodes (complex): Panel endpoints of the cluster.
+            mu (float): Doublet strengths of the cluster's panels.
+            order (int): Number of terms kept in the expansion.
+        """
+        self.nodes = nodes
+        self.mu = mu
+        self.center = np.mean(nodes)
+        self.radius = np.max(np.absolute(nodes - self.center))
+
+        gamma = np.zeros(nodes.size)
+        gamma[1:] += mu
+        gamma[:-1] -= mu
+        powers = np.cumprod(np.repeat((nodes - self.center)[:,np.newaxis], order, 1), axis=1)
+        self.coeffs = np.dot(gamma, powers) / np.arange(1, order+1)
+
+    def evaluate(self, z):
+        """
+        Evaluates the expansion at target points outside the cluster.
+
+        Args:
+            z (complex): Target points.
+
+        Returns:
+            phi (float): Potential induced by the cluster's panels.
+        """
+        w = 1. / (z - self.center)
+        s = np.zeros(z.shape, dtype=complex)
+        for c in self.coeffs[::-1]:
+            s = (s + c) * w
+
+        return(np.imag(s) / (2*np.pi))
+
+class WakeExpansion(object):
+    'Multipole expansions of a wake\'s far panels, kept between time steps'
+    def __init__(self, order, theta, n_near, cluster_size, tol):
+        """
+        Initializes the far-wake expansions of a single wake. Clusters are
+        created as panels age past the near wake and are kept for the rest of
+        the simulation. A cluster is only rebuilt when panels join it or its
+        panels move by more than tol times its radius (wake rollup).
+
+        Args:
+            order (int): Number of terms kept in each expansion.
+            theta (float): A cluster's expansion is only used at targets
+                farther than radius/theta from its center.
+            n_near (int): Number of newest wake panels that are always
+                evaluated directly.
+            cluster_size (int): Number of panels in a new cluster. Two
+                neighbouring clusters of the same size are merged when the
+                result is well separated from every target (see merge()).
+            tol (float): Allowed node movement, relative to the cluster's
+                radius, before a cluster is rebuilt.
+
+        Attributes:
+            clusters (list): WakeCluster objects, oldest panels first.
+            n_builds (int): Number of cluster expansions computed so far.
+        """
+        self.order = order
+        self.theta = theta
+        self.n_near = n_near
+        self.cluster_size = cluster_size
+        self.tol = tol
+        self.clusters = []
+        self.n_builds = 0
+
+    def update(self, Wake, z_t):
+        """
+        Brings the clusters up to date with the wake's active panels.
+
+        Args:
+            Wake (object): The Wake the expansions describe.
+            z_t (complex): Target points the expansions will be evaluated at.
+        """
+        n_far = max(Wake.n - self.n_near, 0)
+        # Drop clusters past the end of the wake (restarts, amalgamated panels)
+        while (self.clusters and self.clusters[-1].j1 > n_far):
+            self.clusters.pop()
+
+        # Rebuild clusters whose panels have moved or changed
+        for Cl in self.clusters:
+            if Cl.mu is None:
+                self.build(Wake, Cl)
+                continue
+            (nodes, mu) = self.panels(Wake, Cl)
+            if (not np.array_equal(mu, Cl.mu) or
+                np.max(np.absolute(nodes - Cl.nodes)) > self.tol * Cl.radius):
+                self.build(Wake, Cl)
+
+        # Add the panels that have left the near wake since the last update
+        j = self.clusters[-1].j1 if self.clusters else 0
+        while j < n_far:
+            Cl = self.clusters[-1] if self.clusters else None
+            if (Cl is not None and Cl.level == 0 and Cl.j1 - Cl.j0 < self.cluster_size):
+                Cl.j1 = min(Cl.j0 + self.cluster_size, n_far)
+            else:
+                Cl = WakeCluster(j, min(j + self.cluster_size, n_far), 0)
+                self.clusters.append(Cl)
+            self.build(Wake, Cl)
+            j = Cl.j1
+
+        self.merge(Wake, z_t)
+
+    def merge(self, Wake, z_t):
+        """
+        Merges neighbouring full clusters of the same size into one, as long
+        as the merged cluster is well separated from every target. Clusters
+        that are too close to the bodies now are tried again at later steps.
+
+        Args:
+            Wake (object): The Wake the expansions describe.
+            z_t (complex): Target points the expansions will be evaluated at.
+        """
+        k = 0
+        while k < len(self.clusters) - 1:
+            (Cl0, Cl1) = self.clusters[k:k+2]
+            size = self.cluster_size * 2**Cl0.level
+            if (Cl0.level != Cl1.level or Cl0.j1 - Cl0.j0 != size or Cl1.j1 - Cl1.j0 != size):
+                k += 1
+                continue
+
+            # Bound the merged cluster's radius before building its expansion
+            center = 0.5 * (Cl0.center + Cl1.center)
+            radius = 0.5 * np.absolute(Cl0.center - Cl1.center) + max(Cl0.radius, Cl1.radius)
+            if np.min(np.absolute(z_t - center)) * self.theta <= radius:
+                k += 1
+                continue
+
+            Merged = WakeCluster(Cl0.j0, Cl1.j1, Cl0.level + 1)
+            self.build(Wake, Merged)
+            self.clusters[k:k+2] = [Merged]
+            k = max(k-1, 0)
+
+    def remove(self, j0, j1):
+        """
+        Accounts for the removal of the wake panels j0 to j1 (counted from
+        the oldest active panel, as WakeCluster.j0 and j1), so that every
+        cluster keeps describing the same panels. Newer clusters are shifted,
+        clusters whose panels were all removed are dropped, and a cluster
+        that lost some of its panels is marked for rebuilding by update().
+
+        Args:
+            j0, j1 (int): Range of the removed panels.
+        """
+        def shift(j):
+            return j if j <= j0 else max(j - (j1 - j0), j0)
+
+        clusters = []
+        for Cl in self.clusters:
+            (c0, c1) = (shift(Cl.j0), shift(Cl.j1))
+            if c0 == c1:
+                continue
+            if c1 - c0 != Cl.j1 - Cl.j0:
+                Cl.mu = None
+            (Cl.j0, Cl.j1) = (c0, c1)
+            clusters.append(Cl)
+        self.clusters = clusters
+
+    def panels(self, Wake, Cl):
+        """
+        Returns the current nodes (as complex numbers) and doublet strengths
+        of a cluster's panels, in wake array order.
+        """
+        (k0, k1) = (Wake.n - Cl.j1, Wake.n - Cl.j0)
+        return(Wake.x[k0:k1+1] + 1j*Wake.z[k0:k1+1], np.copy(Wake.mu[k0:k1]))
+
+    def build(self, Wake, Cl):
+        """Computes a cluster's expansion from the current wake."""
+        (nodes, mu) = self.panels(Wake, Cl)
+        Cl.build(nodes, mu, self.order)
+        self.n_builds += 1
+
+    def evaluate(self, Wake, z_t):
+        """
+        Evaluates the far-wake potential at the targets.
+
+        Args:
+            Wake (object): The Wake the expansions describe.
+            z_t (complex): Target points.
+
+        Returns:
+            phi (float): Potential induced by the clusters at the targets
+                that are well separated from them.
+            direct (list): (k0, k1, targets) tuples of wake panel ranges and
+                boolean target masks that still need direct evaluation.
+        """
+        phi = np.zeros(z_t.size)
+        direct = []
+        for Cl in self.clusters:
+            far = np.absolute(z_t - Cl.center) * self.theta > Cl.radius
+            if np.any(far):
+                phi[far] += Cl.evaluate(z_t[far])
+            if not np.all(far):
+                direct.append((Wake.n - Cl.j1, Wake.n - Cl.j0, ~far))
+
+        return(phi, direct)